@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+import threading
+
+
+# Keyvault secret names per datastore type, in the AUTH section of the datastore config
+DATASTORE_SECRETS: Dict[str, List[str]] = {
+    "BLOB": ["ACCOUNT_KEY_SECRET"],
+    "ADLS2": ["TENANT_ID_SECRET", "SP_CLIENT_ID_SECRET", "SP_SECRET_SECRET"],
+    "SQL": ["PASSWORD_SECRET"]
+}
+
+
+class DatastoreClient(ABC):
+    # Workspace operations used by datastore_setup. get_* return None when the entry does not exist,
+    # so the provisioning logic does not depend on AzureML exceptions and can run against a fake.
+    # Implementations are called from several threads at once.
+
+    @abstractmethod
+    def get_datastore(self, datastore_name):
+        ...
+
+    @abstractmethod
+    def register_datastore(self, datastore_dict, secrets):
+        # secrets: keyvault secret name -> value, for the secrets in DATASTORE_SECRETS of the type
+        ...
+
+    @abstractmethod
+    def get_dataset(self, dataset_name):
+        ...
+
+    @abstractmethod
+    def register_dataset(self, datastore, datastore_type, dataset_name, dataset_dict):
+        ...
+
+    @abstractmethod
+    def get_secrets(self, secret_names):
+        # secret name -> value, in one round trip where the backend supports it
+        ...
+
+    @abstractmethod
+    def list_datastores(self):
+        # names of all datastores in the workspace, one listing call
+        ...
+
+    @abstractmethod
+    def list_datasets(self):
+        # names of all registered datasets in the workspace, one listing call
+        ...
+
+
+class AzureMLDatastoreClient(DatastoreClient):
+    # the AzureML SDK is imported by the methods, so datastore_setup --fake_client runs without it
+
+    def __init__(self, ws):
+        self.ws = ws
+        # Keyvault linked to AzureML Workspace
+        self.kv = ws.get_default_keyvault()
+
+    def get_datastore(self, datastore_name):
+        from azureml.core import Datastore
+        from azureml.exceptions import UserErrorException
+        try:
+            return Datastore.get(self.ws, datastore_name=datastore_name)
+        except UserErrorException:
+            return None
+
+    def register_datastore(self, datastore_dict, secrets):
+        from azureml.core import Datastore
+        auth_dict: Dict[str, str] = datastore_dict["AUTH"]
+
+        if datastore_dict["TYPE"] == "BLOB":
+            return Datastore.register_azure_blob_container(
+                workspace=self.ws,
+                datastore_name=datastore_dict["DATASTORE_NAME"],
+                account_name=datastore_dict["STORAGE_NAME"],
+                container_name=datastore_dict["CONTAINER"],
+                account_key=secrets[auth_dict["ACCOUNT_KEY_SECRET"]]
+            )
+        elif datastore_dict["TYPE"] == "ADLS2":
+            return Datastore.register_azure_data_lake_gen2(
+                workspace=self.ws,
+                datastore_name=datastore_dict["DATASTORE_NAME"],
+                account_name=datastore_dict["STORAGE_NAME"],
+                filesystem=datastore_dict["CONTAINER"],
+                tenant_id=secrets[auth_dict["TENANT_ID_SECRET"]],
+                client_id=secrets[auth_dict["SP_CLIENT_ID_SECRET"]],
+                client_secret=secrets[auth_dict["SP_SECRET_SECRET"]]
+            )
+        elif datastore_dict["TYPE"] == "SQL":
+            return Datastore.register_azure_sql_database(
+                workspace=self.ws,
+                datastore_name=datastore_dict["DATASTORE_NAME"],
+                server_name=auth_dict["SERVER"],
+                database_name=auth_dict["DATABASE"],
+                username=auth_dict["USERNAME"],
+                password=secrets[auth_dict["PASSWORD_SECRET"]]
+            )
+        raise ValueError(f"Unsupported datastore type '{datastore_dict['TYPE']}'")
+
+    def get_dataset(self, dataset_name):
+        from azureml.core import Dataset
+        from azureml.exceptions import UserErrorException
+        try:
+            return Dataset.get_by_name(self.ws, name=dataset_name)
+        except UserErrorException:
+            return None
+
+    def register_dataset(self, datastore, datastore_type, dataset_name, dataset_dict):
+        from azureml.core import Dataset
+        from azureml.data import FileDataset, TabularDataset
+        if dataset_dict["TYPE"] == "file":
+            # create File dataset
+            dataset: FileDataset = Dataset.File.from_files((datastore, dataset_dict["PATH"]))
+        elif datastore_type != "SQL" and dataset_dict["PATH"].endswith(".parquet"):
+            # parquet files, e.g. the intermediate outputs of the pipeline steps
+            dataset: TabularDataset = Dataset.Tabular.from_parquet_files((datastore, dataset_dict["PATH"]))
+        elif datastore_type != "SQL":
+            # if datastore type is not SQL, use Path
+            dataset: TabularDataset = Dataset.Tabular.from_delimited_files((datastore, dataset_dict["PATH"]))
+        else:
+            # if datastore type is SQL, use Query
+            dataset: TabularDataset = Dataset.Tabular.from_sql_query((datastore, dataset_dict["QUERY"]))
+
+        return dataset.register(self.ws, name=dataset_name)
+
+    def get_secrets(self, secret_names):
+        # one keyvault call for all secrets
+        return self.kv.get_secrets(secrets=list(secret_names))
+
+    def list_datastores(self):
+        return list(self.ws.datastores)
+
+    def list_datasets(self):
+        from azureml.core import Dataset
+        return list(Dataset.get_all(self.ws).keys())
+
+
+class SecretCache:
+    # Memoized keyvault lookups, shared by all provisioning threads.
+    # prefetch() batches the secrets of every datastore that has to be registered into one call,
+    # get() only goes to the keyvault for secrets that were not prefetched.
+
+    def __init__(self, client):
+        self.client = client
+        self.secrets: Dict[str, str] = {}
+        self.lookups: int = 0
+        self.lock = threading.Lock()
+
+    def prefetch(self, secret_names):
+        with self.lock:
+            missing: List[str] = sorted(set(secret_names) - set(self.secrets))
+            if missing:
+                self.lookups += 1
+                self.secrets.update(self.client.get_secrets(missing))
+
+    def get(self, secret_names):
+        self.prefetch(secret_names)
+        return {name: self.secrets[name] for name in secret_names}
@@ -26,7 +26,7 @@ DATASTORE_CONFIG = [
             },
             "ds-titanic-preprocessed-tabular": {
                 "TYPE": "tabular",
-                "PATH": "ml/preprocessed/titanic_dataset.csv"
+                "PATH": "ml/preprocessed/titanic_dataset.parquet"
             }
         } 
     }
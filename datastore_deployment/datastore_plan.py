@@ -0,0 +1,75 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from datetime import datetime as dt
+import json
+import time
+import os
+
+
+def take_snapshot(client, workspace_key):
+    ## WORKSPACE SNAPSHOT
+    # two listing calls instead of one get per datastore and dataset
+    return {
+        "workspace": workspace_key,
+        "created": time.time(),
+        "datastores": sorted(client.list_datastores()),
+        "datasets": sorted(client.list_datasets())
+    }
+
+
+def load_snapshot(path, workspace_key, ttl_s):
+    # cached snapshot of the same workspace that is younger than ttl_s, otherwise None
+    if ttl_s <= 0 or not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        snapshot: Dict[str, Any] = json.load(f)
+
+    if snapshot.get("workspace") != workspace_key or time.time() - snapshot["created"] > ttl_s:
+        return None
+    return snapshot
+
+
+def save_snapshot(path, snapshot):
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    # written next to the target and renamed, concurrent CI jobs never read a partial file
+    tmp_path: str = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def create_plan(datastore_config, snapshot):
+    ## PLAN
+    # the part of the config that is missing from the snapshot, in the same format as DATASTORE_CONFIG:
+    #   datastores that do not exist, with the datasets to create
+    #   existing datastores with at least one dataset to create, with only those datasets
+    existing_datastores: Set[str] = set(snapshot["datastores"])
+    existing_datasets: Set[str] = set(snapshot["datasets"])
+
+    plan: List[Dict[str, Any]] = []
+    for datastore_dict in datastore_config:
+        datasets: Dict[str, Dict[str, Any]] = {name: dataset_dict for name, dataset_dict in datastore_dict["DATASETS"].items()
+                                               if name not in existing_datasets}
+        if datastore_dict["DATASTORE_NAME"] not in existing_datastores or datasets:
+            plan.append({**datastore_dict, "DATASETS": datasets})
+
+    return plan
+
+
+def print_plan(plan, snapshot, datastore_config):
+    existing_datastores: Set[str] = set(snapshot["datastores"])
+    n_entries: int = sum(1 + len(datastore_dict["DATASETS"]) for datastore_dict in datastore_config)
+    n_changes: int = 0
+
+    print(f"[{dt.now()}] Plan against the workspace snapshot of {dt.fromtimestamp(snapshot['created'])}:")
+    for datastore_dict in plan:
+        if datastore_dict["DATASTORE_NAME"] not in existing_datastores:
+            print(f"    + {datastore_dict['TYPE']} Datastore '{datastore_dict['DATASTORE_NAME']}'")
+            n_changes += 1
+        for dataset_name, dataset_dict in datastore_dict["DATASETS"].items():
+            print(f"    + {dataset_dict['TYPE'].capitalize()}Dataset '{dataset_name}' on '{datastore_dict['DATASTORE_NAME']}'")
+            n_changes += 1
+
+    print(f"    {n_changes} to create, {n_entries - n_changes} unchanged.")
@@ -1,36 +1,25 @@
-from azureml import data
-from azureml.core import Workspace, Datastore, Dataset, Keyvault
-from azureml.core.authentication import ServicePrincipalAuthentication
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, List, Tuple, Dict, Set, Any, Union
-from azureml.data.azure_data_lake_datastore import AzureDataLakeGen2Datastore
-from azureml.data.azure_sql_database_datastore import AzureSqlDatabaseDatastore
-from azureml.data.azure_storage_datastore import AzureBlobDatastore
-from azureml.exceptions import UserErrorException
-
-from azureml.data import FileDataset, TabularDataset
+from datastore_client import AzureMLDatastoreClient, SecretCache, DATASTORE_SECRETS
+from datastore_plan import take_snapshot, load_snapshot, save_snapshot, create_plan, print_plan
 from datastore_config import *
 from datetime import datetime as dt
+import argparse
+import time
+import sys
 import os
 
+# shared modules in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-def main():
-    # AzureML Workspace
-    ws = Workspace(
-            subscription_id=os.environ["SUBSCRIPTION_ID"],
-            resource_group=os.environ["RESOURCE_GROUP_NAME"],
-            workspace_name=os.environ["WORKSPACE_NAME"],
-        )
 
-    print(f"[{dt.now()}] Interactive authentication successful.")
+DATASTORE_TYPES: List[str] = ["BLOB", "ADLS2", "SQL"]
+DATASET_TYPES: List[str] = ["file", "tabular"]
 
-    # Keyvault linked to AzureML Workspace
-    kv = ws.get_default_keyvault()
-    
-    DATASTORE_TYPES = ["BLOB", "ADLS2", "SQL"]
-    DATASET_TYPES = ["file", "tabular"]
 
+def validate_config(datastore_config):
     # datastore assertions
-    for datastore_dict in DATASTORE_CONFIG:
+    for datastore_dict in datastore_config:
         # assert that datastore types are filled in correctly
         assert datastore_dict["TYPE"] in DATASTORE_TYPES
 
@@ -54,69 +43,199 @@ def main():
             else:
                 assert "PATH" in dataset_dict
 
-    # get/register all datastores and datasets
-    for datastore_dict in DATASTORE_CONFIG:
-        # try to get datastore
+
+def get_secret_names(datastore_dict):
+    # keyvault secrets needed to register the datastore
+    return [datastore_dict["AUTH"][key] for key in DATASTORE_SECRETS[datastore_dict["TYPE"]]]
+
+
+def provision_datastore(client, secret_cache, datastore_dict, datastore):
+    # datastore: result of the existence check, None when the datastore has to be registered
+    if datastore is not None:
+        print(f"[{dt.now()}] Found {datastore_dict['TYPE']} Datastore '{datastore_dict['DATASTORE_NAME']}' in the workspace.")
+        return "existing", datastore
+
+    datastore = client.register_datastore(datastore_dict, secret_cache.get(get_secret_names(datastore_dict)))
+    print(f"[{dt.now()}] Registered '{datastore_dict['DATASTORE_NAME']}' as {datastore_dict['TYPE']} Datastore in the workspace.")
+    return "created", datastore
+
+
+def provision_dataset(client, datastore, datastore_type, dataset_name, dataset_dict):
+    # try to get dataset, otherwise create and register dataset
+    if client.get_dataset(dataset_name) is not None:
+        print(f"[{dt.now()}] Found {dataset_dict['TYPE'].capitalize()}Dataset '{dataset_name}' in the workspace.")
+        return "existing"
+
+    client.register_dataset(datastore, datastore_type, dataset_name, dataset_dict)
+    print(f"[{dt.now()}] Registered '{dataset_name}' as {dataset_dict['TYPE'].capitalize()}Dataset in the workspace.")
+    return "created"
+
+
+def provision(client, datastore_config, max_workers):
+    ## CONCURRENT PROVISIONING
+    # 1. check which datastores exist, in parallel
+    # 2. fetch the secrets of all datastores that have to be registered in one keyvault call
+    # 3. register the missing datastores in parallel, the datasets of a datastore start as soon as it is available
+    # a failing entry is recorded and does not stop the others, datasets of a failed datastore are skipped
+    secret_cache: SecretCache = SecretCache(client)
+    results: List[Dict[str, str]] = []
+
+    def record(kind, name, status, error=None):
+        results.append({"kind": kind, "name": name, "status": status, "error": error})
+        if error is not None:
+            print(f"[{dt.now()}] Failed to provision {kind} '{name}': {error}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        lookups = {pool.submit(client.get_datastore, datastore_dict["DATASTORE_NAME"]): datastore_dict
+                   for datastore_dict in datastore_config}
+        found: Dict[str, Any] = {}
+        for future in as_completed(lookups):
+            datastore_dict = lookups[future]
+            try:
+                found[datastore_dict["DATASTORE_NAME"]] = future.result()
+            except Exception as e:
+                record("datastore", datastore_dict["DATASTORE_NAME"], "failed", repr(e))
+
+        missing: List[Dict[str, Any]] = [datastore_dict for datastore_dict in datastore_config
+                                         if datastore_dict["DATASTORE_NAME"] in found
+                                         and found[datastore_dict["DATASTORE_NAME"]] is None]
         try:
-            datastore = Datastore.get(ws, datastore_name=datastore_dict["DATASTORE_NAME"])
-            print(f"[{dt.now()}] Found {datastore_dict['TYPE']} Datastore '{datastore_dict['DATASTORE_NAME']}' in the workspace.")
-        except UserErrorException:
-            # create and register datastore
-            auth_dict: Dict[str, str] = datastore_dict["AUTH"]
-
-            if datastore_dict["TYPE"] == "BLOB":
-                datastore: AzureBlobDatastore = Datastore.register_azure_blob_container(
-                    workspace=ws,
-                    datastore_name=datastore_dict["DATASTORE_NAME"],
-                    account_name=datastore_dict["STORAGE_NAME"], 
-                    container_name=datastore_dict["CONTAINER"], 
-                    account_key=kv.get_secret(name=auth_dict["ACCOUNT_KEY_SECRET"])
-                )
-            elif datastore_dict["TYPE"] == "ADLS2":
-                datastore: AzureDataLakeGen2Datastore = Datastore.register_azure_data_lake_gen2(
-                    workspace=ws,
-                    datastore_name=datastore_dict["DATASTORE_NAME"],
-                    #subscription_id=os.environ["SUBSCRIPTION_ID"],
-                    #resource_group=os.environ["RESOURCE_GROUP_NAME"], 
-                    account_name=datastore_dict["STORAGE_NAME"],
-                    filesystem=datastore_dict["CONTAINER"], 
-                    tenant_id=kv.get_secret(name=auth_dict["TENANT_ID_SECRET"]), 
-                    client_id=kv.get_secret(name=auth_dict["SP_CLIENT_ID_SECRET"]), 
-                    client_secret=kv.get_secret(name=auth_dict["SP_SECRET_SECRET"])
-                )
-            elif datastore_dict["TYPE"] == "SQL":
-                datastore: AzureSqlDatabaseDatastore = Datastore.register_azure_sql_database(
-                    workspace=ws,
-                    datastore_name=datastore_dict["DATASTORE_NAME"],
-                    server_name=auth_dict["SERVER"],
-                    database_name=auth_dict["DATABASE"],
-                    username=auth_dict["USERNAME"],
-                    password=kv.get_secret(auth_dict["PASSWORD_SECRET"])
-                )
-            print(f"[{dt.now()}] Registered '{datastore_dict['DATASTORE_NAME']}' as {datastore_dict['TYPE']} Datastore in the workspace.")
-
-        # register/get all datasets within the datastore
-        for dataset_name, dataset_dict in datastore_dict["DATASETS"].items():     
-            # try to get dataset, otherwise create and register dataset           
+            secret_cache.prefetch([name for datastore_dict in missing for name in get_secret_names(datastore_dict)])
+        except Exception as e:
+            # e.g. one secret that does not exist, every datastore then fetches its own secrets
+            print(f"[{dt.now()}] Batched keyvault lookup failed, falling back to lookups per datastore: {e!r}")
+
+        registrations = {pool.submit(provision_datastore, client, secret_cache, datastore_dict,
+                                     found[datastore_dict["DATASTORE_NAME"]]): datastore_dict
+                         for datastore_dict in datastore_config if datastore_dict["DATASTORE_NAME"] in found}
+        dataset_tasks = {}
+        for future in as_completed(registrations):
+            datastore_dict = registrations[future]
             try:
-                dataset: Union[TabularDataset, FileDataset] = Dataset.get_by_name(ws, name=dataset_name)
-                print(f"[{dt.now()}] Found {dataset_dict['TYPE'].capitalize()}Dataset '{dataset_name}' in the workspace.")
-            except UserErrorException:
-                if dataset_dict["TYPE"] == "file":
-                    # create File dataset
-                    dataset: FileDataset = Dataset.File.from_files((datastore, dataset_dict["PATH"]))
-                    dataset: FileDataset = dataset.register(ws, name=dataset_name)
-                else:
-                    # create Tabular dataset
-                    if datastore_dict["TYPE"] != "SQL":
-                        # if datastore type is not SQL, use Path
-                        dataset: TabularDataset = Dataset.Tabular.from_delimited_files((datastore, dataset_dict["PATH"]))
-                    else:
-                        # if datastore type is SQL, use Query
-                        dataset: TabularDataset = Dataset.Tabular.from_sql_query((datastore, dataset_dict["QUERY"]))
-                    dataset: TabularDataset = dataset.register(ws, name=dataset_name)
-                print(f"[{dt.now()}] Registered '{dataset_name}' as {dataset_dict['TYPE'].capitalize()}Dataset in the workspace.")
-                
+                status, datastore = future.result()
+            except Exception as e:
+                record("datastore", datastore_dict["DATASTORE_NAME"], "failed", repr(e))
+                for dataset_name in datastore_dict["DATASETS"]:
+                    record("dataset", dataset_name, "skipped")
+                continue
+
+            record("datastore", datastore_dict["DATASTORE_NAME"], status)
+            for dataset_name, dataset_dict in datastore_dict["DATASETS"].items():
+                dataset_future = pool.submit(provision_dataset, client, datastore, datastore_dict["TYPE"],
+                                             dataset_name, dataset_dict)
+                dataset_tasks[dataset_future] = dataset_name
+
+        for future in as_completed(dataset_tasks):
+            try:
+                record("dataset", dataset_tasks[future], future.result())
+            except Exception as e:
+                record("dataset", dataset_tasks[future], "failed", repr(e))
+
+    # datastores whose existence check failed never reach the registration, their datasets are skipped too
+    for datastore_dict in datastore_config:
+        if datastore_dict["DATASTORE_NAME"] not in found:
+            for dataset_name in datastore_dict["DATASETS"]:
+                record("dataset", dataset_name, "skipped")
+
+    return results, secret_cache.lookups
+
+
+def print_summary(results, keyvault_lookups, duration):
+    print(f"[{dt.now()}] Provisioning finished in {duration:.2f}s, {keyvault_lookups} keyvault lookup(s).")
+    for kind in ["datastore", "dataset"]:
+        counts: Dict[str, int] = {status: 0 for status in ["created", "existing", "failed", "skipped"]}
+        for result in results:
+            if result["kind"] == kind:
+                counts[result["status"]] += 1
+        print(f"    {kind + 's':<12} " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+
+    for result in results:
+        if result["status"] == "failed":
+            print(f"    FAILED {result['kind']} '{result['name']}': {result['error']}")
+
+
+def connect_to_workspace():
+    # AzureML Workspace, shared with the other deployment scripts running in the same process
+    # imported here, the session module loads the AzureML SDK, which --fake_client runs without
+    from workspace_session import get_workspace
+    return AzureMLDatastoreClient(get_workspace("interactive"))
+
+
+def get_workspace_key():
+    # identifies the workspace of a cached snapshot, known without connecting to it
+    return "/".join([os.environ["SUBSCRIPTION_ID"], os.environ["RESOURCE_GROUP_NAME"], os.environ["WORKSPACE_NAME"], ENV])
+
+
+def main(client=None, datastore_config=DATASTORE_CONFIG, max_workers=8, mode="provision",
+         snapshot_path=None, snapshot_ttl_s=0, workspace_key=None):
+    # modes:
+    #   provision: check and create every entry of the config
+    #   plan: compare the config with a snapshot of the workspace and print what would be created
+    #   apply: plan, then create only the planned entries
+    # the workspace is only connected to when the snapshot or the plan needs it
+    assert mode in ["provision", "plan", "apply"]
+    validate_config(datastore_config)
+    start: float = time.perf_counter()
+
+    if mode == "provision":
+        client = client or connect_to_workspace()
+        results, keyvault_lookups = provision(client, datastore_config, max_workers)
+        print_summary(results, keyvault_lookups, time.perf_counter() - start)
+        return results
+
+    workspace_key = workspace_key or get_workspace_key()
+    snapshot: Optional[Dict[str, Any]] = load_snapshot(snapshot_path, workspace_key, snapshot_ttl_s) if snapshot_path else None
+    if snapshot is None:
+        client = client or connect_to_workspace()
+        snapshot = take_snapshot(client, workspace_key)
+        print(f"[{dt.now()}] Workspace snapshot: {len(snapshot['datastores'])} datastores, {len(snapshot['datasets'])} datasets.")
+        if snapshot_path:
+            save_snapshot(snapshot_path, snapshot)
+    else:
+        print(f"[{dt.now()}] Using the cached workspace snapshot in {snapshot_path}.")
+
+    plan: List[Dict[str, Any]] = create_plan(datastore_config, snapshot)
+    print_plan(plan, snapshot, datastore_config)
+    if mode == "plan" or not plan:
+        print(f"[{dt.now()}] Finished in {time.perf_counter() - start:.2f}s.")
+        return []
+
+    # planned entries are still checked before they are created, an entry created since the snapshot is reported as existing
+    client = client or connect_to_workspace()
+    results, keyvault_lookups = provision(client, plan, max_workers)
+    print_summary(results, keyvault_lookups, time.perf_counter() - start)
+
+    # created entries are added to the cached snapshot, failed entries are planned again by the next run
+    if snapshot_path:
+        for kind in ["datastore", "dataset"]:
+            provisioned: Set[str] = {result["name"] for result in results
+                                     if result["kind"] == kind and result["status"] in ["created", "existing"]}
+            snapshot[f"{kind}s"] = sorted(set(snapshot[f"{kind}s"]) | provisioned)
+        save_snapshot(snapshot_path, snapshot)
+
+    return results
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', dest='mode', choices=['provision', 'plan', 'apply'], default='apply')
+    parser.add_argument('--max_workers', dest='max_workers', type=int, default=8)
+    parser.add_argument('--snapshot_path', dest='snapshot_path', default=f'outputs/workspace_snapshot_{ENV}.json')
+    # seconds a cached snapshot is used instead of listing the workspace, 0 always lists the workspace
+    parser.add_argument('--snapshot_ttl', dest='snapshot_ttl', type=float, default=900)
+    parser.add_argument('--fake_client', dest='fake_client', action='store_true',
+                        help="provision into an empty in-memory workspace, to validate the config without Azure")
+    args = parser.parse_args()
+
+    client, workspace_key = None, None
+    if args.fake_client:
+        from fake_datastore_client import InMemoryDatastoreClient
+        secret_names: List[str] = [name for datastore_dict in DATASTORE_CONFIG for name in get_secret_names(datastore_dict)]
+        client = InMemoryDatastoreClient(secrets={name: "fake-secret" for name in secret_names})
+        # the in-memory workspace is empty on every run, its snapshot is not cached
+        workspace_key, args.snapshot_path = "in-memory", None
+
+    results = main(client, max_workers=args.max_workers, mode=args.mode, snapshot_path=args.snapshot_path,
+                   snapshot_ttl_s=args.snapshot_ttl, workspace_key=workspace_key)
+    if any(result["status"] in ["failed", "skipped"] for result in results):
+        sys.exit(1)
@@ -0,0 +1,74 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from datastore_client import DatastoreClient
+import threading
+import time
+
+
+class InMemoryDatastoreClient(DatastoreClient):
+    # Stand-in for AzureMLDatastoreClient, keeps datastores, datasets and keyvault secrets in dicts.
+    # Used to run datastore_setup offline, e.g. to validate a config or to measure the provisioning logic.
+    #   latency_s: sleep per call, simulates the workspace round trip
+    #   failures: names of datastores/datasets whose registration raises
+    # Every call is counted in self.calls.
+
+    def __init__(self, secrets=None, datastores=None, datasets=None, latency_s=0.0, failures=None):
+        self.secrets: Dict[str, str] = dict(secrets or {})
+        self.datastores: Dict[str, Dict[str, Any]] = dict(datastores or {})
+        self.datasets: Dict[str, Dict[str, Any]] = dict(datasets or {})
+        self.latency_s = latency_s
+        self.failures: Set[str] = set(failures or [])
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        time.sleep(self.latency_s)
+
+    def get_datastore(self, datastore_name):
+        self._call("get_datastore")
+        with self.lock:
+            return self.datastores.get(datastore_name)
+
+    def register_datastore(self, datastore_dict, secrets):
+        self._call("register_datastore")
+        if datastore_dict["DATASTORE_NAME"] in self.failures:
+            raise RuntimeError(f"Registration of datastore '{datastore_dict['DATASTORE_NAME']}' failed")
+
+        datastore: Dict[str, Any] = {"name": datastore_dict["DATASTORE_NAME"], "type": datastore_dict["TYPE"],
+                                     "secrets": sorted(secrets)}
+        with self.lock:
+            self.datastores[datastore["name"]] = datastore
+        return datastore
+
+    def get_dataset(self, dataset_name):
+        self._call("get_dataset")
+        with self.lock:
+            return self.datasets.get(dataset_name)
+
+    def register_dataset(self, datastore, datastore_type, dataset_name, dataset_dict):
+        self._call("register_dataset")
+        if dataset_name in self.failures:
+            raise RuntimeError(f"Registration of dataset '{dataset_name}' failed")
+
+        dataset: Dict[str, Any] = {"name": dataset_name, "datastore": datastore["name"], **dataset_dict}
+        with self.lock:
+            self.datasets[dataset_name] = dataset
+        return dataset
+
+    def get_secrets(self, secret_names):
+        self._call("get_secrets")
+        missing: List[str] = [name for name in secret_names if name not in self.secrets]
+        if missing:
+            raise KeyError(f"Secrets not found in the keyvault: {missing}")
+        return {name: self.secrets[name] for name in secret_names}
+
+    def list_datastores(self):
+        self._call("list_datastores")
+        with self.lock:
+            return list(self.datastores)
+
+    def list_datasets(self):
+        self._call("list_datasets")
+        with self.lock:
+            return list(self.datasets)
@@ -1,26 +1,72 @@
 from azureml.core import Workspace, Environment
 from azureml.core.webservice import AciWebservice, Webservice, LocalWebservice
 from azureml.core.model import Model, InferenceConfig
+import shutil
+import json
+import sys
+import os
 
-ws = Workspace.from_config()
+# shared modules in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from workspace_session import get_workspace
 
-# Get Model
-model = Model(ws, "titanic_model")
+ws = get_workspace("from_config")
+
+# Get Models
+# one container can host several models/versions, e.g. ACI_MODELS="titanic_model:3,titanic_model:4";
+# a name without version deploys its latest version. Requests select them with "model"/"version".
+model_specs = os.getenv("ACI_MODELS", "titanic_model").split(",")
+models = [Model(ws, spec.split(":")[0], version=int(spec.split(":")[1])) if ":" in spec else Model(ws, spec)
+          for spec in model_specs]
 
 # Create inference config
-entry_script = "model_deployments/entry_scripts/titanic_entry.py"
+# the whole entry_scripts folder is uploaded, so the entry script can import its helper modules,
+# together with the forest engine, which the train step shares through the pipeline's common folder
+source_directory = "outputs/staged_entry_scripts"
+shutil.rmtree(source_directory, ignore_errors=True)
+shutil.copytree("model_deployments/entry_scripts", source_directory, ignore=shutil.ignore_patterns("__pycache__", "*.pyc"))
+shutil.copy("pipelines/train_pipeline/common/forest_engine.py", source_directory)
+entry_script = "titanic_entry.py"
 env_name = "AzureML-sklearn-1.0-ubuntu20.04-py38-cpu"
-env = Environment.get(ws, env_name)
-inference_config = InferenceConfig(entry_script, environment=env)
+env = Environment.get(ws, env_name).clone("titanic-scoring-env")
+
+# request coalescing in the entry script, a window of 0 ms disables it
+env.environment_variables = {
+    "SCORING_BATCH_WINDOW_MS": "2",
+    "SCORING_MAX_BATCH_SIZE": "256",
+    # LRU cache of predictions per feature row, repeated rows skip the model, 0 disables it
+    "SCORING_CACHE_SIZE": "4096",
+    "SCORING_CACHE_TTL_S": "0",
+    # live and shadow version per model name (default: the highest deployed version, no shadow scoring),
+    # memory budget for lazily loaded models (0 is unlimited) and swap/shadow control requests (the service
+    # gets key auth when they are enabled, anyone who can score could otherwise switch the model)
+    "SCORING_LIVE_VERSIONS": os.getenv("SCORING_LIVE_VERSIONS", ""),
+    "SCORING_SHADOW_VERSIONS": os.getenv("SCORING_SHADOW_VERSIONS", ""),
+    "SCORING_MODEL_MEMORY_MB": "0",
+    "SCORING_CONTROL_ENABLED": os.getenv("SCORING_CONTROL_ENABLED", "0"),
+    # sampling profiler of the request threads, GET ?profile on the scoring uri, 0 disables it
+    "SCORING_PROFILER_INTERVAL_MS": "0"
+}
+inference_config = InferenceConfig(entry_script, source_directory=source_directory, environment=env)
 
 # Create deployment config
-deployment_config = AciWebservice.deploy_configuration(cpu_cores = 1, memory_gb = 1)
+# resources measured by model_deployments/testing/load_test.py --sizing_path, 1 core and 1 GB without a measurement
+sizing_path = os.getenv("ACI_SIZING_PATH", "outputs/aci_sizing.json")
+sizing = {"cpu_cores": 1, "memory_gb": 1}
+if os.path.isfile(sizing_path):
+    with open(sizing_path) as f:
+        sizing = json.load(f)
+    print(f"ACI resources from {sizing_path}: {sizing['cpu_cores']} cores, {sizing['memory_gb']} GB")
+# control requests need key auth, send the service key with model_request.py/load_test.py --api_key
+auth_enabled = env.environment_variables["SCORING_CONTROL_ENABLED"] == "1"
+deployment_config = AciWebservice.deploy_configuration(cpu_cores = sizing["cpu_cores"], memory_gb = sizing["memory_gb"],
+                                                       auth_enabled = auth_enabled)
 
 # Deploy model
 service = Model.deploy(
     workspace=ws, 
     name="titanic-aci-model", 
-    models=[model], 
+    models=models, 
     inference_config=inference_config, 
     deployment_config=deployment_config,
     overwrite=True)
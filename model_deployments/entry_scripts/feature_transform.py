@@ -0,0 +1,67 @@
+import json
+import numpy as np
+
+
+class FeatureTransform:
+    # Serving side of the preprocess step: raw passenger records -> model feature matrix.
+    # The spec is written by the preprocess step and registered next to the model, so training and
+    # scoring share the same fill values, categories and column order. The per-column steps are
+    # resolved once at load time, a request only runs vectorized NumPy comparisons.
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.fill_values = spec["fill_values"]
+        self.feature_columns = spec["feature_columns"]
+        self.input_columns = spec["numeric_columns"] + list(spec["categorical_columns"])
+
+        # (input column, category or None for numeric pass-through) for every feature column
+        self.numeric_categories = {}
+        feature_sources = {col: (col, None) for col in spec["numeric_columns"]}
+        for col, categories in spec["categorical_columns"].items():
+            self.numeric_categories[col] = all(isinstance(value, (int, float)) for value in categories)
+            for category in categories[1 if spec["drop_first"] else 0:]:
+                feature_sources[f"{col}_{category}"] = (col, category)
+        self.steps = [feature_sources[feature] for feature in self.feature_columns]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _column(self, records, col):
+        # accepted records:
+        #   [{"Pclass": 3, "Sex": "male", ...}, ...]    list of records
+        #   {"Pclass": [3, 1], "Sex": [...], ...}       columnar records
+        if isinstance(records, dict):
+            values = records.get(col)
+            if values is None:
+                raise ValueError(f"Missing input column: '{col}'")
+        else:
+            values = [record.get(col) for record in records]
+
+        values = [self.fill_values.get(col) if value is None else value for value in values]
+        if any(value is None for value in values):
+            raise ValueError(f"Missing value for '{col}' and no fill value in the preprocessing spec")
+
+        if col in self.numeric_categories and not self.numeric_categories[col]:
+            return np.asarray([str(value) for value in values], dtype=object)
+        return np.asarray(values, dtype=np.float64)
+
+    def transform(self, records):
+        if not isinstance(records, (list, dict)):
+            raise ValueError("'records' must be a list of records or a dict of columns")
+
+        columns = {col: self._column(records, col) for col in self.input_columns}
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+
+        # categories that were not seen in training encode as all zeros, like the dropped first category
+        X = np.empty((n_rows, len(self.steps)), dtype=np.float64)
+        for index, (col, category) in enumerate(self.steps):
+            if category is None:
+                X[:, index] = columns[col]
+            elif self.numeric_categories[col]:
+                X[:, index] = columns[col] == category
+            else:
+                X[:, index] = columns[col] == str(category)
+
+        return X
@@ -0,0 +1,213 @@
+import os
+import glob
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def version_order(version):
+    # registered versions are numbers, other names (e.g. 'local') sort before them
+    return (1, int(version), '') if version.isdigit() else (0, 0, version)
+
+
+def discover_models(base_dir, default_name):
+    # AZUREML_MODEL_DIR holds <name>/<version>/model for every model of a multi-model deployment,
+    # a single model deployment points at the version folder itself
+    if os.path.isdir(os.path.join(base_dir, 'model')):
+        version = os.path.basename(os.path.normpath(base_dir))
+        return {(default_name, version if version.isdigit() else 'local'): os.path.join(base_dir, 'model')}
+
+    model_dirs = {}
+    for model_dir in glob.glob(os.path.join(base_dir, '*', '*', 'model')):
+        version_dir = os.path.dirname(model_dir)
+        model_dirs[(os.path.basename(os.path.dirname(version_dir)), os.path.basename(version_dir))] = model_dir
+    return model_dirs
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def parse_versions(text):
+    # 'titanic_model:3,other_model:1' -> {'titanic_model': '3', 'other_model': '1'}
+    return dict(item.strip().split(':', 1) for item in text.split(',') if item.strip())
+
+
+class HostedModel:
+    # One loaded model version with its preprocessing spec, request batcher and prediction cache.
+
+    def __init__(self, name, version, model, feature_columns, feature_transform=None, batcher=None, prediction_cache=None):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.feature_columns = feature_columns
+        self.feature_transform = feature_transform
+        self.batcher = batcher
+        self.prediction_cache = prediction_cache
+        self.size_bytes = 0
+        self.timings = {}
+
+    @property
+    def key(self):
+        return f"{self.name}:{self.version}"
+
+    def model_predict_proba(self, X):
+        # concurrent requests share one model call when the batcher is enabled
+        if self.batcher is not None:
+            return self.batcher.submit(X)
+        return self.model.predict_proba(X)
+
+    def predict_proba(self, X):
+        # cached rows are answered directly, only the misses reach the model
+        if self.prediction_cache is not None:
+            return self.prediction_cache.predict(X, self.model_predict_proba)
+        return self.model_predict_proba(X)
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+
+class ModelRegistry:
+    # Models hosted by one scoring container, keyed on (name, version).
+    #   live: version served per model name, the highest version unless configured
+    #   shadow: candidate version per model name, scored next to the live version without affecting responses
+    # Versions are loaded on first use with loader(name, version, model_dir) and kept in LRU order, the least
+    # recently used ones are unloaded once the loaded models exceed memory_budget_bytes (0 is unlimited),
+    # versions that are not live or shadow before the others.
+    # swap() loads a version in the background and switches the live version when it is ready, requests
+    # in flight keep the model object they started with.
+
+    def __init__(self, model_dirs, loader, memory_budget_bytes=0, default_name=None, live_versions=None, shadow_versions=None):
+        if not model_dirs:
+            raise ValueError("No models found to host")
+        self.model_dirs = dict(model_dirs)
+        self.loader = loader
+        self.memory_budget = memory_budget_bytes
+
+        names = sorted({name for name, _ in self.model_dirs})
+        self.default_name = default_name if default_name in names else names[0]
+        self.live = {name: max((version for model_name, version in self.model_dirs if model_name == name), key=version_order)
+                     for name in names}
+        self.shadow = {}
+        for name, version in (live_versions or {}).items():
+            self.live[name] = self._check(name, version)[1]
+        for name, version in (shadow_versions or {}).items():
+            self.shadow[name] = self._check(name, version)[1]
+
+        self.loaded = OrderedDict()
+        self.unloads = 0
+        self._lock = threading.Lock()
+        self._load_locks = {key: threading.Lock() for key in self.model_dirs}
+        self._swaps = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-swap')
+
+    def _check(self, name, version):
+        if (name, version) not in self.model_dirs:
+            hosted = [f"{model_name}:{model_version}" for model_name, model_version in sorted(self.model_dirs)]
+            raise KeyError(f"Model '{name}' version '{version}' is not hosted here, available: {hosted}")
+        return name, version
+
+    def resolve(self, name=None, version=None):
+        name = name or self.default_name
+        if name not in self.live:
+            raise KeyError(f"Model '{name}' is not hosted here, available: {sorted(self.live)}")
+        return self._check(name, str(version) if version else self.live[name])
+
+    def get(self, name=None, version=None):
+        key = self.resolve(name, version)
+        with self._lock:
+            hosted = self.loaded.get(key)
+            if hosted is not None:
+                self.loaded.move_to_end(key)
+                return hosted
+
+        # one load per version, concurrent requests for the same version wait for it
+        with self._load_locks[key]:
+            with self._lock:
+                hosted = self.loaded.get(key)
+            if hosted is None:
+                hosted = self.loader(key[0], key[1], self.model_dirs[key])
+                hosted.size_bytes = directory_size(self.model_dirs[key])
+                with self._lock:
+                    self.loaded[key] = hosted
+                    self._unload_over_budget(keep=key)
+                print(f"[{datetime.now()}] Loaded model {key[0]}:{key[1]} ({hosted.size_bytes / 1024 ** 2:.1f} MB)")
+
+        with self._lock:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+        return hosted
+
+    def _unload_over_budget(self, keep):
+        if self.memory_budget <= 0:
+            return
+        # versions that are neither live nor shadow go first, e.g. the previous version after a swap
+        serving = set(self.live.items()) | set(self.shadow.items())
+        candidates = [key for key in self.loaded if key not in serving] + [key for key in self.loaded if key in serving]
+        for key in candidates:
+            if sum(hosted.size_bytes for hosted in self.loaded.values()) <= self.memory_budget:
+                break
+            if key == keep:
+                continue
+            # requests holding the model finish with it, the memory is released afterwards
+            self.loaded.pop(key).close()
+            self.unloads += 1
+            print(f"[{datetime.now()}] Unloaded model {key[0]}:{key[1]}, over the memory budget")
+
+    def get_shadow(self, name):
+        with self._lock:
+            version = self.shadow.get(name)
+        if version is None or version == self.live.get(name):
+            return None
+        return self.get(name, version)
+
+    def set_shadow(self, name, version=None):
+        # version None stops shadow scoring of the model
+        with self._lock:
+            if version is None:
+                self.shadow.pop(name, None)
+            else:
+                self.shadow[name] = self._check(name, str(version))[1]
+
+    def swap(self, name, version):
+        # returns a future, done once the new version is loaded and live
+        key = self._check(name, str(version))
+
+        def load_and_switch():
+            start = time.perf_counter()
+            self.get(*key)
+            with self._lock:
+                previous = self.live[name]
+                self.live[name] = key[1]
+            print(f"[{datetime.now()}] Swapped model {name} from version {previous} to {key[1]} "
+                  f"in {time.perf_counter() - start:.2f}s")
+            return previous
+
+        return self._swaps.submit(load_and_switch)
+
+    def status(self):
+        with self._lock:
+            return {
+                'default': self.default_name,
+                'live': dict(self.live),
+                'shadow': dict(self.shadow),
+                'hosted': [f"{name}:{version}" for name, version in sorted(self.model_dirs)],
+                'loaded': [{'model': f"{name}:{version}", 'size_mb': round(hosted.size_bytes / 1024 ** 2, 2)}
+                           for (name, version), hosted in self.loaded.items()],
+                'memory_budget_mb': round(self.memory_budget / 1024 ** 2, 2),
+                'unloads': self.unloads
+            }
+
+    def cache_stats(self):
+        with self._lock:
+            return {hosted.key: hosted.prediction_cache.stats() for hosted in self.loaded.values()
+                    if hosted.prediction_cache is not None}
+
+    def close(self):
+        self._swaps.shutdown(wait=True)
+        with self._lock:
+            for hosted in self.loaded.values():
+                hosted.close()
+            self.loaded.clear()
@@ -0,0 +1,94 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class PredictionCache:
+    # Bounded LRU cache of predicted probabilities, keyed on the bytes of the float64 feature row.
+    # predict() looks up every row of a batch and only sends the misses to the model, rows repeated
+    # within a batch are predicted once. Entries expire after ttl_s seconds (0 keeps them until evicted).
+    # The cache belongs to one model version, init() creates a new one when a model is loaded.
+
+    def __init__(self, max_entries, ttl_s=0.0, model_version=None):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self.model_version = model_version
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        proba, expires_at = entry
+        if self.ttl > 0 and now > expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return proba
+
+    def _put(self, key, proba, now):
+        self._entries[key] = (proba, now + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def predict(self, X, predict_fn):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        keys = [row.tobytes() for row in X]
+
+        # row indices per missing key, the first one is sent to the model
+        cached, pending = {}, {}
+        with self._lock:
+            now = time.monotonic()
+            for index, key in enumerate(keys):
+                proba = self._get(key, now)
+                if proba is not None:
+                    cached[index] = proba
+                else:
+                    pending.setdefault(key, []).append(index)
+            self.misses += len(pending)
+            self.hits += len(keys) - len(pending)
+
+        if not pending:
+            return np.stack([cached[index] for index in range(len(keys))])
+
+        # the model call runs outside the lock, concurrent requests only wait for each other on lookups
+        miss_proba = predict_fn(X[[indices[0] for indices in pending.values()]])
+        proba = np.empty((len(keys), miss_proba.shape[1]), dtype=miss_proba.dtype)
+        for index, row_proba in cached.items():
+            proba[index] = row_proba
+
+        with self._lock:
+            now = time.monotonic()
+            for (key, indices), row_proba in zip(pending.items(), miss_proba):
+                proba[indices] = row_proba
+                self._put(key, row_proba.copy(), now)
+
+        return proba
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'model_version': self.model_version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
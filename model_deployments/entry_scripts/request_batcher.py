@@ -0,0 +1,88 @@
+import threading
+import time
+import numpy as np
+
+
+class PendingRequest:
+    def __init__(self, X):
+        self.X = X
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RequestBatcher:
+    # Coalesces concurrent requests into one model call.
+    # The first waiting request opens a window of window_ms milliseconds, every request that
+    # arrives within that window (up to max_batch_size rows) is scored with the same call.
+
+    def __init__(self, predict_fn, window_ms=2.0, max_batch_size=256):
+        self.predict_fn = predict_fn
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self._pending = []
+        self._closed = False
+        self._lock = threading.Condition()
+        self._worker = threading.Thread(target=self._loop, name="request-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, X):
+        # blocks until the batch containing X has been scored, returns the rows belonging to X
+        request = PendingRequest(X)
+        with self._lock:
+            if self._closed:
+                # a request that picked up the model before it was unloaded is scored on its own
+                return self.predict_fn(X)
+            self._pending.append(request)
+            self._lock.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        # the worker scores the requests still pending and then exits
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+
+    def _next_batch(self):
+        with self._lock:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._lock.wait()
+
+            deadline = time.perf_counter() + self.window
+            while sum(len(request.X) for request in self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+
+            # take whole requests until the batch is full, a single oversized request is still taken
+            batch, rows = [], 0
+            while self._pending and (not batch or rows + len(self._pending[0].X) <= self.max_batch_size):
+                request = self._pending.pop(0)
+                batch.append(request)
+                rows += len(request.X)
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                result = self.predict_fn(np.concatenate([request.X for request in batch]))
+                offsets = np.cumsum([0] + [len(request.X) for request in batch])
+                for request, start, end in zip(batch, offsets[:-1], offsets[1:]):
+                    request.result = result[start:end]
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
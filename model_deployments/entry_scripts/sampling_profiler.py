@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+
+
+# functions in root_dir where a thread of the entry scripts parks while it has no work, e.g. the request
+# batcher waiting for requests; a thread blocked in a threading wait directly below one of them is idle
+IDLE_FRAMES = ['request_batcher._next_batch']
+
+
+class SamplingProfiler:
+    # Statistical profiler for the scoring hot path.
+    # A daemon thread samples the stacks of all other threads every interval_ms milliseconds. Only stacks
+    # passing through a file in root_dir (the entry scripts) are counted, so idle server threads are left out,
+    # as are the entry scripts' own threads while they wait in one of idle_frames.
+    # Request threads waiting for their batch are counted, that wait is part of the request latency.
+    # folded() returns the counts in the folded stack format read by flamegraph.pl and speedscope.
+
+    def __init__(self, root_dir, interval_ms=5.0, max_stacks=10000, idle_frames=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.interval = interval_ms / 1000
+        self.max_stacks = max_stacks
+        self.idle_frames = set(IDLE_FRAMES if idle_frames is None else idle_frames)
+        self.idle_samples = 0
+
+        self.samples = 0
+        self.stacks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            # innermost frame first, waiting means blocked in threading's Condition/Event wait
+            waiting = frame.f_code.co_name == 'wait' and frame.f_code.co_filename == threading.__file__
+            stack, root_frame = [], None
+            while frame is not None:
+                code = frame.f_code
+                name = f"{os.path.splitext(os.path.basename(code.co_filename))[0]}.{code.co_name}"
+                if root_frame is None and code.co_filename.startswith(self.root_dir):
+                    root_frame = name
+                stack.append(name)
+                frame = frame.f_back
+            if root_frame is None:
+                continue
+            if waiting and root_frame in self.idle_frames:
+                with self._lock:
+                    self.idle_samples += 1
+                continue
+
+            key = ';'.join(reversed(stack))
+            with self._lock:
+                self.samples += 1
+                # the number of distinct stacks is bounded, new stacks beyond it are counted together
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = 'other'
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def folded(self, limit=None):
+        # most sampled stacks first, one 'frame;frame;frame count' line per stack
+        with self._lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks[:limit]) + '\n'
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.folded())
@@ -0,0 +1,194 @@
+import os
+import time
+import bisect
+import platform
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not reported there
+    resource = None
+
+
+# upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS_S = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096]
+
+# stages of a scoring request, 'total' covers the whole run() call
+STAGES = ['decode', 'predict', 'encode', 'total']
+
+METRIC_PREFIX = 'titanic_scoring'
+
+
+class Histogram:
+    # Fixed bucket histogram, counts[i] holds the observations <= buckets[i] and > buckets[i - 1].
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-quantile, None for the +Inf bucket
+        if self.count == 0:
+            return None
+        rank, cumulative = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def exposition(self, name, labels=''):
+        separator = ',' if labels else ''
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+def process_stats():
+    # CPU seconds and peak memory of the scoring process, the numbers ACI cpu_cores/memory_gb are sized on
+    times = os.times()
+    peak_rss_bytes = None
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peak_rss_bytes = max_rss if platform.system() == 'Darwin' else max_rss * 1024
+    return {'cpu_seconds': times.user + times.system, 'peak_rss_bytes': peak_rss_bytes, 'cpu_count': os.cpu_count()}
+
+
+class ScoringMetrics:
+    # In-process metrics of the scoring service, shared by all request threads:
+    #   requests per model, request format and status code, scored rows,
+    #   batch size histogram and latency histograms per stage (decode, predict, encode, total).
+    # Exposed as JSON (to_dict) or in the Prometheus text exposition format (exposition).
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.rows = 0
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.latency = {stage: Histogram(LATENCY_BUCKETS_S) for stage in STAGES}
+        self.startup = {}
+        # ModelRegistry and ShadowScorer of the entry script, for the prediction cache and shadow scoring stats
+        self.registry = None
+        self.shadow_scorer = None
+
+    def count_request(self, request_format, status_code, model=''):
+        with self.lock:
+            key = (model, request_format, status_code)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def observe_batch(self, rows):
+        with self.lock:
+            self.rows += rows
+            self.batch_size.observe(rows)
+
+    def observe_latency(self, stage, seconds):
+        with self.lock:
+            self.latency[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        # only successful stages are observed, failures show up in the request counts
+        start = time.perf_counter()
+        yield
+        self.observe_latency(stage, time.perf_counter() - start)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'uptime_s': round(time.time() - self.started, 1),
+                'requests': [{'model': model, 'format': request_format, 'status': status_code, 'count': count}
+                             for (model, request_format, status_code), count in sorted(self.requests.items())],
+                'rows': self.rows,
+                'batch_size': {'count': self.batch_size.count, 'mean': self.batch_size.sum / max(self.batch_size.count, 1),
+                               'p50': self.batch_size.quantile(0.5), 'p99': self.batch_size.quantile(0.99)},
+                'latency_s': {stage: {'count': histogram.count, 'mean': histogram.sum / max(histogram.count, 1),
+                                      'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95),
+                                      'p99': histogram.quantile(0.99)}
+                              for stage, histogram in self.latency.items()},
+                'startup_ms': dict(self.startup),
+                'cache': self.registry.cache_stats() if self.registry is not None else {},
+                'shadow': self.shadow_scorer.summary() if self.shadow_scorer is not None else {},
+                'process': process_stats()
+            }
+
+    def exposition(self):
+        with self.lock:
+            lines = [f'# HELP {METRIC_PREFIX}_requests_total Scoring requests by model, request format and status code.',
+                     f'# TYPE {METRIC_PREFIX}_requests_total counter']
+            for (model, request_format, status_code), count in sorted(self.requests.items()):
+                lines.append(f'{METRIC_PREFIX}_requests_total{{model="{model}",format="{request_format}",status="{status_code}"}} {count}')
+
+            lines += [f'# HELP {METRIC_PREFIX}_rows_total Rows scored.',
+                      f'# TYPE {METRIC_PREFIX}_rows_total counter',
+                      f'{METRIC_PREFIX}_rows_total {self.rows}']
+
+            lines += [f'# HELP {METRIC_PREFIX}_batch_size Rows per scoring request.',
+                      f'# TYPE {METRIC_PREFIX}_batch_size histogram']
+            lines += self.batch_size.exposition(f'{METRIC_PREFIX}_batch_size')
+
+            lines += [f'# HELP {METRIC_PREFIX}_latency_seconds Request latency by stage.',
+                      f'# TYPE {METRIC_PREFIX}_latency_seconds histogram']
+            for stage, histogram in self.latency.items():
+                lines += histogram.exposition(f'{METRIC_PREFIX}_latency_seconds', f'stage="{stage}"')
+
+            lines += [f'# HELP {METRIC_PREFIX}_startup_milliseconds Time spent in init() by stage.',
+                      f'# TYPE {METRIC_PREFIX}_startup_milliseconds gauge']
+            for stage, value in self.startup.items():
+                lines.append(f'{METRIC_PREFIX}_startup_milliseconds{{stage="{stage}"}} {value}')
+
+        cache_stats = self.registry.cache_stats() if self.registry is not None else {}
+        if cache_stats:
+            lines += [f'# HELP {METRIC_PREFIX}_cache_lookups_total Prediction cache lookups by model and result, one per row.',
+                      f'# TYPE {METRIC_PREFIX}_cache_lookups_total counter']
+            for model, stats in cache_stats.items():
+                lines += [f'{METRIC_PREFIX}_cache_lookups_total{{model="{model}",result="hit"}} {stats["hits"]}',
+                          f'{METRIC_PREFIX}_cache_lookups_total{{model="{model}",result="miss"}} {stats["misses"]}']
+            lines += [f'# HELP {METRIC_PREFIX}_cache_removals_total Prediction cache entries removed by model and reason.',
+                      f'# TYPE {METRIC_PREFIX}_cache_removals_total counter']
+            for model, stats in cache_stats.items():
+                lines += [f'{METRIC_PREFIX}_cache_removals_total{{model="{model}",reason="evicted"}} {stats["evictions"]}',
+                          f'{METRIC_PREFIX}_cache_removals_total{{model="{model}",reason="expired"}} {stats["expirations"]}']
+            lines += [f'# HELP {METRIC_PREFIX}_cache_entries Entries in the prediction cache by model.',
+                      f'# TYPE {METRIC_PREFIX}_cache_entries gauge']
+            lines += [f'{METRIC_PREFIX}_cache_entries{{model="{model}"}} {stats["entries"]}' for model, stats in cache_stats.items()]
+
+        shadow_stats = self.shadow_scorer.summary() if self.shadow_scorer is not None else {}
+        if shadow_stats:
+            lines += [f'# HELP {METRIC_PREFIX}_shadow_rows_total Rows scored by shadow models, by agreement with the live model.',
+                      f'# TYPE {METRIC_PREFIX}_shadow_rows_total counter']
+            for model, stats in shadow_stats.items():
+                lines += [f'{METRIC_PREFIX}_shadow_rows_total{{model="{model}",result="agreed"}} {stats["agreed_rows"]}',
+                          f'{METRIC_PREFIX}_shadow_rows_total{{model="{model}",result="disagreed"}} {stats["rows"] - stats["agreed_rows"]}']
+            lines += [f'# HELP {METRIC_PREFIX}_shadow_requests_total Shadow scoring requests by model and result.',
+                      f'# TYPE {METRIC_PREFIX}_shadow_requests_total counter']
+            for model, stats in shadow_stats.items():
+                lines += [f'{METRIC_PREFIX}_shadow_requests_total{{model="{model}",result="{result}"}} {stats[field]}'
+                          for result, field in [('scored', 'requests'), ('dropped', 'dropped'), ('failed', 'errors')]]
+
+        stats = process_stats()
+        lines += ['# HELP process_cpu_seconds_total User and system CPU time of the scoring process.',
+                  '# TYPE process_cpu_seconds_total counter',
+                  f'process_cpu_seconds_total {stats["cpu_seconds"]}']
+        if stats['peak_rss_bytes'] is not None:
+            lines += ['# HELP process_peak_resident_memory_bytes Peak resident memory of the scoring process.',
+                      '# TYPE process_peak_resident_memory_bytes gauge',
+                      f'process_peak_resident_memory_bytes {stats["peak_rss_bytes"]}']
+        return '\n'.join(lines) + '\n'
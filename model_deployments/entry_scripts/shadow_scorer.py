@@ -0,0 +1,59 @@
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ShadowScorer:
+    # Scores requests with a candidate model version after the live response has been computed.
+    # Shadow predictions run on a background thread and never change or delay responses, requests are
+    # dropped when more than max_pending are waiting. Per candidate it records how often its predictions
+    # agree with the live version and the mean absolute difference of the probabilities.
+
+    def __init__(self, max_pending=64):
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-scorer')
+
+    def _record(self, key):
+        return self.stats.setdefault(key, {'requests': 0, 'rows': 0, 'agreed_rows': 0, 'abs_diff_sum': 0.0,
+                                           'seconds': 0.0, 'dropped': 0, 'errors': 0})
+
+    def submit(self, hosted, X, live_proba):
+        key = f"{hosted.name}:{hosted.version}"
+        if not self._pending.acquire(blocking=False):
+            with self._lock:
+                self._record(key)['dropped'] += 1
+            return
+
+        def score():
+            try:
+                start = time.perf_counter()
+                proba = hosted.predict_proba(X)
+                seconds = time.perf_counter() - start
+                agreed = int(np.sum(np.argmax(proba, axis=1) == np.argmax(live_proba, axis=1)))
+                with self._lock:
+                    record = self._record(key)
+                    record['requests'] += 1
+                    record['rows'] += len(X)
+                    record['agreed_rows'] += agreed
+                    record['abs_diff_sum'] += float(np.abs(proba[:, -1] - live_proba[:, -1]).sum())
+                    record['seconds'] += seconds
+            except Exception:
+                with self._lock:
+                    self._record(key)['errors'] += 1
+            finally:
+                self._pending.release()
+
+        self._executor.submit(score)
+
+    def summary(self):
+        with self._lock:
+            return {key: {**record,
+                          'agreement': round(record['agreed_rows'] / record['rows'], 4) if record['rows'] else None,
+                          'mean_abs_diff': round(record['abs_diff_sum'] / record['rows'], 6) if record['rows'] else None}
+                    for key, record in self.stats.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -1,27 +1,338 @@
+import time
+IMPORT_START = time.perf_counter()
+
 import os
-import pickle
+import io
 import json
+import traceback
 import numpy as np
+from datetime import datetime
+from azureml.contrib.services.aml_request import rawhttp
+from azureml.contrib.services.aml_response import AMLResponse
+from forest_engine import ArrayForest
+from feature_transform import FeatureTransform
+from scoring_metrics import ScoringMetrics
+from model_registry import ModelRegistry, HostedModel, discover_models, parse_versions
+from shadow_scorer import ShadowScorer
+
+IMPORT_TIME = time.perf_counter() - IMPORT_START
+
+
+# feature order of data/003_preprocessed, used when the model does not carry feature names
+FEATURE_COLUMNS = ['Age', 'Fare', 'Pclass_2', 'Pclass_3', 'Sex_male', 'Embarked_Q', 'Embarked_S']
+
+# supported request formats, negotiated on the Content-Type header
+JSON_CONTENT_TYPE = 'application/json'
+NPY_CONTENT_TYPE = 'application/x-npy'
+RAW_CONTENT_TYPE = 'application/octet-stream'
+RAW_DTYPES = {'float32': np.dtype('<f4'), 'float64': np.dtype('<f8')}
+
+# request coalescing, disabled when the window is 0
+BATCH_WINDOW_MS = float(os.getenv('SCORING_BATCH_WINDOW_MS', '0'))
+MAX_BATCH_SIZE = int(os.getenv('SCORING_MAX_BATCH_SIZE', '256'))
+
+# 'arrays' serves the exported forest with NumPy only, 'sklearn' unpickles the full model
+SCORING_ENGINE = os.getenv('SCORING_ENGINE', 'arrays')
+
+# prediction cache keyed on the feature row, disabled when the size is 0, a ttl of 0 never expires entries
+CACHE_SIZE = int(os.getenv('SCORING_CACHE_SIZE', '0'))
+CACHE_TTL_S = float(os.getenv('SCORING_CACHE_TTL_S', '0'))
+
+# multi-model hosting: model served when a request names none, live/shadow versions as 'name:version,...',
+# loaded models above the memory budget (0 is unlimited) are unloaded least recently used first
+DEFAULT_MODEL_NAME = os.getenv('SCORING_DEFAULT_MODEL', 'titanic_model')
+LIVE_VERSIONS = parse_versions(os.getenv('SCORING_LIVE_VERSIONS', ''))
+SHADOW_VERSIONS = parse_versions(os.getenv('SCORING_SHADOW_VERSIONS', ''))
+MODEL_MEMORY_MB = float(os.getenv('SCORING_MODEL_MEMORY_MB', '0'))
+
+# POST {"control": {...}} requests (swap, shadow, status), only accepted when enabled
+CONTROL_ENABLED = os.getenv('SCORING_CONTROL_ENABLED', '0') == '1'
+
+# sampling profiler of the request threads, disabled when the interval is 0
+PROFILER_INTERVAL_MS = float(os.getenv('SCORING_PROFILER_INTERVAL_MS', '0'))
+
+# GET requests return the metrics (text exposition, ?format=json) or the profiler stacks (?profile)
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# request errors caused by the payload, answered with 400 instead of 500
+CLIENT_ERRORS = (ValueError, KeyError, TypeError, IndexError)
+
+
+def load_model(model_dir):
+    forest_dir = os.path.join(model_dir, 'rf_forest')
+
+    # the array forest is memory mapped, so loading only reads the .npy headers
+    # models registered before the array export only have the pickle, which pulls in sklearn
+    if SCORING_ENGINE == 'arrays' and os.path.isdir(forest_dir):
+        return ArrayForest.load(forest_dir, mmap_mode='r')
+
+    import pickle
+    with open(os.path.join(model_dir, 'rf.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def load_feature_transform(model_dir):
+    # fitted preprocessing registered with the model, models trained before it only accept feature vectors
+    spec_path = os.path.join(model_dir, 'preprocessing.json')
+    if os.path.isfile(spec_path):
+        return FeatureTransform.load(spec_path)
+    return None
+
+
+def load_hosted_model(name, version, model_dir):
+    load_start = time.perf_counter()
+    model = load_model(model_dir)
+    feature_transform = load_feature_transform(model_dir)
+    load_time = time.perf_counter() - load_start
+
+    feature_names = getattr(model, 'feature_names_in_', None)
+    feature_columns = list(feature_names) if feature_names is not None else FEATURE_COLUMNS
+    if feature_transform is not None and feature_transform.feature_columns != feature_columns:
+        raise ValueError(f"Preprocessing spec columns {feature_transform.feature_columns} do not match the model {feature_columns}")
+
+    # the first prediction pages in the mapped arrays, done here instead of on the first request
+    predict_start = time.perf_counter()
+    model.predict_proba(np.zeros((1, len(feature_columns))))
+    first_predict_time = time.perf_counter() - predict_start
+
+    batcher = None
+    if BATCH_WINDOW_MS > 0:
+        from request_batcher import RequestBatcher
+        batcher = RequestBatcher(model.predict_proba, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE)
+
+    # a cache per loaded model version, so predictions of another version are never served
+    prediction_cache = None
+    if CACHE_SIZE > 0:
+        from prediction_cache import PredictionCache
+        prediction_cache = PredictionCache(CACHE_SIZE, ttl_s=CACHE_TTL_S, model_version=f"{name}:{version}")
+
+    hosted = HostedModel(name, version, model, feature_columns, feature_transform, batcher, prediction_cache)
+    hosted.timings = {
+        "engine": type(model).__name__,
+        "load_ms": round(load_time * 1000, 2),
+        "first_predict_ms": round(first_predict_time * 1000, 2)
+    }
+    return hosted
 
 
 def init():
-    global model
-    
-    model_path = os.path.join(os.getenv('AZUREML_MODEL_DIR'), 'model', 'rf.pkl')
+    global registry, shadow_scorer, startup_timings, metrics, profiler
+
+    # a repeated init() replaces the hosted models
+    if globals().get('registry') is not None:
+        registry.close()
+        shadow_scorer.close()
+
+    registry = ModelRegistry(discover_models(os.getenv('AZUREML_MODEL_DIR'), DEFAULT_MODEL_NAME), load_hosted_model,
+                             memory_budget_bytes=MODEL_MEMORY_MB * 1024 ** 2, default_name=DEFAULT_MODEL_NAME,
+                             live_versions=LIVE_VERSIONS, shadow_versions=SHADOW_VERSIONS)
+    shadow_scorer = ShadowScorer()
+
+    # the live default model is loaded before the first request, other models on first use
+    hosted = registry.get()
+    registry.get_shadow(hosted.name)
+
+    startup_timings = {"model": hosted.key, **hosted.timings, "import_ms": round(IMPORT_TIME * 1000, 2)}
+    print(f"[{datetime.now()}] Startup timings: {json.dumps(startup_timings)}")
+    print(f"[{datetime.now()}] Hosted models: {json.dumps(registry.status())}")
+
+    metrics = ScoringMetrics()
+    metrics.startup = {stage: value for stage, value in startup_timings.items() if stage not in ('engine', 'model')}
+    metrics.registry = registry
+    metrics.shadow_scorer = shadow_scorer
+
+    profiler = None
+    if PROFILER_INTERVAL_MS > 0:
+        from sampling_profiler import SamplingProfiler
+        profiler = SamplingProfiler(os.path.dirname(os.path.abspath(__file__)), interval_ms=PROFILER_INTERVAL_MS).start()
 
-    model = pickle.load(open(model_path, 'rb'))
 
+def to_feature_matrix(sample, feature_columns):
+    # accepted payloads for 'data':
+    #   [f1, f2, ...]                     single row (original format)
+    #   [[f1, f2, ...], [f1, f2, ...]]    batch of rows
+    #   {"Age": [...], "Fare": [...]}     columnar batch, keyed by feature name
+    if isinstance(sample, dict):
+        missing = [col for col in feature_columns if col not in sample]
+        if missing:
+            raise ValueError(f"Missing feature columns: {missing}")
+        return np.column_stack([np.asarray(sample[col], dtype=np.float64) for col in feature_columns])
 
-def run(data):
+    X = np.asarray(sample, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    return X
+
+
+def decode_npy(body):
+    # parse the .npy header only, the array itself is a view on the request body
+    buffer = io.BytesIO(body)
+    version = np.lib.format.read_magic(buffer)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+    if fortran_order or dtype not in RAW_DTYPES.values():
+        raise ValueError(f"Unsupported npy array: dtype={dtype}, fortran_order={fortran_order}")
+    return np.frombuffer(body, dtype=dtype, offset=buffer.tell()).reshape(shape)
+
+
+def decode_raw(body, headers, feature_columns):
+    # little-endian float buffer, described by the X-Dtype and X-Shape headers
+    dtype_name = headers.get('X-Dtype', 'float64')
+    if dtype_name not in RAW_DTYPES:
+        raise ValueError(f"Unsupported X-Dtype '{dtype_name}', expected one of {list(RAW_DTYPES)}")
+    X = np.frombuffer(body, dtype=RAW_DTYPES[dtype_name])
+
+    shape = headers.get('X-Shape')
+    if shape is not None:
+        return X.reshape(tuple(int(dim) for dim in shape.split(',')))
+    return X.reshape(-1, len(feature_columns))
+
+
+def content_format(headers):
+    content_type = headers.get('Content-Type', JSON_CONTENT_TYPE).split(';')[0].strip()
+    return {NPY_CONTENT_TYPE: 'npy', RAW_CONTENT_TYPE: 'raw'}.get(content_type, 'json')
+
+
+def select_model(payload, headers):
+    # the model and version are named in the JSON payload or in the X-Model and X-Model-Version headers,
+    # without them the live version of the default model scores the request
+    name = payload.get('model') or headers.get('X-Model')
+    version = payload.get('version') or headers.get('X-Model-Version')
+    return registry.get(name, version)
+
+
+def decode_request(body, headers):
+    # returns the hosted model, the feature matrix, whether the original single row response format applies
+    # and the request format
+    request_format = content_format(headers)
+
+    if request_format in ('npy', 'raw'):
+        hosted = select_model({}, headers)
+        if request_format == 'npy':
+            X, single_row = decode_npy(body), False
+        else:
+            X, single_row = decode_raw(body, headers, hosted.feature_columns), False
+    else:
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("Expected a JSON object with 'data' or 'records'")
+        hosted = select_model(payload, headers)
+        if 'records' in payload:
+            # raw passenger records, preprocessed with the spec registered next to the model
+            if hosted.feature_transform is None:
+                raise ValueError("This model has no preprocessing spec, send feature vectors in 'data'.")
+            X, single_row, request_format = hosted.feature_transform.transform(payload['records']), False, 'records'
+        else:
+            sample = payload['data']
+            X = to_feature_matrix(sample, hosted.feature_columns)
+            single_row = not isinstance(sample, dict) and np.ndim(sample) == 1
+
+    if X.ndim != 2 or X.shape[1] != len(hosted.feature_columns):
+        raise ValueError(f"Expected rows with {len(hosted.feature_columns)} features, got shape {X.shape}")
+
+    return hosted, X, single_row, request_format
+
+
+def score(hosted, X):
+    # one vectorized call for the whole batch, predictions are derived from the probabilities
+    proba = hosted.predict_proba(X)
+    pred = hosted.model.classes_.take(np.argmax(proba, axis=1))
+
+    # requests served by the live version are also scored by its shadow candidate, in the background
+    if hosted.version == registry.live[hosted.name]:
+        shadow = registry.get_shadow(hosted.name)
+        if shadow is not None:
+            shadow_scorer.submit(shadow, X, proba)
+
+    return {
+        "model": hosted.key,
+        "predictions": pred.tolist(),
+        "probabilities": proba[:, -1].tolist()
+    }
+
+
+def control(command):
+    # {"action": "swap", "model": "titanic_model", "version": "4"}   load version 4 in the background, then serve it
+    # {"action": "shadow", "model": "titanic_model", "version": "4"} score version 4 next to the live one, null stops it
+    # {"action": "status"}                                           hosted, loaded, live and shadow versions
+    if not CONTROL_ENABLED:
+        return json.dumps({"error": "Control requests are disabled, set SCORING_CONTROL_ENABLED=1."}), 403
+
+    action = command.get('action')
+    name = command.get('model') or registry.default_name
+    if action == 'swap':
+        registry.swap(name, command['version'])
+        return json.dumps({"status": "swapping", "model": name, "version": str(command['version'])}), 202
+    if action == 'shadow':
+        registry.set_shadow(name, command.get('version'))
+        # load the candidate now instead of on the next request
+        registry.get_shadow(name)
+        return json.dumps(registry.status()), 200
+    if action == 'status':
+        return json.dumps({**registry.status(), "shadow_scoring": shadow_scorer.summary()}), 200
+    raise ValueError(f"Unknown control action '{action}', expected swap, shadow or status")
+
+
+def respond(body, status_code, content_type=JSON_CONTENT_TYPE):
+    response = AMLResponse(body, status_code)
+    response.headers['Content-Type'] = content_type
+    return response
+
+
+def observability(request):
+    # GET ?profile returns the sampled stacks, GET ?format=json the metrics as JSON, any other GET the text exposition
+    args = getattr(request, 'args', {})
+    if 'models' in args:
+        return respond(json.dumps({**registry.status(), "shadow_scoring": shadow_scorer.summary()}), 200)
+    if 'profile' in args:
+        if profiler is None:
+            return respond(json.dumps({"error": "The profiler is disabled, set SCORING_PROFILER_INTERVAL_MS."}), 404)
+        return respond(profiler.folded(), 200, 'text/plain')
+    if args.get('format') == 'json':
+        return respond(json.dumps(metrics.to_dict()), 200)
+    return respond(metrics.exposition(), 200, METRICS_CONTENT_TYPE)
+
+
+@rawhttp
+def run(request):
+    if request.method == 'GET':
+        return observability(request)
+    if request.method != 'POST':
+        return AMLResponse(f"Method {request.method} not allowed, send a POST request.", 405)
+
+    request_start = time.perf_counter()
+    request_format, model_key = content_format(request.headers), ''
     try:
-        body = json.loads(data)
-        
-        sample = body['data']
-        sample = np.array(sample).reshape(1, -1)
+        if request_format == 'json' and b'"control"' in request.get_data(False):
+            payload = json.loads(request.get_data(False))
+            if 'control' in payload:
+                body, status_code = control(payload['control'])
+                return respond(body, status_code)
+
+        with metrics.timer('decode'):
+            hosted, X, single_row, request_format = decode_request(request.get_data(False), request.headers)
+        model_key = hosted.key
+        metrics.observe_batch(len(X))
+
+        with metrics.timer('predict'):
+            result = score(hosted, X)
+
+        with metrics.timer('encode'):
+            # single row requests keep the original response format
+            body = json.dumps(str(np.array(result["predictions"])) if single_row else result)
+        status_code = 200
 
-        pred = model.predict(sample)
+    except CLIENT_ERRORS as e:
+        body, status_code = json.dumps({"error": f"{type(e).__name__}: {e}"}), 400
 
-        return str(pred)
+    except Exception:
+        # details stay in the container log
+        print(f"[{datetime.now()}] Scoring request failed:\n{traceback.format_exc()}")
+        body, status_code = json.dumps({"error": "Internal error while scoring the request."}), 500
 
-    except Exception as e:
-        return str(e)
\ No newline at end of file
+    metrics.count_request(request_format, status_code, model_key)
+    if status_code == 200:
+        metrics.observe_latency('total', time.perf_counter() - request_start)
+    return respond(body, status_code)
@@ -0,0 +1,228 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from datetime import datetime
+from model_request import ENCODERS, allowSelfSignedHttps, load_rows, get_scoring_uri
+import http.client
+import itertools
+import math
+import threading
+import argparse
+import time
+import json
+import sys
+import os
+import ssl
+
+
+ENTRY_SCRIPT_DIR = 'model_deployments/entry_scripts'
+# forest engine of the entry script, shared with the train step, copied next to the entry script on deployment
+COMMON_DIR = 'pipelines/train_pipeline/common'
+
+# measured usage is multiplied by this factor when suggesting ACI resources
+SIZING_HEADROOM = 1.5
+
+
+class LocalRequest:
+    # stand-in for the request object the inference server passes to a @rawhttp run()
+    def __init__(self, body, headers, method='POST', args=None):
+        self.method = method
+        self.headers = headers
+        self.body = body
+        self.args = args or {}
+
+    def get_data(self, cache=True):
+        return self.body
+
+
+class LocalTarget:
+    # scores in-process through titanic_entry.init()/run(), no Azure resources needed
+    def __init__(self, model_dir, profiler_interval_ms=0):
+        os.environ['AZUREML_MODEL_DIR'] = model_dir
+        os.environ['SCORING_PROFILER_INTERVAL_MS'] = str(profiler_interval_ms)
+        sys.path.insert(0, ENTRY_SCRIPT_DIR)
+        sys.path.insert(1, COMMON_DIR)
+        import titanic_entry
+
+        self.entry = titanic_entry
+        self.entry.init()
+
+    def send(self, body, headers):
+        result = self.entry.run(LocalRequest(body, headers))
+        status = getattr(result, 'status_code', 200)
+        return status < 400
+
+    def get(self, query):
+        result = self.entry.run(LocalRequest(b'', {}, method='GET', args=dict(parse_qsl(query, keep_blank_values=True))))
+        return result.body
+
+
+class HttpTarget:
+    # one keep-alive connection per worker thread
+    def __init__(self, scoring_uri, api_key=None):
+        url = urlsplit(scoring_uri)
+        self.https = url.scheme == 'https'
+        self.netloc = url.netloc
+        self.path = url.path or '/'
+        self.auth_headers = {'Authorization': f"Bearer {api_key}"} if api_key else {}
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            if self.https:
+                self.local.connection = http.client.HTTPSConnection(self.netloc, context=ssl._create_default_https_context())
+            else:
+                self.local.connection = http.client.HTTPConnection(self.netloc)
+        return self.local.connection
+
+    def send(self, body, headers):
+        connection = self.connection()
+        try:
+            connection.request('POST', self.path, body=body, headers={**headers, **self.auth_headers})
+            response = connection.getresponse()
+            response.read()
+            return response.status < 400
+        except (http.client.HTTPException, OSError):
+            # drop the broken connection, the next request opens a new one
+            connection.close()
+            self.local.connection = None
+            return False
+
+    def get(self, query):
+        # metrics and profiler stacks of the scoring container
+        connection = self.connection()
+        connection.request('GET', f"{self.path}?{query}", headers=self.auth_headers)
+        response = connection.getresponse()
+        body = response.read().decode('utf8')
+        if response.status >= 400:
+            raise RuntimeError(f"GET ?{query} failed with status code {response.status}: {body}")
+        return body
+
+
+def run_load_test(target, X, batch_size, concurrency, duration, encoding, dtype='float64'):
+    # every worker replays consecutive batches of X until the duration has passed
+    batch_starts = itertools.cycle(range(0, len(X), batch_size))
+    batch_lock = threading.Lock()
+    encode = ENCODERS[encoding]
+
+    def worker(deadline):
+        latencies, rows, errors = [], 0, 0
+        while time.perf_counter() < deadline:
+            with batch_lock:
+                start = next(batch_starts)
+            batch = X[start:start + batch_size]
+            body, headers = encode(batch) if encoding == 'json' else encode(batch, dtype=dtype)
+
+            request_start = time.perf_counter()
+            ok = target.send(body, headers)
+            latencies.append(time.perf_counter() - request_start)
+
+            rows += len(batch)
+            errors += not ok
+        return latencies, rows, errors
+
+    test_start = time.perf_counter()
+    deadline = test_start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, [deadline] * concurrency))
+    elapsed = time.perf_counter() - test_start
+
+    latencies = np.concatenate([result[0] for result in results]) * 1000
+    requests = len(latencies)
+    rows = sum(result[1] for result in results)
+    errors = sum(result[2] for result in results)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if requests else (np.nan, np.nan, np.nan)
+
+    return {
+        "format": encoding,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": requests,
+        "rows": rows,
+        "errors": errors,
+        "requests_per_s": round(requests / elapsed, 1),
+        "rows_per_s": round(rows / elapsed, 1),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3)
+    }
+
+
+def suggest_aci_sizing(before, after, elapsed):
+    # ACI resources from the CPU time and peak memory the scoring process used during the load test
+    cores_used = (after['cpu_seconds'] - before['cpu_seconds']) / elapsed
+    peak_gb = after['peak_rss_bytes'] / 1024 ** 3 if after['peak_rss_bytes'] is not None else None
+    if cores_used >= 0.9 * after['cpu_count']:
+        print(f"[{datetime.now()}] The scoring process used all {after['cpu_count']} cores, "
+              f"the suggested cpu_cores is a lower bound, rerun on a larger container.")
+
+    return {
+        "cpu_cores": max(0.1, math.ceil(cores_used * SIZING_HEADROOM * 10) / 10),
+        "memory_gb": max(0.5, math.ceil(peak_gb * SIZING_HEADROOM * 10) / 10) if peak_gb is not None else 1,
+        "measured": {"cores_used": round(cores_used, 3), "peak_memory_gb": round(peak_gb, 3) if peak_gb is not None else None,
+                     "cpu_count": after['cpu_count'], "duration_s": round(elapsed, 2)}
+    }
+
+
+def main(args):
+    X = load_rows(args.csv_path)
+
+    if args.target == 'local':
+        target = LocalTarget(args.model_dir, profiler_interval_ms=args.profiler_interval_ms)
+    else:
+        allowSelfSignedHttps(True)
+        scoring_uri = args.scoring_uri or get_scoring_uri(args.service_name)
+        target = HttpTarget(scoring_uri, api_key=args.api_key)
+
+    print(f"[{datetime.now()}] Running {args.duration}s load test against {args.target} target...")
+    metrics_before = json.loads(target.get('format=json'))
+    test_start = time.perf_counter()
+    for encoding in args.formats:
+        report = run_load_test(target, X, args.batch_size, args.concurrency, args.duration, encoding, args.dtype)
+        print(json.dumps(report))
+    elapsed = time.perf_counter() - test_start
+    metrics_after = json.loads(target.get('format=json'))
+
+    # server side view of the same requests
+    print(f"[{datetime.now()}] Scoring service latency (s): {json.dumps(metrics_after['latency_s'])}")
+
+    if args.sizing_path:
+        # a local target shares its process with the load generator, so its CPU time is an upper bound
+        sizing = suggest_aci_sizing(metrics_before['process'], metrics_after['process'], elapsed)
+        with open(args.sizing_path, 'w') as f:
+            json.dump(sizing, f, indent=4)
+        print(f"[{datetime.now()}] Suggested ACI resources written to {args.sizing_path}: {json.dumps(sizing)}")
+
+    if args.profile_path:
+        with open(args.profile_path, 'w') as f:
+            f.write(target.get('profile'))
+        print(f"[{datetime.now()}] Sampled stacks written to {args.profile_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', dest='target', choices=['local', 'http'], default='local')
+    # the train step folder of a local pipeline run (run_pipeline.py --local) holds model/rf.pkl and model/rf_forest/
+    parser.add_argument('--model_dir', dest='model_dir', default='outputs/local_pipeline/steps/train',
+                        help="local target: folder containing model/rf.pkl (and model/rf_forest/), or "
+                             "<name>/<version>/model/ per model, same layout as AZUREML_MODEL_DIR; "
+                             "default: the train step folder of run_pipeline.py --local")
+    parser.add_argument('--scoring_uri', dest='scoring_uri', default=None)
+    parser.add_argument('--service_name', dest='service_name', default='titanic-aci-model')
+    parser.add_argument('--api_key', dest='api_key', default=os.environ.get('SCORING_API_KEY'))
+    parser.add_argument('--csv_path', dest='csv_path', default='data/003_preprocessed/titanic_dataset.csv')
+    parser.add_argument('--formats', dest='formats', nargs='+', choices=list(ENCODERS), default=['json'])
+    parser.add_argument('--dtype', dest='dtype', choices=['float32', 'float64'], default='float64')
+    parser.add_argument('--concurrency', dest='concurrency', type=int, default=8)
+    parser.add_argument('--batch_size', dest='batch_size', type=int, default=1)
+    parser.add_argument('--duration', dest='duration', type=float, default=10)
+    parser.add_argument('--sizing_path', dest='sizing_path', default=None,
+                        help="write ACI cpu_cores/memory_gb suggested from the measured usage, read by aci_deployment.py")
+    parser.add_argument('--profile_path', dest='profile_path', default=None,
+                        help="write the folded stacks of the sampling profiler, the service needs SCORING_PROFILER_INTERVAL_MS > 0")
+    parser.add_argument('--profiler_interval_ms', dest='profiler_interval_ms', type=float, default=0,
+                        help="local target: sampling interval of the profiler, 0 disables it")
+    args = parser.parse_args()
+
+    main(args)
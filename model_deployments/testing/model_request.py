@@ -1,41 +1,137 @@
 import pandas as pd
-from azureml.core import Workspace
-from azureml.core.webservice import Webservice
+import numpy as np
+from datetime import datetime
 import urllib.request
+import argparse
+import time
 import json
+import io
+import sys
 import os
 import ssl
 
+# shared modules in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+
+def get_scoring_uri(service_name):
+    # imported here, the session module loads the AzureML SDK, which the local load test target runs without
+    from workspace_session import get_scoring_uri as get_service_scoring_uri
+    return get_service_scoring_uri(service_name)
+
 
 def allowSelfSignedHttps(allowed):
     # bypass the server certificate verification on client side
     if allowed and not os.environ.get('PYTHONHTTPSVERIFY', '') and getattr(ssl, '_create_unverified_context', None):
         ssl._create_default_https_context = ssl._create_unverified_context
 
-allowSelfSignedHttps(True)
 
-ws = Workspace.from_config()
-service = Webservice(ws, 'titanic-aci-model')
-url = service.scoring_uri
+# little-endian float layouts understood by the entry script
+RAW_DTYPES = {'float32': '<f4', 'float64': '<f8'}
+
+
+def encode_json(X):
+    # original format, a single row is sent as a flat list
+    rows = X.tolist()
+    data = {"data": rows[0] if len(rows) == 1 else rows}
+    return str.encode(json.dumps(data)), {'Content-Type': 'application/json'}
+
 
-df = pd.read_csv('data/003_preprocessed/titanic_dataset.csv')
+def encode_npy(X, dtype='float64'):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(X, dtype=RAW_DTYPES[dtype]))
+    return buffer.getvalue(), {'Content-Type': 'application/x-npy'}
 
-data = {
-    "data": df.loc[20, df.columns != 'Survived'].values.flatten().tolist()
+
+def encode_raw(X, dtype='float64'):
+    X = np.ascontiguousarray(X, dtype=RAW_DTYPES[dtype])
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'X-Dtype': dtype,
+        'X-Shape': ','.join(str(dim) for dim in X.shape)
+    }
+    return X.tobytes(), headers
+
+
+ENCODERS = {
+    "json": encode_json,
+    "npy": encode_npy,
+    "raw": encode_raw
 }
 
-body = str.encode(json.dumps(data))
-headers = {'Content-Type':'application/json'}
-req = urllib.request.Request(url, body, headers)
 
-try:
-    response = urllib.request.urlopen(req)
+def load_rows(csv_path, start=0, rows=None):
+    df = pd.read_csv(csv_path)
+    X = df.loc[:, df.columns != 'Survived'].values
+    return X[start:] if rows is None else X[start:start + rows]
+
+
+def send_request(url, body, headers):
+    req = urllib.request.Request(url, body, headers)
+
+    try:
+        response = urllib.request.urlopen(req)
+
+        result = response.read()
+        print(result)
+    except urllib.error.HTTPError as error:
+        print("The request failed with status code: " + str(error.code))
+
+        # Print the headers - they include the requert ID and the timestamp, which are useful for debugging the failure
+        print(error.info())
+        print(error.read().decode("utf8", 'ignore'))
+
+
+def main(args):
+    allowSelfSignedHttps(True)
+
+    url = get_scoring_uri(args.service_name)
+    # service key of an ACI service with key auth, control requests are only accepted on those
+    auth_headers = {'Authorization': f"Bearer {args.api_key}"} if args.api_key else {}
+
+    if args.control:
+        # e.g. '{"action": "swap", "model": "titanic_model", "version": "4"}'
+        send_request(url, str.encode(json.dumps({"control": json.loads(args.control)})),
+                     {'Content-Type': 'application/json', **auth_headers})
+        return
+
+    X = load_rows(args.csv_path, args.start_row, args.rows)
+
+    encode_start = time.perf_counter()
+    if args.format == "json":
+        body, headers = encode_json(X)
+    else:
+        body, headers = ENCODERS[args.format](X, dtype=args.dtype)
+    encode_time = time.perf_counter() - encode_start
+
+    # hosted model to score with, the live version of the default model when not set
+    if args.model_name:
+        headers['X-Model'] = args.model_name
+    if args.model_version:
+        headers['X-Model-Version'] = args.model_version
+    headers.update(auth_headers)
+
+    request_start = time.perf_counter()
+    send_request(url, body, headers)
+    request_time = time.perf_counter() - request_start
+
+    print(f"[{datetime.now()}] {args.format}: {len(X)} rows, {len(body)} bytes, "
+          f"encode {encode_time * 1000:.2f} ms, request {request_time * 1000:.2f} ms")
+
 
-    result = response.read()
-    print(result)
-except urllib.error.HTTPError as error:
-    print("The request failed with status code: " + str(error.code))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--service_name', dest='service_name', default='titanic-aci-model')
+    parser.add_argument('--csv_path', dest='csv_path', default='data/003_preprocessed/titanic_dataset.csv')
+    parser.add_argument('--format', dest='format', choices=list(ENCODERS), default='json')
+    parser.add_argument('--dtype', dest='dtype', choices=['float32', 'float64'], default='float64')
+    parser.add_argument('--start_row', dest='start_row', type=int, default=20)
+    parser.add_argument('--rows', dest='rows', type=int, default=1)
+    parser.add_argument('--model_name', dest='model_name', default=None)
+    parser.add_argument('--model_version', dest='model_version', default=None)
+    parser.add_argument('--api_key', dest='api_key', default=os.environ.get('SCORING_API_KEY'))
+    parser.add_argument('--control', dest='control', default=None,
+                        help="JSON control command (swap, shadow, status) instead of a scoring request")
+    args = parser.parse_args()
 
-    # Print the headers - they include the requert ID and the timestamp, which are useful for debugging the failure
-    print(error.info())
-    print(error.read().decode("utf8", 'ignore'))
+    main(args)
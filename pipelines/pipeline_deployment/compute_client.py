@@ -0,0 +1,110 @@
+from abc import ABC, abstractmethod
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+class ComputeClient(ABC):
+    # Compute operations used by get_compute_targets. get returns None when the cluster does not exist,
+    # so the provisioning logic does not depend on AzureML exceptions and can run against a fake.
+    # Implementations are called from several threads at once.
+
+    @abstractmethod
+    def get(self, compute_name):
+        ...
+
+    @abstractmethod
+    def create(self, compute_name, vm_size, min_nodes, max_nodes):
+        # starts the provisioning and returns the compute target without waiting for it
+        ...
+
+    @abstractmethod
+    def wait_for_completion(self, compute_target, timeout_in_minutes):
+        # blocks until the compute target is ready, raises when provisioning failed
+        ...
+
+
+class AzureMLComputeClient(ComputeClient):
+    # the AzureML SDK is imported by the methods, so this module and the fake client load without it
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def get(self, compute_name):
+        from azureml.core.compute import ComputeTarget
+        from azureml.exceptions import ComputeTargetException
+        try:
+            return ComputeTarget(workspace=self.ws, name=compute_name)
+        except ComputeTargetException:
+            return None
+
+    def create(self, compute_name, vm_size, min_nodes, max_nodes):
+        from azureml.core.compute import AmlCompute, ComputeTarget
+        aml_compute_config = AmlCompute.provisioning_configuration(vm_size=vm_size,
+                                                                   vm_priority="lowpriority",
+                                                                   min_nodes=min_nodes,
+                                                                   max_nodes=max_nodes)
+        return ComputeTarget.create(workspace=self.ws, name=compute_name, provisioning_configuration=aml_compute_config)
+
+    def wait_for_completion(self, compute_target, timeout_in_minutes):
+        from azureml.exceptions import ComputeTargetException
+        compute_target.wait_for_completion(show_output=False, min_node_count=None, timeout_in_minutes=timeout_in_minutes)
+        if compute_target.provisioning_state == "Failed":
+            raise ComputeTargetException(f"Provisioning of compute target '{compute_target.name}' failed: "
+                                         f"{compute_target.provisioning_errors}")
+
+
+def provision_compute_target(client, compute_name, compute_type, num_nodes, timeout_in_minutes):
+    # get or create one cluster and wait until it is ready
+    vm_sizes: Dict[str, str] = {"cpu": "STANDARD_DS3_V2", "gpu": "STANDARD_NC6"}
+    compute_target = client.get(compute_name)
+    created: bool = compute_target is None
+    if created:
+        if compute_type is None:
+            raise ValueError(f"Compute target '{compute_name}' does not exist and is not in CPU_CLUSTERS or GPU_CLUSTERS.")
+        compute_target = client.create(compute_name, vm_sizes[compute_type], num_nodes["min"], num_nodes["max"])
+        print(f"[{datetime.now()}] Creating compute target: {compute_name}")
+
+    client.wait_for_completion(compute_target, timeout_in_minutes)
+
+    return compute_target, created
+
+
+def get_compute_targets(client, config, compute_configs, timeout_in_minutes=180):
+    ## COMPUTE TARGET
+    # only the clusters used by a step are fetched or created, all of them at the same time,
+    # so the setup takes as long as the slowest cluster instead of the sum of all clusters
+    required_computes: List[str] = list(dict.fromkeys(step["COMPUTE"] for step in config["PIPELINE_STEPS"]))
+    compute_types: Dict[str, str] = {compute_name: compute_type for compute_type, compute_config in compute_configs.items()
+                                     for compute_name in compute_config}
+    num_nodes: Dict[str, Dict[str, int]] = {compute_name: nodes for compute_config in compute_configs.values()
+                                            for compute_name, nodes in compute_config.items()}
+
+    for compute_name in compute_types:
+        if compute_name not in required_computes:
+            print(f"[{datetime.now()}] Skipped compute target, no step uses it: {compute_name}")
+
+    start: datetime = datetime.now()
+    compute_targets: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(required_computes))) as pool:
+        futures = {pool.submit(provision_compute_target, client, compute_name, compute_types.get(compute_name),
+                               num_nodes.get(compute_name), timeout_in_minutes): compute_name
+                   for compute_name in required_computes}
+        for future in as_completed(futures):
+            compute_name = futures[future]
+            try:
+                compute_targets[compute_name], created = future.result()
+            except Exception as e:
+                errors[compute_name] = repr(e)
+                print(f"[{datetime.now()}] Compute target failed: {compute_name}: {e!r}")
+                continue
+            print(f"[{datetime.now()}] Compute target ready: {compute_name} ({'created' if created else 'existing'}, "
+                  f"{len(compute_targets)}/{len(required_computes)} ready after {(datetime.now() - start).total_seconds():.1f}s)")
+
+    if errors:
+        raise RuntimeError(f"Compute target setup failed for {sorted(errors)}: {errors}")
+
+    print(f"[{datetime.now()}] Finished compute target setup.")
+
+    return compute_targets
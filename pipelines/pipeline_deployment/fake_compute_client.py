@@ -0,0 +1,43 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from compute_client import ComputeClient
+import threading
+import time
+
+
+class InMemoryComputeClient(ComputeClient):
+    # Stand-in for AzureMLComputeClient, compute targets are dicts that become ready after a delay.
+    #   existing: names of clusters that already exist and are ready
+    #   provisioning_s: seconds until a created cluster is ready, per cluster name or one value for all
+    #   failures: names of clusters whose provisioning fails
+    # Every call is counted in self.calls.
+
+    def __init__(self, existing=None, provisioning_s=0.0, failures=None):
+        self.targets: Dict[str, Dict[str, Any]] = {name: {"name": name, "ready_at": 0.0} for name in existing or []}
+        self.provisioning_s = provisioning_s
+        self.failures: Set[str] = set(failures or [])
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def get(self, compute_name):
+        self._call("get")
+        with self.lock:
+            return self.targets.get(compute_name)
+
+    def create(self, compute_name, vm_size, min_nodes, max_nodes):
+        self._call("create")
+        delay: float = self.provisioning_s.get(compute_name, 0.0) if isinstance(self.provisioning_s, dict) else self.provisioning_s
+        compute_target: Dict[str, Any] = {"name": compute_name, "vm_size": vm_size, "min_nodes": min_nodes,
+                                          "max_nodes": max_nodes, "ready_at": time.monotonic() + delay}
+        with self.lock:
+            self.targets[compute_name] = compute_target
+        return compute_target
+
+    def wait_for_completion(self, compute_target, timeout_in_minutes):
+        self._call("wait_for_completion")
+        time.sleep(max(0.0, compute_target["ready_at"] - time.monotonic()))
+        if compute_target["name"] in self.failures:
+            raise RuntimeError(f"Provisioning of compute target '{compute_target['name']}' failed")
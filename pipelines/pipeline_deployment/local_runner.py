@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from pipeline_utils import add_datetime_as_param, get_step_dependencies, get_critical_path, stage_source_directory, expand_sharded_steps
+from step_cache import LocalStepCache, get_step_keys, hash_directory
+from datetime import datetime
+import subprocess
+import argparse
+import json
+import time
+import sys
+import os
+
+
+def get_dataset_paths(config, work_dir):
+    ## DATASET PATHS
+    # datasets produced by a step are written to the work dir, all other inputs come from LOCAL_DATASETS
+    dataset_paths: Dict[str, str] = {name: os.path.abspath(path) for name, path in config.get("LOCAL_DATASETS", {}).items()}
+    for step in config["PIPELINE_STEPS"]:
+        for dataset_name in step.get("OUTPUT_DATASETS", {}):
+            dataset_paths[dataset_name] = os.path.abspath(os.path.join(work_dir, "datasets", dataset_name))
+
+    return dataset_paths
+
+
+def stage_step_sources(config, work_dir):
+    ## STAGE STEP SOURCES
+    # same folder layout as the snapshots uploaded to AzureML
+    common_dir: Optional[str] = os.path.join(config["SOURCE_DIR_PREFIX"], config["COMMON_DIR"]) if "COMMON_DIR" in config else None
+
+    return {
+        step["NAME"]: stage_source_directory(
+            os.path.join(config["SOURCE_DIR_PREFIX"], step["SOURCE_DIR"]),
+            os.path.abspath(os.path.join(work_dir, "source", step["NAME"])),
+            common_dir)
+        for step in config["PIPELINE_STEPS"]
+    }
+
+
+def create_step_command(step, source_dir, step_params, dataset_paths, state_dir):
+    ## STEP COMMAND
+    # same arguments as on AzureML, output path params point to local folders and inputs are passed explicitly
+    # STATE_PATHS are folders below state_dir (the work dir), at the same path as on the output datastore, kept between runs
+    script_path: str = os.path.join(source_dir, step["SCRIPT"])
+
+    arguments: Dict[str, str] = dict(step_params)
+    for dataset_name, param_name in step.get("OUTPUT_DATASETS", {}).items():
+        arguments[param_name] = dataset_paths[dataset_name]
+    for dataset_name, input_name in step["INPUT_DATASETS"].items():
+        if dataset_name not in dataset_paths:
+            raise KeyError(f"No local path for input dataset '{dataset_name}' of step '{step['NAME']}', add it to LOCAL_DATASETS.")
+        arguments[input_name] = dataset_paths[dataset_name]
+    for param_name, state_path in step.get("STATE_PATHS", {}).items():
+        arguments[param_name] = os.path.abspath(os.path.join(state_dir, state_path))
+
+    command: List[str] = [sys.executable, script_path]
+    for key, value in arguments.items():
+        command.extend([f"--{key}", str(value)])
+
+    return command
+
+
+def run_step(command, step_dir):
+    # every step runs in its own python process with its own working directory
+    os.makedirs(step_dir, exist_ok=True)
+    start: float = time.perf_counter()
+    with open(os.path.join(step_dir, "step.log"), "w") as log:
+        returncode: int = subprocess.call(command, cwd=step_dir, stdout=log, stderr=subprocess.STDOUT)
+
+    return returncode, time.perf_counter() - start
+
+
+def get_local_step_keys(config, dependencies, source_directories, step_params, dataset_paths):
+    ## LOCAL STEP KEYS
+    # local input datasets are fingerprinted by their content
+    produced_datasets: Set[str] = {name for step in config["PIPELINE_STEPS"] for name in step.get("OUTPUT_DATASETS", {})}
+    external_fingerprints: Dict[str, str] = {
+        dataset_name: hash_directory(dataset_paths[dataset_name])
+        for step in config["PIPELINE_STEPS"] for dataset_name in step["INPUT_DATASETS"]
+        if dataset_name not in produced_datasets and dataset_name in dataset_paths
+    }
+
+    return get_step_keys(config["PIPELINE_STEPS"], dependencies, source_directories, step_params, external_fingerprints)
+
+
+def run_pipeline_locally(config, work_dir, max_workers, step_cache=None):
+    ## LOCAL DAG EXECUTION
+    steps: Dict[str, Dict[str, Any]] = {step["NAME"]: step for step in config["PIPELINE_STEPS"]}
+    dependencies: Dict[str, List[str]] = get_step_dependencies(config["PIPELINE_STEPS"])
+    pipeline_params: List[Dict[str, str]] = add_datetime_as_param([dict(step["PARAMS"]) for step in config["PIPELINE_STEPS"]])
+    step_params: Dict[str, Dict[str, str]] = dict(zip(steps, pipeline_params))
+    dataset_paths: Dict[str, str] = get_dataset_paths(config, work_dir)
+    source_directories: Dict[str, str] = stage_step_sources(config, work_dir)
+    output_dirs: Dict[str, Dict[str, str]] = {
+        name: {dataset_name: dataset_paths[dataset_name] for dataset_name in step.get("OUTPUT_DATASETS", {})}
+        for name, step in steps.items()}
+
+    step_keys: Dict[str, str] = {}
+    if step_cache is not None:
+        step_keys = get_local_step_keys(config, dependencies, source_directories, step_params, dataset_paths)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    running: Dict[Any, str] = {}
+    start_times: Dict[str, float] = {}
+    pipeline_start: float = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(results) < len(steps):
+            # start every step whose dependencies finished, skip steps downstream of a failure
+            for name in steps:
+                if name in results or name in running.values():
+                    continue
+                dependency_status: List[str] = [results[dep]["status"] if dep in results else "pending" for dep in dependencies[name]]
+                if any(status in ["failed", "skipped"] for status in dependency_status):
+                    results[name] = {"status": "skipped", "wall_time_s": 0.0}
+                    print(f"[{datetime.now()}] Skipped step: {name}")
+                elif not all(status in ["succeeded", "cached"] for status in dependency_status):
+                    continue
+                elif step_cache is not None and step_cache.get(step_keys[name]) is not None:
+                    # cache hit, the outputs of the last run with the same key are copied into place
+                    restore_start: float = time.perf_counter()
+                    step_cache.restore(step_keys[name], output_dirs[name])
+                    results[name] = {
+                        "status": "cached",
+                        "start_s": round(restore_start - pipeline_start, 3),
+                        "wall_time_s": round(time.perf_counter() - restore_start, 3),
+                        "key": step_keys[name]
+                    }
+                    print(f"[{datetime.now()}] Restored cached step: {name}")
+                else:
+                    command: List[str] = create_step_command(steps[name], source_directories[name], step_params[name], dataset_paths, work_dir)
+                    future = pool.submit(run_step, command, os.path.join(work_dir, "steps", name))
+                    running[future] = name
+                    start_times[name] = time.perf_counter() - pipeline_start
+                    print(f"[{datetime.now()}] Started step: {name}")
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, wall_time = future.result()
+                results[name] = {
+                    "status": "succeeded" if returncode == 0 else "failed",
+                    "start_s": round(start_times[name], 3),
+                    "wall_time_s": round(wall_time, 3),
+                    "log": os.path.join(work_dir, "steps", name, "step.log")
+                }
+                if step_cache is not None and returncode == 0:
+                    step_cache.put(step_keys[name], name, output_dirs[name])
+                    results[name]["key"] = step_keys[name]
+                print(f"[{datetime.now()}] Step {name} {results[name]['status']} in {wall_time:.2f}s")
+
+    total_time: float = time.perf_counter() - pipeline_start
+    critical_path, critical_path_time = get_critical_path(
+        dependencies, {name: result["wall_time_s"] for name, result in results.items()})
+
+    return {
+        "steps": results,
+        "dependencies": dependencies,
+        "wall_time_s": round(total_time, 3),
+        "sum_step_time_s": round(sum(result["wall_time_s"] for result in results.values()), 3),
+        "critical_path": critical_path,
+        "critical_path_s": round(critical_path_time, 3)
+    }
+
+
+def main(config, work_dir, max_workers, use_cache):
+    # shards of a step with SHARDS run as parallel processes, up to max_workers, not capped by the cluster size
+    config = {**config, "PIPELINE_STEPS": expand_sharded_steps(config["PIPELINE_STEPS"])}
+    step_cache: Optional[LocalStepCache] = LocalStepCache(os.path.join(work_dir, "step_cache")) if use_cache else None
+    report: Dict[str, Any] = run_pipeline_locally(config, work_dir, max_workers, step_cache)
+
+    print(f"[{datetime.now()}] Pipeline finished in {report['wall_time_s']}s "
+          f"(sum of steps {report['sum_step_time_s']}s).")
+    for name, result in report["steps"].items():
+        print(f"    {name:<20} {result['status']:<10} {result['wall_time_s']:>8.2f}s")
+    print(f"    critical path: {' -> '.join(report['critical_path'])} ({report['critical_path_s']}s)")
+
+    with open(os.path.join(work_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+
+    if any(result["status"] not in ["succeeded", "cached"] for result in report["steps"].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_path', dest='config_path', required=True)
+    parser.add_argument('--work_dir', dest='work_dir', default='outputs/local_pipeline')
+    parser.add_argument('--max_workers', dest='max_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no_cache', dest='use_cache', action='store_false',
+                        help="run every step, even when its source, params and inputs did not change")
+    args = parser.parse_args()
+
+    with open(args.config_path) as f:
+        CONFIG: Dict[str, Any] = json.load(f)
+
+    main(CONFIG, args.work_dir, args.max_workers, args.use_cache)
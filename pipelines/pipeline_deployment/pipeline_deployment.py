@@ -1,119 +1,59 @@
 from venv import create
 from azureml.core.environment import Environment
 from azureml.core.runconfig import RunConfiguration, DockerConfiguration
-from azureml.core import Workspace, Experiment, Dataset
+from azureml.core import Workspace, Experiment, Dataset, Datastore
 from azureml.core.conda_dependencies import CondaDependencies
 from azureml.core.compute import AmlCompute, ComputeTarget
-from azureml.core.authentication import ServicePrincipalAuthentication, MsiAuthentication
 from azureml.data.file_dataset import FileDataset
+from azureml.data import OutputFileDatasetConfig
 from azureml.exceptions import ComputeTargetException
 from azureml.pipeline.core.run import PipelineRun
 from azureml.pipeline.steps import PythonScriptStep
 from azureml.pipeline.core import Pipeline, PipelineEndpoint
 from azureml.pipeline.core.graph import PipelineParameter
-from azureml.pipeline.core import StepSequence
 from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from pipeline_utils import add_datetime_as_param, get_step_dependencies, get_topological_order, stage_source_directory, expand_sharded_steps
+from step_cache import LocalStepCache, get_step_keys, hash_listing
+from compute_client import AzureMLComputeClient, get_compute_targets
 from datetime import datetime
 import argparse
 import json
+import sys
 import os
 
+# shared modules in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from workspace_session import get_workspace
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--config_path', dest='config_path', required=True)
-args = parser.parse_args()
 
-with open(args.config_path) as f:
-    CONFIG: Dict[str, Any] = json.load(f)
+# staged step folders (step source + shared modules) that are uploaded as step snapshots
+STAGING_DIR = "outputs/staged_steps"
 
+# params that differ between the shard copies of a step, passed as fixed arguments instead of pipeline parameters,
+# which have one default per name
+SHARD_PARAMS = ["shard_index", "shard_count"]
 
 def connect_to_aml_ws(config):
     ## WORKSPACE AUTHENTICATION
+    # the workspace and its auth are shared with the other deployment scripts running in the same process
     assert config["WORKSPACE_AUTH"] in ["from_config", "interactive", "service_principal", "managed_identity"]
 
-    if config["WORKSPACE_AUTH"] == "from_config":
-        # when running on azureml compute instance
-        ws = Workspace.from_config()
-        print(f"[{datetime.now()}] Authentication from config successful.")
-
-    elif config["WORKSPACE_AUTH"] == "interactive":
-        ws = Workspace(
-            subscription_id=os.environ["SUBSCRIPTION_ID"],
-            resource_group=os.environ["RESOURCE_GROUP_NAME"],
-            workspace_name=os.environ["WORKSPACE_NAME"])
-
-    elif config["WORKSPACE_AUTH"] == "service_principal":
-        sp = ServicePrincipalAuthentication(
-            tenant_id=os.environ["TENANT_ID"], 
-            service_principal_id=os.environ["SP_CLIENT_ID"], 
-            service_principal_password=os.environ["SP_SECRET"])
-        ws = Workspace(
-            subscription_id=os.environ["SUBSCRIPTION_ID"],
-            resource_group=os.environ["RESOURCE_GROUP_NAME"],
-            workspace_name=os.environ["WORKSPACE_NAME"],
-            auth=sp)
-        print(f"[{datetime.now()}] Service Principal Authentication successful.")
-        
-    elif config["WORKSPACE_AUTH"] == "managed_identity":
-        # when running on Azure VM
-        msi_auth = MsiAuthentication()
-        ws = Workspace(
-            subscription_id=os.environ["SUBSCRIPTION_ID"],
-            resource_group=os.environ["RESOURCE_GROUP_NAME"],
-            workspace_name=os.environ["WORKSPACE_NAME"],
-            auth=msi_auth)
-        print(f"[{datetime.now()}] Managed Identity Authentication successful.")
-
-    return ws
-
-
-def add_datetime_as_param(pipeline_params):
-    ## ADD DATETIME ARGUMENT FOR EACH STEP
-    dt: datetime = datetime.now()
-    run_datetime: str = f"{dt.year}{dt.month:02d}{dt.day:02d}_{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
-
-    # datetime string is passed to each step for dynamic paths
-    # format: yyyymmdd_HHMMSS
-    for step in pipeline_params:
-        step['run_datetime'] = run_datetime
-
-    return pipeline_params
-
-
-def get_compute_targets(ws, config, compute_configs):
-    ## COMPUTE TARGET
-    compute_targets: Dict[str, ComputeTarget] = {}
-    vm_sizes: Dict[str, str] = {"cpu": "STANDARD_DS3_V2", "gpu": "STANDARD_NC6"}
-    required_computes: List[str] = [step["COMPUTE"] for step in config["PIPELINE_STEPS"]]
-    for compute_type, compute_config in compute_configs.items():
-        for compute_name, num_nodes in compute_config.items():
-            try:
-                compute_targets[compute_name] = ComputeTarget(workspace=ws, name=compute_name)
-            except ComputeTargetException:
-                if compute_name in required_computes:            
-                    aml_compute_config = AmlCompute.provisioning_configuration(vm_size=vm_sizes[compute_type],
-                                                vm_priority="lowpriority", 
-                                                min_nodes=num_nodes["min"],
-                                                max_nodes=num_nodes["max"])
-                    compute_targets[compute_name] = ComputeTarget.create(workspace=ws, name=compute_name, provisioning_configuration=aml_compute_config)
-                    
-    for compute_config in compute_configs.values():
-        for compute_name in compute_config:
-            compute_targets[compute_name].wait_for_completion(show_output=False, min_node_count=None, timeout_in_minutes=180)
-            print(f"[{datetime.now()}] Compute target ready: {compute_name}")
-
-    print(f"[{datetime.now()}] Finished compute target setup.")
-
-    return compute_targets
-
-
-def create_pipeline_arguments(pipeline_params):
+    return get_workspace(config["WORKSPACE_AUTH"])
+
+
+def create_pipeline_arguments(pipeline_params, excluded_params):
     ## CREATE PIPELINE ARGUMENTS
+    # excluded_params: per step, params that are passed as step outputs instead of pipeline parameters
     pipeline_args: List[List[str, PipelineParameter]] = []
-    for step in pipeline_params:
+    for step, excluded in zip(pipeline_params, excluded_params):
         pipeline_args_per_step: List[str, PipelineParameter] = []
         for key in step:
+            if key in excluded:
+                continue
             pipeline_args_per_step.append(f"--{key}")
+            if key in SHARD_PARAMS:
+                pipeline_args_per_step.append(str(step[key]))
+                continue
             pipeline_args_per_step.append(PipelineParameter(
                 name=key,
                 default_value=step[key]
@@ -122,10 +62,62 @@ def create_pipeline_arguments(pipeline_params):
     return pipeline_args
 
 
-def create_run_config(env):
+def create_step_outputs(ws, config, cached_steps):
+    ## STEP OUTPUTS
+    # every produced dataset is written by its step to the output datastore and registered when the step
+    # completes, the consuming step mounts it directly instead of the step uploading and re-registering it
+    output_datastore: Datastore = Datastore.get(ws, datastore_name=config["OUTPUT_DATASTORE"])
+    step_outputs: Dict[str, OutputFileDatasetConfig] = {}
+    for step in config["PIPELINE_STEPS"]:
+        if step["NAME"] in cached_steps:
+            continue
+        for dataset_name, param_name in step.get("OUTPUT_DATASETS", {}).items():
+            step_outputs[dataset_name] = OutputFileDatasetConfig(
+                name=param_name,
+                destination=(output_datastore, step["PARAMS"][param_name])
+            ).as_upload(overwrite=True).register_on_complete(name=dataset_name)
+
+    return step_outputs
+
+
+def create_step_data_arguments(ws, step, step_outputs):
+    ## STEP DATA ARGUMENTS
+    # the scripts receive the folders of their inputs and outputs as arguments
+    data_args: List[Any] = []
+    for dataset_name, param_name in step.get("OUTPUT_DATASETS", {}).items():
+        data_args.extend([f"--{param_name}", step_outputs[dataset_name]])
+
+    for dataset_name, input_name in step["INPUT_DATASETS"].items():
+        if dataset_name in step_outputs:
+            # produced in this run
+            data_input = step_outputs[dataset_name].as_input(name=input_name)
+        else:
+            # registered dataset, also used when the producing step was skipped by the step cache
+            data_input = Dataset.get_by_name(ws, name=dataset_name).as_named_input(input_name).as_mount()
+        data_args.extend([f"--{input_name}", data_input])
+
+    return data_args
+
+
+def create_step_state_arguments(ws, config, step):
+    ## STEP STATE
+    # STATE_PATHS: folders on the output datastore that a step keeps between runs, e.g. the manifest of an
+    # incremental step, mounted read-write and never registered as a dataset
+    output_datastore: Datastore = Datastore.get(ws, datastore_name=config["OUTPUT_DATASTORE"])
+    state_args: List[Any] = []
+    for param_name, state_path in step.get("STATE_PATHS", {}).items():
+        state_args.extend([f"--{param_name}", OutputFileDatasetConfig(
+            name=f"{step['NAME']}_{param_name}",
+            destination=(output_datastore, state_path)
+        ).as_mount()])
+
+    return state_args
+
+
+def create_run_config(env, config):
     ## ASSIGN COMPUTE TARGET AND/OR ENVIRONMENT
     aml_run_config = RunConfiguration()
-    if "DOCKER_IMAGE" in CONFIG:
+    if "DOCKER_IMAGE" in config:
         docker_config = DockerConfiguration(use_docker=True)
         aml_run_config.docker=docker_config
     aml_run_config.environment = env
@@ -133,24 +125,92 @@ def create_run_config(env):
     return aml_run_config
 
 
-def main(CONFIG):
+def get_dataset_fingerprint(dataset):
+    # id and version stay the same when files are added to or replaced in the folder or glob of a file dataset,
+    # so the listing of its files is added: sizes and blob modification times, read from a mount without downloading
+    # None when there is no content signal, e.g. a tabular dataset from a sql query, the steps reading it always run
+    if not isinstance(dataset, FileDataset):
+        print(f"[{datetime.now()}] Dataset {dataset.name} is not a file dataset, steps reading it are not cached.")
+        return None
+    try:
+        with dataset.mount() as mount_context:
+            listing: str = hash_listing(mount_context.mount_point)
+    except Exception as e:
+        print(f"[{datetime.now()}] Dataset {dataset.name} could not be listed, steps reading it are not cached: {e!r}")
+        return None
+
+    return f"{dataset.id}:{dataset.version}:{listing}"
+
+
+def get_dataset_fingerprints(ws, pipeline_steps):
+    ## DATASET FINGERPRINTS
+    # registered datasets that are not produced by a step
+    produced_datasets: Set[str] = {name for step in pipeline_steps for name in step.get("OUTPUT_DATASETS", {})}
+    fingerprints: Dict[str, Optional[str]] = {}
+    for step in pipeline_steps:
+        for dataset_name in step["INPUT_DATASETS"]:
+            if dataset_name not in produced_datasets and dataset_name not in fingerprints:
+                fingerprints[dataset_name] = get_dataset_fingerprint(Dataset.get_by_name(ws, name=dataset_name))
+
+    return fingerprints
+
+
+def record_finished_runs(ws, experiment_name, step_cache):
+    ## RECORD STEP CACHE
+    # submitted runs are not waited for, the steps that finished successfully are added to the cache by the
+    # next deployment or by --record_cache, once their run completed
+    for pending in step_cache.get_pending():
+        pipeline_run: PipelineRun = PipelineRun(Experiment(ws, experiment_name), pending["run_id"])
+        status: str = pipeline_run.get_status()
+        if status not in ["Finished", "Failed", "Canceled"]:
+            print(f"[{datetime.now()}] Run {pending['run_id']} is {status}, its steps are cached once it completes.")
+            continue
+        for step_run in pipeline_run.get_steps():
+            if step_run.get_status() == "Finished" and pending["step_keys"].get(step_run.name) is not None:
+                step_cache.put(pending["step_keys"][step_run.name], step_run.name)
+                print(f"[{datetime.now()}] Cached step: {step_run.name} (run {pending['run_id']})")
+        step_cache.remove_pending(pending["run_id"])
+
+
+def get_cached_steps(step_cache, step_keys, step_dependencies):
+    ## CACHED STEPS
+    # a step is only skipped when every step it depends on is skipped as well
+    cached_steps: List[str] = []
+    for step_name in get_topological_order(step_dependencies):
+        if step_cache.get(step_keys[step_name]) is not None and \
+                all(dependency in cached_steps for dependency in step_dependencies[step_name]):
+            cached_steps.append(step_name)
+
+    return cached_steps
+
+
+def main(CONFIG, wait_for_completion=False):
+    # wait_for_completion: block until the submitted run completed and cache its steps right away
     
     ws = connect_to_aml_ws(CONFIG)
 
+    # steps with SHARDS fan out over the nodes of their cluster, one shard per node
+    max_nodes: Dict[str, int] = {compute_name: nodes["max"] for clusters in [CONFIG["CPU_CLUSTERS"], CONFIG["GPU_CLUSTERS"]]
+                                 for compute_name, nodes in clusters.items()}
+    CONFIG = {**CONFIG, "PIPELINE_STEPS": expand_sharded_steps(CONFIG["PIPELINE_STEPS"], max_nodes)}
+
     ## UNPACK CONFIG
     experiment_name: str = CONFIG["EXPERIMENT_NAME"]
 
+    step_names: List[str] = [step["NAME"] for step in CONFIG["PIPELINE_STEPS"]]
+
     script_names: List[str] = [step["SCRIPT"] for step in CONFIG["PIPELINE_STEPS"]]
 
-    run_with_previous_script: List[bool] = [step["RUN_WITH_PREVIOUS"] for step in CONFIG["PIPELINE_STEPS"]]
+    step_dependencies: Dict[str, List[str]] = get_step_dependencies(CONFIG["PIPELINE_STEPS"])
     
     source_dir_names: List[str] = [step["SOURCE_DIR"] for step in CONFIG["PIPELINE_STEPS"]]
-    source_directories: List[str] = [f"{CONFIG['SOURCE_DIR_PREFIX']}/{src_dir}" for src_dir in source_dir_names]
+    common_dir: Optional[str] = f"{CONFIG['SOURCE_DIR_PREFIX']}/{CONFIG['COMMON_DIR']}" if "COMMON_DIR" in CONFIG else None
+    source_directories: List[str] = [
+        stage_source_directory(f"{CONFIG['SOURCE_DIR_PREFIX']}/{src_dir}", f"{STAGING_DIR}/{step_name}", common_dir)
+        for src_dir, step_name in zip(source_dir_names, step_names)]
     
     step_targets: List[str] = [step["COMPUTE"] for step in CONFIG["PIPELINE_STEPS"]]
     
-    input_dataset_dicts: List[Dict[str, str]] = [step["INPUT_DATASETS"] for step in CONFIG["PIPELINE_STEPS"]]
-    
     pipeline_name: str = CONFIG["PIPELINE_NAME"]
     pipeline_description: str = CONFIG["PIPELINE_DESCRIPTION"]
     pipeline_params: List[Dict[str, str]] = [step["PARAMS"] for step in CONFIG["PIPELINE_STEPS"]]
@@ -186,6 +246,7 @@ def main(CONFIG):
         conda_dep.add_pip_package("azureml-defaults")
         conda_dep.add_pip_package("azureml-core")
         conda_dep.add_pip_package("azureml-dataprep[fuse]")
+        conda_dep.add_pip_package("pyarrow")
         if os.path.isfile('deployment/pipeline_requirements.txt'):
             with open(f"deployment/pipeline_requirements.txt", 'r') as f:
                 lines: List[str] = f.readlines()
@@ -194,42 +255,69 @@ def main(CONFIG):
         env.python.conda_dependencies = conda_dep
     print(f"[{datetime.now()}] Finished environment setup.")
 
-    compute_targets = get_compute_targets(ws, CONFIG, compute_configs)
-
-    pipeline_args = create_pipeline_arguments(pipeline_params)
-
-    aml_run_config = create_run_config(env)
+    compute_targets = get_compute_targets(AzureMLComputeClient(ws), CONFIG, compute_configs)
+
+    pipeline_args = create_pipeline_arguments(
+        pipeline_params, [list(step.get("OUTPUT_DATASETS", {}).values()) for step in CONFIG["PIPELINE_STEPS"]])
+
+    aml_run_config = create_run_config(env, CONFIG)
+
+    ## STEP CACHE
+    # steps whose source, params (without run_datetime) and inputs did not change since their last
+    # successful run are left out, their outputs are still on the datastore
+    # only for direct submissions, a published endpoint has to contain every step
+    step_cache: Optional[LocalStepCache] = None
+    cached_steps: List[str] = []
+    if "STEP_CACHE_DIR" in CONFIG and not CONFIG["DEPLOY_PIPELINE_ENDPOINT"]:
+        step_cache = LocalStepCache(CONFIG["STEP_CACHE_DIR"])
+        record_finished_runs(ws, experiment_name, step_cache)
+        step_keys: Dict[str, Optional[str]] = get_step_keys(
+            CONFIG["PIPELINE_STEPS"],
+            step_dependencies,
+            dict(zip(step_names, source_directories)),
+            dict(zip(step_names, pipeline_params)),
+            get_dataset_fingerprints(ws, CONFIG["PIPELINE_STEPS"]))
+        cached_steps = get_cached_steps(step_cache, step_keys, step_dependencies)
+        print(f"[{datetime.now()}] Cached steps: {cached_steps or 'none'}")
+
+        if len(cached_steps) == len(step_names):
+            print(f"[{datetime.now()}] All steps are cached, nothing to run.")
+            return
+
+    step_outputs: Dict[str, OutputFileDatasetConfig] = create_step_outputs(ws, CONFIG, cached_steps)
 
     # CREATE PIPELINE STEPS
-    pipeline_steps: List[PythonScriptStep] = []
-    parallel_runs_count = 0
+    pipeline_steps: Dict[str, PythonScriptStep] = {}
     for step_nr, step in enumerate(CONFIG["PIPELINE_STEPS"]):
-        # tabular datasets are not mounted
-        input_datasets: List[FileDataset] = [Dataset.get_by_name(ws, name=key).as_named_input(value).as_mount(path_on_compute=value) 
-            for (key, value) in input_dataset_dicts[step_nr].items()]
-    
+        if step["NAME"] in cached_steps:
+            print(f"[{datetime.now()}] Skipped cached step: {step['NAME']}")
+            continue
+
+        # reuse is decided by the step cache, AzureML reuse never hits because run_datetime changes every run
         script_step = PythonScriptStep(
+        name=step["NAME"],
         script_name=script_names[step_nr],
         source_directory=source_directories[step_nr],
-        inputs=input_datasets,
-        arguments=pipeline_args[step_nr],
+        arguments=pipeline_args[step_nr] + create_step_data_arguments(ws, step, step_outputs) + create_step_state_arguments(ws, CONFIG, step),
         compute_target=compute_targets[step_targets[step_nr]],
         runconfig=aml_run_config,
         allow_reuse=False)
 
-        if run_with_previous_script[step_nr]:
-            parallel_runs_count += 1
-            if isinstance(pipeline_steps[step_nr - parallel_runs_count], list):
-                pipeline_steps[step_nr - parallel_runs_count].append(script_step)
-            else:
-                pipeline_steps[step_nr - parallel_runs_count] = [pipeline_steps[step_nr - parallel_runs_count], script_step]
-        else:
-            pipeline_steps.append(script_step)
+        pipeline_steps[step["NAME"]] = script_step
         print(f"[{datetime.now()}] Created step: {step['NAME']}")
 
+    # steps only wait for the steps they depend on, independent branches run concurrently
+    for step_name in get_topological_order(step_dependencies):
+        if step_name in cached_steps:
+            continue
+        dependencies: List[str] = [dep for dep in step_dependencies[step_name] if dep not in cached_steps]
+        for dependency in dependencies:
+            pipeline_steps[step_name].run_after(pipeline_steps[dependency])
+        print(f"[{datetime.now()}] Step {step_name} runs after: {dependencies or 'nothing'}")
+
 
     ## CREATE PIPELINE 
-    pipeline = Pipeline(workspace=ws, steps=StepSequence(pipeline_steps))
+    pipeline = Pipeline(workspace=ws, steps=list(pipeline_steps.values()))
 
     published_pipeline: Any = pipeline.publish(
         name=pipeline_name,
@@ -273,6 +361,28 @@ def main(CONFIG):
         active_run: PipelineRun = exp.submit(published_pipeline)
         print(f"[{datetime.now()}] Run submitted successfully.")
 
+        if step_cache is not None:
+            # only steps that finished successfully are added to the cache, once the run completed
+            step_cache.add_pending(active_run.id, step_keys)
+            if wait_for_completion:
+                print(f"[{datetime.now()}] Waiting for the run to complete to update the step cache...")
+                active_run.wait_for_completion(show_output=False, raise_on_error=False)
+                record_finished_runs(ws, experiment_name, step_cache)
+
 
 if __name__ == '__main__':
-    main(CONFIG)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_path', dest='config_path', required=True)
+    parser.add_argument('--wait', dest='wait', action='store_true',
+                        help="wait for the submitted run and add its finished steps to the step cache")
+    parser.add_argument('--record_cache', dest='record_cache', action='store_true',
+                        help="only add the finished steps of completed runs to the step cache, nothing is submitted")
+    args = parser.parse_args()
+
+    with open(args.config_path) as f:
+        CONFIG: Dict[str, Any] = json.load(f)
+
+    if args.record_cache:
+        record_finished_runs(connect_to_aml_ws(CONFIG), CONFIG["EXPERIMENT_NAME"], LocalStepCache(CONFIG["STEP_CACHE_DIR"]))
+    else:
+        main(CONFIG, args.wait)
\ No newline at end of file
@@ -0,0 +1,157 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from datetime import datetime
+import shutil
+
+
+def add_datetime_as_param(pipeline_params):
+    ## ADD DATETIME ARGUMENT FOR EACH STEP
+    dt: datetime = datetime.now()
+    run_datetime: str = f"{dt.year}{dt.month:02d}{dt.day:02d}_{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
+
+    # datetime string is passed to each step for dynamic paths
+    # format: yyyymmdd_HHMMSS
+    for step in pipeline_params:
+        step['run_datetime'] = run_datetime
+
+    return pipeline_params
+
+
+def get_step_dependencies(pipeline_steps):
+    ## STEP DEPENDENCIES
+    # a step depends on
+    #   - every step that lists one of its INPUT_DATASETS in OUTPUT_DATASETS
+    #   - every step named in its optional DEPENDS_ON list
+    # configs that still use RUN_WITH_PREVIOUS keep the original sequential behaviour:
+    # a step runs after the previous step (group), or next to it when RUN_WITH_PREVIOUS is true
+    step_names: List[str] = [step["NAME"] for step in pipeline_steps]
+    assert len(set(step_names)) == len(step_names), "step names must be unique"
+
+    producers: Dict[str, str] = {}
+    for step in pipeline_steps:
+        for dataset_name in step.get("OUTPUT_DATASETS", {}):
+            assert dataset_name not in producers, f"dataset '{dataset_name}' is produced by more than one step"
+            producers[dataset_name] = step["NAME"]
+
+    dependencies: Dict[str, List[str]] = {}
+    previous_group: List[str] = []
+    current_group: List[str] = []
+    for step_nr, step in enumerate(pipeline_steps):
+        step_dependencies: List[str] = [producers[dataset_name] for dataset_name in step["INPUT_DATASETS"]
+                                        if dataset_name in producers]
+
+        for dependency in step.get("DEPENDS_ON", []):
+            assert dependency in step_names, f"step '{step['NAME']}' depends on unknown step '{dependency}'"
+            step_dependencies.append(dependency)
+
+        if "RUN_WITH_PREVIOUS" in step:
+            # steps running together form a group, the next group waits for all of them
+            if step["RUN_WITH_PREVIOUS"] and step_nr > 0:
+                current_group.append(step["NAME"])
+            else:
+                previous_group, current_group = current_group, [step["NAME"]]
+            step_dependencies.extend(previous_group)
+
+        dependencies[step["NAME"]] = sorted(set(step_dependencies) - {step["NAME"]})
+
+    # fails on cycles
+    get_topological_order(dependencies)
+
+    return dependencies
+
+
+def expand_sharded_steps(pipeline_steps, max_nodes=None):
+    ## SHARDED STEPS
+    # a step with "SHARDS": n runs as n copies of its script over disjoint slices of its input rows
+    # (--shard_index/--shard_count), each writing its own <dataset>-shard-<index> dataset, followed by a merge step
+    # with the name and output dataset of the original step, so consumers and DEPENDS_ON are unchanged
+    # max_nodes: max nodes per compute, one node runs one shard at a time so shards are capped at it
+    # steps without SHARDS are returned unchanged
+    expanded_steps: List[Dict[str, Any]] = []
+    for step in pipeline_steps:
+        shard_count: int = step.get("SHARDS", 1)
+        if max_nodes is not None and step["COMPUTE"] in max_nodes and shard_count > max_nodes[step["COMPUTE"]]:
+            print(f"[{datetime.now()}] Step {step['NAME']}: {shard_count} shards capped at "
+                  f"{max_nodes[step['COMPUTE']]}, the max nodes of {step['COMPUTE']}")
+            shard_count = max_nodes[step["COMPUTE"]]
+        step = {key: value for key, value in step.items() if key != "SHARDS"}
+        if shard_count <= 1:
+            expanded_steps.append(step)
+            continue
+
+        assert len(step.get("OUTPUT_DATASETS", {})) == 1, f"sharded step '{step['NAME']}' must have one output dataset"
+        assert "RUN_WITH_PREVIOUS" not in step, f"sharded step '{step['NAME']}' must use DEPENDS_ON instead of RUN_WITH_PREVIOUS"
+        (dataset_name, param_name), = step["OUTPUT_DATASETS"].items()
+        output_path: str = step["PARAMS"][param_name].rstrip("/")
+
+        shard_datasets: Dict[str, str] = {}
+        for shard_index in range(shard_count):
+            shard_dataset: str = f"{dataset_name}-shard-{shard_index}"
+            shard_datasets[shard_dataset] = f"shard_input_{shard_index}"
+            expanded_steps.append({
+                **step,
+                "NAME": f"{step['NAME']}_shard_{shard_index}",
+                "PARAMS": {**step["PARAMS"], param_name: f"{output_path}_shards/{shard_index}/",
+                           "shard_index": shard_index, "shard_count": shard_count},
+                "OUTPUT_DATASETS": {shard_dataset: param_name}
+            })
+
+        # COMMON_DIR is staged next to every step script, so the merge script is part of the step source
+        expanded_steps.append({
+            "NAME": step["NAME"],
+            "SCRIPT": "merge_shards.py",
+            "SOURCE_DIR": step["SOURCE_DIR"],
+            "COMPUTE": step["COMPUTE"],
+            "PARAMS": {"merged_output_path": step["PARAMS"][param_name], "shard_count": shard_count},
+            "INPUT_DATASETS": shard_datasets,
+            "OUTPUT_DATASETS": {dataset_name: "merged_output_path"}
+        })
+
+    return expanded_steps
+
+
+def get_topological_order(dependencies):
+    ## TOPOLOGICAL ORDER
+    # steps without dependencies first, ties keep the config order
+    order: List[str] = []
+    done: Set[str] = set()
+    while len(order) < len(dependencies):
+        ready: List[str] = [name for name, deps in dependencies.items()
+                            if name not in done and all(dep in done for dep in deps)]
+        if not ready:
+            raise ValueError(f"Pipeline steps contain a dependency cycle: {sorted(set(dependencies) - done)}")
+        order.extend(ready)
+        done.update(ready)
+
+    return order
+
+
+def get_critical_path(dependencies, durations):
+    ## CRITICAL PATH
+    # longest chain of dependent steps, weighted by step duration
+    finish: Dict[str, float] = {}
+    previous: Dict[str, Optional[str]] = {}
+    for name in get_topological_order(dependencies):
+        slowest: Optional[str] = max(dependencies[name], key=lambda dep: finish[dep], default=None)
+        previous[name] = slowest
+        finish[name] = durations.get(name, 0.0) + (finish[slowest] if slowest is not None else 0.0)
+
+    path: List[str] = []
+    step: Optional[str] = max(finish, key=finish.get, default=None)
+    while step is not None:
+        path.insert(0, step)
+        step = previous[step]
+
+    return path, (finish[path[-1]] if path else 0.0)
+
+
+def stage_source_directory(source_dir, staging_dir, common_dir=None):
+    ## STAGE STEP SOURCE
+    # copy of the step folder with the shared modules of COMMON_DIR next to the script,
+    # AzureML only uploads the source directory of a step
+    ignore = shutil.ignore_patterns("__pycache__", "*.pyc")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    shutil.copytree(source_dir, staging_dir, ignore=ignore)
+    if common_dir is not None:
+        shutil.copytree(common_dir, staging_dir, ignore=ignore, dirs_exist_ok=True)
+
+    return staging_dir
@@ -0,0 +1,163 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from pipeline_utils import get_topological_order
+from datetime import datetime
+import hashlib
+import shutil
+import json
+import os
+
+
+# params that change on every run and do not influence the step output
+VOLATILE_PARAMS: List[str] = ["run_datetime"]
+
+IGNORED_DIRS: List[str] = ["__pycache__", ".ipynb_checkpoints"]
+
+
+def hash_directory(path):
+    ## DIRECTORY HASH
+    # content hash over all files, relative paths are included so renames change the hash
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+        for file_name in sorted(files):
+            if file_name.endswith(".pyc"):
+                continue
+            file_path: str = os.path.join(root, file_name)
+            sha.update(os.path.relpath(file_path, path).replace(os.sep, "/").encode())
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+
+    return sha.hexdigest()
+
+
+def hash_listing(path):
+    ## LISTING HASH
+    # relative path, size and modification time of every file, no file is read
+    # used for mounted datasets, where reading the content would download it
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(dirs)
+        for file_name in sorted(files):
+            file_path: str = os.path.join(root, file_name)
+            stat = os.stat(file_path)
+            sha.update(f"{os.path.relpath(file_path, path).replace(os.sep, '/')}:{stat.st_size}:{stat.st_mtime}\n".encode())
+
+    return sha.hexdigest()
+
+
+def compute_step_key(source_dir, params, input_fingerprints):
+    ## STEP CACHE KEY
+    # source_dir: folder that is uploaded for the step
+    # params: step arguments, volatile params are dropped
+    # input_fingerprints: input dataset name -> fingerprint (upstream step key or data hash)
+    key_content: Dict[str, Any] = {
+        "source": hash_directory(source_dir),
+        "params": {key: str(value) for key, value in params.items() if key not in VOLATILE_PARAMS},
+        "inputs": input_fingerprints
+    }
+
+    return hashlib.sha256(json.dumps(key_content, sort_keys=True).encode()).hexdigest()
+
+
+def get_step_keys(pipeline_steps, dependencies, source_directories, step_params, external_fingerprints):
+    ## STEP KEYS FOR A WHOLE PIPELINE
+    # datasets produced inside the pipeline are fingerprinted by the key of the producing step,
+    # so a change upstream invalidates every step downstream without reading any data
+    # a step gets no key, so it always runs, when it has "CACHE": false, when an external input has no fingerprint
+    # (None) or when a step it depends on has no key
+    steps: Dict[str, Dict[str, Any]] = {step["NAME"]: step for step in pipeline_steps}
+    producer_keys: Dict[str, str] = {}
+    step_keys: Dict[str, str] = {}
+    for name in get_topological_order(dependencies):
+        input_fingerprints: Dict[str, str] = {
+            dataset_name: producer_keys.get(dataset_name, external_fingerprints.get(dataset_name, ""))
+            for dataset_name in steps[name]["INPUT_DATASETS"]
+        }
+        # steps in DEPENDS_ON hand over something else than a dataset, e.g. the registered model
+        for dependency in steps[name].get("DEPENDS_ON", []):
+            input_fingerprints[f"step:{dependency}"] = step_keys[dependency]
+        if steps[name].get("CACHE", True) is False or None in input_fingerprints.values():
+            step_keys[name] = None
+        else:
+            step_keys[name] = compute_step_key(source_directories[name], step_params[name], input_fingerprints)
+        for dataset_name in steps[name].get("OUTPUT_DATASETS", {}):
+            producer_keys[dataset_name] = step_keys[name]
+
+    return step_keys
+
+
+class LocalStepCache:
+    # File based cache: <cache_dir>/<key>/entry.json plus a copy of every output folder of the step.
+    # Steps that write to a datastore are cached without outputs, the data stays where the step wrote it.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        # steps without a key are never cached
+        if key is None:
+            return None
+        entry_path: str = os.path.join(self._entry_dir(key), "entry.json")
+        if not os.path.isfile(entry_path):
+            return None
+        with open(entry_path) as f:
+            return json.load(f)
+
+    def put(self, key, step_name, output_dirs=None):
+        # output_dirs: output dataset name -> local folder written by the step
+        if key is None:
+            return None
+        output_dirs = output_dirs or {}
+        entry_dir: str = self._entry_dir(key)
+        tmp_dir: str = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        for dataset_name, output_dir in output_dirs.items():
+            shutil.copytree(output_dir, os.path.join(tmp_dir, "outputs", dataset_name))
+
+        entry: Dict[str, Any] = {
+            "key": key,
+            "step": step_name,
+            "created": str(datetime.now()),
+            "outputs": sorted(output_dirs)
+        }
+        with open(os.path.join(tmp_dir, "entry.json"), "w") as f:
+            json.dump(entry, f, indent=4)
+
+        # entries only become visible once complete
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+        return entry
+
+    def add_pending(self, run_id, step_keys):
+        # submitted run whose finished steps are added to the cache once it completes, see record_finished_runs
+        os.makedirs(os.path.join(self.cache_dir, "pending"), exist_ok=True)
+        with open(os.path.join(self.cache_dir, "pending", f"{run_id}.json"), "w") as f:
+            json.dump({"run_id": run_id, "submitted": str(datetime.now()), "step_keys": step_keys}, f, indent=4)
+
+    def get_pending(self):
+        pending_dir: str = os.path.join(self.cache_dir, "pending")
+        if not os.path.isdir(pending_dir):
+            return []
+        pending: List[Dict[str, Any]] = []
+        for file_name in sorted(os.listdir(pending_dir)):
+            with open(os.path.join(pending_dir, file_name)) as f:
+                pending.append(json.load(f))
+        return pending
+
+    def remove_pending(self, run_id):
+        pending_path: str = os.path.join(self.cache_dir, "pending", f"{run_id}.json")
+        if os.path.isfile(pending_path):
+            os.remove(pending_path)
+
+    def restore(self, key, output_dirs):
+        # copies the cached outputs back to the folders the step would have written
+        for dataset_name, output_dir in output_dirs.items():
+            shutil.rmtree(output_dir, ignore_errors=True)
+            shutil.copytree(os.path.join(self._entry_dir(key), "outputs", dataset_name), output_dir)
@@ -0,0 +1,88 @@
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from datetime import datetime
+import statistics
+import argparse
+import glob
+import json
+import os
+
+
+# written by step_telemetry.StepTelemetry in the working directory of every step
+TELEMETRY_FILE = "telemetry.jsonl"
+
+
+def load_step_runs(work_dir):
+    ## LOAD TELEMETRY
+    # step name -> runs in the order they finished, from the step folders of the local runner
+    step_runs: Dict[str, List[Dict[str, Any]]] = {}
+    for file_path in sorted(glob.glob(os.path.join(work_dir, "steps", "*", TELEMETRY_FILE))):
+        with open(file_path) as f:
+            runs: List[Dict[str, Any]] = [json.loads(line) for line in f if line.strip()]
+        for run in runs:
+            step_runs.setdefault(run["step"], []).append(run)
+
+    return step_runs
+
+
+def summarize_phases(runs, last_runs):
+    ## PHASE SUMMARY
+    # latest run of every phase compared with the previous run and the median of the last runs
+    runs = runs[-last_runs:]
+    phase_names: List[str] = list(dict.fromkeys(["total"] + [phase["phase"] for run in runs for phase in run["phases"]]))
+
+    rows: List[Dict[str, Any]] = []
+    for phase_name in phase_names:
+        if phase_name == "total":
+            records: List[Dict[str, Any]] = runs
+        else:
+            records = [phase for run in runs for phase in run["phases"] if phase["phase"] == phase_name]
+        wall_times: List[float] = [record["wall_time_s"] for record in records]
+        median: float = statistics.median(wall_times)
+        rows.append({
+            "phase": phase_name,
+            "runs": len(records),
+            "last_s": wall_times[-1],
+            "previous_s": wall_times[-2] if len(wall_times) > 1 else None,
+            "median_s": median,
+            "change": (wall_times[-1] - median) / median if median > 0 else None,
+            "cpu_s": records[-1]["cpu_time_s"],
+            "peak_rss_mb": records[-1]["peak_rss_mb"],
+            "rows": records[-1].get("rows")
+        })
+
+    return rows
+
+
+def main(work_dir, last_runs, output_path=None):
+    step_runs: Dict[str, List[Dict[str, Any]]] = load_step_runs(work_dir)
+    if not step_runs:
+        print(f"[{datetime.now()}] No step telemetry found in {work_dir}, run the pipeline locally first.")
+        return {}
+
+    summary: Dict[str, List[Dict[str, Any]]] = {}
+    print(f"[{datetime.now()}] Step telemetry of the last {last_runs} runs, change is the last run against the median.")
+    print(f"    {'step':<12} {'phase':<16} {'runs':>4} {'last_s':>9} {'prev_s':>9} {'median_s':>9} {'change':>7} "
+          f"{'cpu_s':>8} {'rss_mb':>8} {'rows':>9}")
+    for step_name, runs in step_runs.items():
+        summary[step_name] = summarize_phases(runs, last_runs)
+        for row in summary[step_name]:
+            previous: str = f"{row['previous_s']:.3f}" if row["previous_s"] is not None else "-"
+            change: str = f"{row['change']:+.0%}" if row["change"] is not None else "-"
+            print(f"    {step_name:<12} {row['phase']:<16} {row['runs']:>4} {row['last_s']:>9.3f} {previous:>9} "
+                  f"{row['median_s']:>9.3f} {change:>7} {row['cpu_s']:>8.3f} {str(row['peak_rss_mb']):>8} {str(row['rows']):>9}")
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(summary, f, indent=4)
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--work_dir', dest='work_dir', default='outputs/local_pipeline')
+    parser.add_argument('--last_runs', dest='last_runs', type=int, default=10)
+    parser.add_argument('--output_path', dest='output_path', default=None)
+    args = parser.parse_args()
+
+    main(args.work_dir, args.last_runs, args.output_path)
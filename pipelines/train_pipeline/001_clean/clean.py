@@ -1,37 +1,131 @@
 import os
+import hashlib
 import argparse
 import pandas as pd
-from azureml.core import Run, Experiment, Workspace, Datastore
+from datetime import datetime
+from step_run import get_run_context
+from step_io import StepInput, StepOutput, common_dtypes, READERS
+from step_telemetry import StepTelemetry
+from dataset_manifest import MANIFEST_NAME, DatasetManifest, LocalDirectoryBackend
 
 # Read dataset, code specific for ML pipelines
 parser = argparse.ArgumentParser()
 # run_datetime is not actually used in current demo
 parser.add_argument('--run_datetime', dest='run_datetime', required=True)
+# folder with the input data, a dataset mount on AzureML and a local folder in the local runner
+parser.add_argument('--titanic_input_dataset', dest='input_path', required=True)
 parser.add_argument('--cleaned_output_path', dest='output_path', required=True)
+# rows per chunk in streaming mode, 0 loads the whole dataset in memory
+parser.add_argument('--chunksize', dest='chunksize', type=int, default=0)
+# 1 reads only the raw files that are new or changed since the last run, every data file below the input folder
+parser.add_argument('--incremental', dest='incremental', type=int, default=0)
+# folder that keeps the manifest and the cleaned parts between runs, STATE_PATHS in the pipeline config
+parser.add_argument('--state_path', dest='state_path', default='')
+# shard of the input rows when the step runs with SHARDS in the pipeline config, set by the deployment
+parser.add_argument('--shard_index', dest='shard_index', type=int, default=0)
+parser.add_argument('--shard_count', dest='shard_count', type=int, default=1)
 args = parser.parse_args()
+assert args.shard_count == 1 or not (args.incremental or args.chunksize), "shards are cleaned in memory, without incremental or chunksize"
 
-run = Run.get_context(allow_offline=False)
-experiment = run.experiment
-ws = experiment.workspace 
+run = get_run_context()
+telemetry = StepTelemetry(run, 'clean', args.run_datetime)
 
-mounted_path = run.input_datasets['titanic_input_dataset']
-csv_path = os.path.join(mounted_path, 'titanic_dataset.csv')
+step_input = StepInput(args.input_path)
+step_output = StepOutput(args.output_path)
 
-# From here on, we can reuse the code from the notebooks
-df = pd.read_csv(csv_path)
+if args.incremental:
+    # Incremental mode, for append-only raw data
+    # every raw file is read once into its own part (without the Age fill, which depends on all files),
+    # the manifest in the state folder tracks the hash of every file and the Age sum/count of its part,
+    # the output folder only gets the merged dataset, it starts empty on AzureML
+    assert args.state_path, "incremental mode needs a --state_path that is kept between runs"
+    backend = LocalDirectoryBackend(args.input_path)
+    manifest_path = os.path.join(args.state_path, f"{MANIFEST_NAME}.json")
+    parts_dir = os.path.join(args.state_path, 'parts')
+    os.makedirs(parts_dir, exist_ok=True)
 
-df['Age'] = df['Age'].fillna(round(df['Age'].mean()))
-df['Embarked'] = df['Embarked'].fillna('S')
+    with telemetry.phase('manifest') as phase:
+        previous = DatasetManifest.load(manifest_path)
+        manifest = DatasetManifest.build(backend, previous)
+        diff = manifest.diff(previous)
+    print(f"[{datetime.now()}] Raw files: {diff.summary()}, {manifest.hashed} hashed")
 
-if not os.path.exists('data/'):
-    os.makedirs('data/')
+    def part_path(relative_path):
+        return os.path.join(parts_dir, f"{hashlib.sha1(relative_path.encode()).hexdigest()[:16]}.parquet")
 
-df.to_csv('data/titanic_dataset.csv', index=False)
+    data_files = [path for path in manifest.files if path.rsplit('.', 1)[-1] in READERS]
+    # unchanged files whose part is missing, e.g. after a failed run, are read again
+    to_process = [path for path in data_files if path in diff.to_process or not os.path.isfile(part_path(path))]
 
-# Write dataset, code specific for ML pipelines
-datastore = Datastore.get(ws, datastore_name='bc_blob')
+    with telemetry.phase('read_transform', rows=0) as phase:
+        for relative_path in diff.removed + diff.changed:
+            if os.path.isfile(part_path(relative_path)):
+                os.remove(part_path(relative_path))
 
-datastore.upload(
-    src_dir='data/',
-    target_path=args.output_path,
-    overwrite=True)
\ No newline at end of file
+        for relative_path in to_process:
+            part = READERS[relative_path.rsplit('.', 1)[-1]](backend.local_path(relative_path))
+            part.to_parquet(part_path(relative_path), index=False)
+            manifest.set_stats(relative_path, {'rows': len(part), 'age_sum': float(part['Age'].sum()),
+                                               'age_count': int(part['Age'].count())})
+            phase['rows'] += len(part)
+
+    # the Age mean over all files, from the stats of every part
+    stats = [manifest.get_stats(path) for path in data_files]
+    age_fill = round(sum(stat['age_sum'] for stat in stats) / sum(stat['age_count'] for stat in stats))
+
+    with telemetry.phase('merge_write') as phase:
+        df = pd.concat([pd.read_parquet(part_path(path)) for path in data_files], ignore_index=True)
+        df['Age'] = df['Age'].fillna(age_fill)
+        df['Embarked'] = df['Embarked'].fillna('S')
+        step_output.write(df)
+        phase['rows'] = len(df)
+
+    # saved last, a failed run is repeated from the previous manifest
+    manifest.save(manifest_path)
+elif args.chunksize > 0:
+    # Streaming mode, memory is bounded by the chunk size
+    # first pass: the Age mean over the whole dataset and the dtypes that fit all chunks
+    with telemetry.phase('scan') as phase:
+        age_sum, age_count, chunk_dtypes, phase['rows'] = 0.0, 0, [], 0
+        for chunk in step_input.iter_chunks(args.chunksize):
+            age_sum += chunk['Age'].sum()
+            age_count += chunk['Age'].count()
+            chunk_dtypes.append(chunk.dtypes)
+            phase['rows'] += len(chunk)
+
+    dtypes = common_dtypes(chunk_dtypes)
+    age_fill = round(age_sum / age_count)
+
+    # second pass: clean and write chunk by chunk, reading, cleaning and writing are interleaved
+    with telemetry.phase('clean_write', rows=0) as phase:
+        def clean_chunks():
+            for chunk in step_input.iter_chunks(args.chunksize):
+                chunk = chunk.astype(dtypes)
+                chunk['Age'] = chunk['Age'].fillna(age_fill)
+                chunk['Embarked'] = chunk['Embarked'].fillna('S')
+                phase['rows'] += len(chunk)
+                yield chunk
+
+        step_output.write_chunks(clean_chunks())
+else:
+    # From here on, we can reuse the code from the notebooks
+    # a shard cleans its slice of the rows, with the Age mean of all rows so every shard fills the same value
+    with telemetry.phase('read') as phase:
+        df = step_input.read_shard(args.shard_index, args.shard_count) if args.shard_count > 1 else step_input.read()
+        phase['rows'] = len(df)
+
+    with telemetry.phase('transform', rows=len(df)):
+        age = step_input.read(columns=['Age'])['Age'] if args.shard_count > 1 else df['Age']
+        age_fill = round(age.mean())
+
+        df['Age'] = df['Age'].fillna(age_fill)
+        df['Embarked'] = df['Embarked'].fillna('S')
+
+    # Write dataset, the output folder is uploaded and registered by AzureML, no datastore round trip needed
+    with telemetry.phase('write', rows=len(df)):
+        step_output.write(df)
+
+# the fill values are part of the preprocessing applied again at scoring time
+step_output.write_json('fill_values', {'Age': float(age_fill), 'Embarked': 'S'})
+
+telemetry.finish()
@@ -1,38 +1,99 @@
 import os
 import argparse
 import pandas as pd
-from azureml.core import Run, Experiment, Workspace, Datastore
+from step_run import get_run_context
+from step_io import StepInput, StepOutput, common_dtypes
+from preprocessing_spec import PREPROCESSING_SPEC_NAME, create_preprocessing_spec
+from step_telemetry import StepTelemetry
 
 # Read dataset, code specific for ML pipelines
 parser = argparse.ArgumentParser()
 # run_datetime is not actually used in current demo
 parser.add_argument('--run_datetime', dest='run_datetime', required=True)
+# folder with the input data, a dataset mount on AzureML and a local folder in the local runner
+parser.add_argument('--titanic_input_dataset', dest='input_path', required=True)
 parser.add_argument('--preprocessed_output_path', dest='output_path', required=True)
+# rows per chunk in streaming mode, 0 loads the whole dataset in memory
+parser.add_argument('--chunksize', dest='chunksize', type=int, default=0)
+# shard of the input rows when the step runs with SHARDS in the pipeline config, set by the deployment
+parser.add_argument('--shard_index', dest='shard_index', type=int, default=0)
+parser.add_argument('--shard_count', dest='shard_count', type=int, default=1)
 args = parser.parse_args()
+assert args.shard_count == 1 or not args.chunksize, "shards are preprocessed in memory, without chunksize"
 
-run = Run.get_context(allow_offline=False)
-experiment = run.experiment
-ws = experiment.workspace 
+run = get_run_context()
+telemetry = StepTelemetry(run, 'preprocess', args.run_datetime)
 
-mounted_path = run.input_datasets['titanic_input_dataset']
-csv_path = os.path.join(mounted_path, 'titanic_dataset.csv')
+target = 'Survived'
+columns = ['Survived', 'Pclass', 'Sex', 'Age', 'Fare', 'Embarked']
+numeric_columns = ['Age', 'Fare']
+categorical_columns = ['Pclass', 'Sex', 'Embarked']
 
-# From here on, we can reuse the code from the notebooks
-df = pd.read_csv(csv_path)
+step_input = StepInput(args.input_path)
+step_output = StepOutput(args.output_path)
 
-df = df[['Survived', 'Pclass', 'Sex', 'Age', 'Fare', 'Embarked']]
+if args.chunksize > 0:
+    # Streaming mode, memory is bounded by the chunk size
+    # first pass: the categories of every categorical column and the dtypes that fit all chunks
+    with telemetry.phase('scan', rows=0) as phase:
+        vocabularies, chunk_dtypes = {col: set() for col in categorical_columns}, []
+        for chunk in step_input.iter_chunks(args.chunksize, columns=columns):
+            for col in categorical_columns:
+                vocabularies[col].update(chunk[col].dropna().unique())
+            chunk_dtypes.append(chunk.dtypes)
+            phase['rows'] += len(chunk)
 
-df = pd.get_dummies(data=df, columns=['Pclass', 'Sex', 'Embarked'], drop_first=True)
+    dtypes = common_dtypes(chunk_dtypes)
+    # sorted like get_dummies sorts the values it finds, so the dummy columns match the in-memory path
+    categories = {col: pd.Index(list(vocabularies[col])).astype(dtypes[col]).unique().sort_values()
+                  for col in categorical_columns}
 
-if not os.path.exists('data/'):
-    os.makedirs('data/')
+    # second pass: encode with the global categories and write chunk by chunk
+    output_columns = []
 
-df.to_csv('data/titanic_dataset.csv', index=False)
+    with telemetry.phase('transform_write', rows=0) as phase:
+        def preprocess_chunks():
+            for chunk in step_input.iter_chunks(args.chunksize, columns=columns):
+                chunk = chunk[columns].astype(dtypes)
+                for col in categorical_columns:
+                    chunk[col] = pd.Categorical(chunk[col], categories=categories[col])
+                chunk = pd.get_dummies(data=chunk, columns=categorical_columns, drop_first=True)
+                output_columns[:] = list(chunk.columns)
+                phase['rows'] += len(chunk)
+                yield chunk
 
-# Write dataset, code specific for ML pipelines
-datastore = Datastore.get(ws, datastore_name='bc_blob')
+        step_output.write_chunks(preprocess_chunks())
+    feature_columns = [col for col in output_columns if col != target]
+else:
+    # From here on, we can reuse the code from the notebooks
+    # a shard preprocesses its slice of the rows, with the categories of all rows so every shard has the same columns
+    with telemetry.phase('read') as phase:
+        df = step_input.read_shard(args.shard_index, args.shard_count) if args.shard_count > 1 else step_input.read()
+        phase['rows'] = len(df)
 
-datastore.upload(
-    src_dir='data/',
-    target_path=args.output_path,
-    overwrite=True)
\ No newline at end of file
+    with telemetry.phase('transform', rows=len(df)):
+        df = df[columns]
+        fit_df = step_input.read(columns=categorical_columns) if args.shard_count > 1 else df
+        categories = {col: fit_df[col].dropna().unique() for col in categorical_columns}
+        categories = {col: pd.Index(values).sort_values() for col, values in categories.items()}
+
+        if args.shard_count > 1:
+            for col in categorical_columns:
+                df[col] = pd.Categorical(df[col], categories=categories[col])
+        df = pd.get_dummies(data=df, columns=categorical_columns, drop_first=True)
+
+    # Write dataset, the output folder is uploaded and registered by AzureML, no datastore round trip needed
+    with telemetry.phase('write', rows=len(df)):
+        step_output.write(df)
+    feature_columns = [col for col in df.columns if col != target]
+
+# Preprocessing spec, applied again by the scoring entry script on raw passenger records
+# the fill values are fitted by the clean step, datasets cleaned elsewhere have none
+preprocessing_spec = create_preprocessing_spec(
+    numeric_columns=numeric_columns,
+    categories={col: categories[col].tolist() for col in categorical_columns},
+    fill_values=step_input.read_json('fill_values', default={}),
+    feature_columns=feature_columns)
+step_output.write_json(PREPROCESSING_SPEC_NAME, preprocessing_spec)
+
+telemetry.finish()
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+
+
+def export_forest(rf, path, feature_names=None):
+    # Flatten all trees of a fitted RandomForestClassifier into contiguous arrays.
+    # Node indices are global over the whole forest, leaves have left == right == -1 and
+    # carry the normalized class distribution of the tree in value.
+    # Every array is written as its own .npy file in path, so the scoring engine can memory map them.
+    assert rf.n_outputs_ == 1, "only single output forests can be exported"
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in rf.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+
+        # same normalization as DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :rf.n_classes_].astype(np.float64)
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        value /= normalizer
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset))
+        values.append(value)
+        roots.append(offset)
+        offset += tree.node_count
+
+    if feature_names is None:
+        feature_names = getattr(rf, 'feature_names_in_', [])
+
+    # string labels are an object array in sklearn, which np.load only reads with pickles,
+    # they are stored as fixed-width unicode instead
+    classes = np.asarray(rf.classes_)
+    if classes.dtype == object:
+        classes = classes.astype(str)
+
+    arrays = dict(
+        feature=np.concatenate(features).astype(np.int32),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        left=np.concatenate(lefts).astype(np.int32),
+        right=np.concatenate(rights).astype(np.int32),
+        value=np.concatenate(values),
+        roots=np.array(roots, dtype=np.int32),
+        max_depth=np.array(max(estimator.tree_.max_depth for estimator in rf.estimators_)),
+        classes=classes,
+        feature_names=np.array(feature_names, dtype=str)
+    )
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
@@ -0,0 +1,96 @@
+import os
+import time
+import pickle
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import StratifiedKFold
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+
+
+# forest params that can be searched, each passed to the step as a comma separated list of values
+SEARCH_PARAMS = ['n_estimators', 'max_depth', 'min_samples_leaf', 'max_features']
+
+# training data of the worker processes, set once per process instead of pickled with every task
+_X, _y = None, None
+
+
+def parse_values(text):
+    # "50,100" -> [50, 100], "none,5" -> [None, 5], "sqrt,0.5" -> ['sqrt', 0.5]
+    values = []
+    for value in str(text).split(','):
+        value = value.strip()
+        if value.lower() == 'none':
+            values.append(None)
+            continue
+        for parse in (int, float):
+            try:
+                values.append(parse(value))
+                break
+            except ValueError:
+                pass
+        else:
+            values.append(value)
+    return values
+
+
+def get_candidates(search_space):
+    # search_space: param name -> list of values, every combination is a candidate
+    names = list(search_space)
+    return [dict(zip(names, values)) for values in itertools.product(*search_space.values())]
+
+
+def _init_worker(X, y):
+    global _X, _y
+    _X, _y = X, y
+
+
+def _fit_fold(candidate_nr, params, fold_nr, train_index, test_index, n_jobs, random_state):
+    rf = RandomForestClassifier(**params, n_jobs=n_jobs, random_state=random_state)
+
+    fit_start = time.perf_counter()
+    rf.fit(_X[train_index], _y[train_index])
+    fit_time = time.perf_counter() - fit_start
+
+    score = accuracy_score(_y[test_index], rf.predict(_X[test_index]))
+
+    return candidate_nr, fold_nr, score, fit_time, len(pickle.dumps(rf))
+
+
+def run_search(X, y, candidates, cv_folds, max_workers=None, random_state=123):
+    ## CROSS VALIDATED SEARCH
+    # every (candidate, fold) pair is a task in a process pool, the cores are split between the workers
+    # through n_jobs so the pool and the forests together never use more cores than the node has
+    X, y = np.asarray(X), np.asarray(y)
+    folds = list(StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=random_state).split(X, y))
+    tasks = [(candidate_nr, params, fold_nr, train_index, test_index)
+             for candidate_nr, params in enumerate(candidates)
+             for fold_nr, (train_index, test_index) in enumerate(folds)]
+
+    cores = os.cpu_count() or 1
+    workers = max(1, min(max_workers or cores, cores, len(tasks)))
+    n_jobs = max(1, cores // workers)
+
+    fold_results = {candidate_nr: [] for candidate_nr in range(len(candidates))}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y)) as pool:
+        futures = [pool.submit(_fit_fold, *task, n_jobs, random_state) for task in tasks]
+        for future in futures:
+            candidate_nr, fold_nr, score, fit_time, model_size = future.result()
+            fold_results[candidate_nr].append((score, fit_time, model_size))
+
+    results = []
+    for candidate_nr, params in enumerate(candidates):
+        scores, fit_times, model_sizes = zip(*fold_results[candidate_nr])
+        results.append({
+            "params": params,
+            "mean_score": float(np.mean(scores)),
+            "std_score": float(np.std(scores)),
+            "mean_fit_time_s": round(float(np.mean(fit_times)), 4),
+            "mean_model_size_bytes": int(np.mean(model_sizes))
+        })
+
+    # ties go to the candidate listed first, fit times differ between runs
+    best = max(results, key=lambda result: result["mean_score"])
+
+    return best, results, {"workers": workers, "n_jobs": n_jobs, "tasks": len(tasks)}
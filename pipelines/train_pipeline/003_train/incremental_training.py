@@ -0,0 +1,75 @@
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+
+# file next to rf.pkl with the tree batches of the forest and the rows they were trained on
+TRAINING_STATE_NAME = 'training_state'
+
+
+def row_hashes(df):
+    # content hash per row, identifies rows across runs without an id column
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def hash_split(hashes, test_size):
+    # a row stays in the same split as the dataset grows, so trees added later never see test rows
+    return hashes % 1000 < int(test_size * 1000)
+
+
+def load_previous_model(model_dir):
+    # fitted forest and training state of the last registered model, None when there is nothing to extend
+    state_path = os.path.join(model_dir, f"{TRAINING_STATE_NAME}.json")
+    if not os.path.isfile(state_path):
+        return None, None
+
+    with open(os.path.join(model_dir, 'rf.pkl'), 'rb') as f:
+        rf = pickle.load(f)
+    with open(state_path) as f:
+        state = json.load(f)
+    state["trained_rows"] = np.load(os.path.join(model_dir, f"{TRAINING_STATE_NAME}.npy"))
+
+    return rf, state
+
+
+def save_training_state(model_dir, state):
+    with open(os.path.join(model_dir, f"{TRAINING_STATE_NAME}.json"), 'w') as f:
+        json.dump({key: value for key, value in state.items() if key != "trained_rows"}, f, indent=4)
+    np.save(os.path.join(model_dir, f"{TRAINING_STATE_NAME}.npy"), state["trained_rows"])
+
+
+def evict_trees(rf, state, n_trees):
+    ## TREE EVICTION
+    # oldest batches go first, the forest forgets the oldest partitions instead of growing without bound
+    evicted = 0
+    while evicted < n_trees and state["batches"]:
+        batch = state["batches"][0]
+        n_evict = min(batch["trees"], n_trees - evicted)
+        batch["trees"] -= n_evict
+        evicted += n_evict
+        if batch["trees"] == 0:
+            state["batches"].pop(0)
+
+    rf.estimators_ = rf.estimators_[evicted:]
+    rf.n_estimators = len(rf.estimators_)
+
+    return evicted
+
+
+def add_trees(rf, state, X, y, n_trees):
+    ## WARM START
+    # the existing trees are kept, only the new trees are fitted, on the given rows only
+    # sklearn seeds the new trees by their position in the forest, which repeats once eviction caps its size,
+    # so the seed of a run is derived from the number of trees ever fitted, a counter in the training state
+    # models without the counter continue from their forest size
+    trees_fitted = state.get("trees_fitted", len(rf.estimators_))
+    random_state = rf.random_state
+    rf.set_params(warm_start=True, n_estimators=len(rf.estimators_) + n_trees,
+                  random_state=np.random.SeedSequence([random_state or 0, trees_fitted]).generate_state(1)[0])
+    rf.fit(X, y)
+    rf.set_params(warm_start=False, random_state=random_state)
+    state["trees_fitted"] = trees_fitted + n_trees
+
+    return rf
@@ -0,0 +1,121 @@
+import os
+import time
+import tracemalloc
+import numpy as np
+from forest_engine import ArrayForest
+
+
+# file in the model folder, registered with the model
+BENCHMARK_NAME = 'benchmark'
+
+# folder of the exported forest in the model folder, what the scoring entry script loads
+FOREST_DIR = 'rf_forest'
+
+# metrics compared with the registered model, per ratio budget
+RATIO_METRICS = {
+    'size': ['size_bytes'],
+    'latency': ['single_row_p50_ms', 'batch_p50_ms'],
+    'memory': ['peak_memory_bytes']
+}
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def replay_set(X, hashes, n_rows):
+    # the rows with the lowest content hashes, the same rows in every run as long as they are in the dataset
+    order = np.argsort(hashes, kind='stable')[:n_rows]
+    return X.iloc[np.sort(order)].reset_index(drop=True)
+
+
+def load_model(model_dir):
+    # same as the entry script: the exported forest, memory mapped
+    forest_dir = os.path.join(model_dir, FOREST_DIR)
+    if not os.path.isdir(forest_dir):
+        raise FileNotFoundError(f"No exported forest in {model_dir}, the model predates the forest export")
+    return ArrayForest.load(forest_dir, mmap_mode='r')
+
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1000
+    return {f"p{q}_ms": round(float(np.percentile(values, q)), 4) for q in [50, 95, 99]}
+
+
+def benchmark_model(model_dir, X_replay, single_rows=200, repeats=10):
+    # size, load time, predict latency and peak memory of the serving path of the model in model_dir on the replay rows
+    # size is the exported forest only, the same artifact for every model, the rest of the folder is reported apart
+    result = {'size_bytes': directory_size(os.path.join(model_dir, FOREST_DIR)), 'model_dir_bytes': directory_size(model_dir)}
+
+    # fastest load, a load takes milliseconds and other work on the node only ever adds to it
+    # the previous copy is released first, so every load allocates from the same state
+    load_times, model = [], None
+    for _ in range(max(1, repeats)):
+        model = None
+        start = time.perf_counter()
+        model = load_model(model_dir)
+        load_times.append(time.perf_counter() - start)
+    result['load_ms'] = round(float(np.min(load_times)) * 1000, 4)
+
+    # an older model may not use every column of the replay set, it is scored on its own columns
+    columns = list(model.feature_names_in_) if model.feature_names_in_ is not None else list(X_replay.columns)
+    missing = sorted(set(columns) - set(X_replay.columns))
+    if missing:
+        raise ValueError(f"Replay set is missing the feature columns {missing}")
+    # the entry script scores float arrays
+    X = X_replay[columns].to_numpy(dtype=np.float64)
+
+    # first call outside the timings, pages in the memory mapped arrays
+    model.predict_proba(X)
+
+    single_times = []
+    for row_nr in range(min(single_rows, len(X))):
+        row = X[row_nr:row_nr + 1]
+        start = time.perf_counter()
+        model.predict_proba(row)
+        single_times.append(time.perf_counter() - start)
+    result.update({f"single_row_{name}": value for name, value in percentiles(single_times).items()})
+
+    batch_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_proba(X)
+        batch_times.append(time.perf_counter() - start)
+    result.update({f"batch_{name}": value for name, value in percentiles(batch_times).items()})
+    result['batch_rows'] = len(X)
+    result['batch_rows_per_s'] = round(len(X) / float(np.median(batch_times)), 1)
+
+    # separate pass, tracing slows down the allocations that are timed above
+    del model
+    tracemalloc.start()
+    try:
+        load_model(model_dir).predict_proba(X)
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result
+
+
+def check_budgets(candidate, baseline, max_ratios, max_values):
+    ## GATE
+    # max_ratios: per RATIO_METRICS group, multiple of the registered model
+    # max_values: per metric, absolute budget
+    # budgets of 0 are not checked, nor are the ratios when there is no registered model to compare with
+    violations = []
+    if baseline is not None:
+        for budget, metrics in RATIO_METRICS.items():
+            max_ratio = max_ratios.get(budget, 0)
+            if max_ratio <= 0:
+                continue
+            for metric in metrics:
+                ratio = candidate[metric] / max(baseline[metric], 1e-12)
+                if ratio > max_ratio:
+                    violations.append(f"{metric} {candidate[metric]} is {ratio:.2f}x the registered model "
+                                      f"({baseline[metric]}), budget {max_ratio}x")
+
+    for metric, max_value in max_values.items():
+        if max_value > 0 and candidate[metric] > max_value:
+            violations.append(f"{metric} {candidate[metric]} is over the budget of {max_value}")
+
+    return violations
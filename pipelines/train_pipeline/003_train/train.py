@@ -2,52 +2,335 @@ import os
 import argparse
 import pandas as pd
 import pickle
-from sklearn.model_selection import train_test_split
+import json
+import time
+import shutil
+from datetime import datetime
+import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
-from azureml.core import Run, Experiment, Workspace, Datastore, Model
+from step_io import StepInput
+from preprocessing_spec import PREPROCESSING_SPEC_NAME
+from forest_export import export_forest
+from hyperparameter_search import SEARCH_PARAMS, parse_values, get_candidates, run_search
+from step_run import get_run_context
+from step_telemetry import StepTelemetry
+from incremental_training import row_hashes, hash_split, load_previous_model, save_training_state, evict_trees, add_trees
+from model_benchmark import BENCHMARK_NAME, RATIO_METRICS, replay_set, benchmark_model, check_budgets
 
-# Read dataset, code specific for ML pipelines
-parser = argparse.ArgumentParser()
-# run_datetime is not actually used in current demo
-parser.add_argument('--run_datetime', dest='run_datetime', required=True)
-args = parser.parse_args()
 
-run = Run.get_context(allow_offline=False)
-experiment = run.experiment
-ws = experiment.workspace 
+def parse_args():
+    # step arguments, code specific for ML pipelines
+    parser = argparse.ArgumentParser()
+    # run_datetime is not actually used in current demo
+    parser.add_argument('--run_datetime', dest='run_datetime', required=True)
+    # folder with the input data, a dataset mount on AzureML and a local folder in the local runner
+    parser.add_argument('--titanic_input_dataset', dest='input_path', required=True)
+    # search space, comma separated values per forest param, a single value per param skips the search
+    parser.add_argument('--n_estimators', dest='n_estimators', default='50')
+    parser.add_argument('--max_depth', dest='max_depth', default='none')
+    parser.add_argument('--min_samples_leaf', dest='min_samples_leaf', default='1')
+    parser.add_argument('--max_features', dest='max_features', default='sqrt')
+    parser.add_argument('--cv_folds', dest='cv_folds', type=int, default=5)
+    # processes for the search, 0 uses every core of the node
+    parser.add_argument('--search_workers', dest='search_workers', type=int, default=0)
+    # 'full' fits a new forest on all rows, 'incremental' adds trees for the rows the registered model has not seen
+    parser.add_argument('--training_mode', dest='training_mode', choices=['full', 'incremental'], default='full')
+    parser.add_argument('--new_trees', dest='new_trees', type=int, default=10)
+    # oldest trees are evicted when the forest would grow beyond max_trees
+    parser.add_argument('--max_trees', dest='max_trees', type=int, default=200)
+    # model folder to extend in offline runs, defaults to the model of the previous run
+    parser.add_argument('--previous_model_dir', dest='previous_model_dir', default='')
+    # also time a full refit with the same number of trees, to compare with the incremental run
+    parser.add_argument('--compare_full_refit', dest='compare_full_refit', type=int, default=0)
+    # benchmark of the model on a fixed replay set of the input rows, compared with the registered model
+    parser.add_argument('--benchmark_rows', dest='benchmark_rows', type=int, default=1000)
+    parser.add_argument('--benchmark_single_rows', dest='benchmark_single_rows', type=int, default=200)
+    parser.add_argument('--benchmark_repeats', dest='benchmark_repeats', type=int, default=10)
+    # budgets as a multiple of the registered model, 0 is not checked
+    # the search can pick a forest several times the size of the registered one, so these suit pinned params
+    parser.add_argument('--max_size_ratio', dest='max_size_ratio', type=float, default=0)
+    parser.add_argument('--max_latency_ratio', dest='max_latency_ratio', type=float, default=0)
+    parser.add_argument('--max_memory_ratio', dest='max_memory_ratio', type=float, default=0)
+    # absolute budgets of the serving path, 0 is not checked, the timings depend on the node they run on
+    parser.add_argument('--max_size_mb', dest='max_size_mb', type=float, default=0)
+    parser.add_argument('--max_load_ms', dest='max_load_ms', type=float, default=0)
+    parser.add_argument('--max_single_row_p95_ms', dest='max_single_row_p95_ms', type=float, default=0)
+    parser.add_argument('--max_batch_p95_ms', dest='max_batch_p95_ms', type=float, default=0)
+    parser.add_argument('--max_memory_mb', dest='max_memory_mb', type=float, default=0)
+    # 1 blocks the registration when a budget is exceeded, 0 only reports it
+    parser.add_argument('--benchmark_gate', dest='benchmark_gate', type=int, default=1)
+    # model folder to compare with in offline runs, defaults to the last model that passed the gate locally
+    parser.add_argument('--baseline_model_dir', dest='baseline_model_dir', default='')
+    return parser.parse_args()
 
-mounted_path = run.input_datasets['titanic_input_dataset']
-csv_path = os.path.join(mounted_path, 'titanic_dataset.csv')
 
-# From here on, we can reuse the code from the notebooks
-df = pd.read_csv(csv_path)
+def download_registered_model(ws, target_dir):
+    # folder of the registered titanic_model, '' when nothing is registered yet
+    from azureml.core import Model
+    from azureml.exceptions import WebserviceException
+    try:
+        return Model(ws, 'titanic_model').download(target_dir=target_dir, exist_ok=True)
+    except WebserviceException:
+        return ''
 
-target = 'Survived'
 
-X = df.loc[:, df.columns != target]
-y = df[target]
+def load_incremental_model(args, ws, X, y_train, train_hashes):
+    ## INCREMENTAL MODEL
+    # the last registered forest with its training state, and the training rows it has not seen yet
+    # None when there is nothing to extend, the caller then fits a new forest
+    if ws is not None:
+        previous_model_dir = download_registered_model(ws, 'previous_model')
+    else:
+        # local runs extend the model of the previous run in the same step folder
+        previous_model_dir = args.previous_model_dir or 'model/'
+    rf, training_state = load_previous_model(previous_model_dir)
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=123
-)
+    if rf is None:
+        print(f"[{datetime.now()}] No previous model with a training state, falling back to a full refit")
+        return None, None, None
+    if list(getattr(rf, 'feature_names_in_', [])) != list(X.columns):
+        print(f"[{datetime.now()}] Feature columns changed since the previous model, falling back to a full refit")
+        return None, None, None
 
-rf = RandomForestClassifier(
-    n_estimators=50,
-    random_state=123
-)
+    new_rows = ~np.isin(train_hashes, training_state["trained_rows"])
+    if new_rows.any() and set(y_train[new_rows]) != set(rf.classes_):
+        # warm start refits the classes on the new rows only, all classes have to be present
+        print(f"[{datetime.now()}] New rows do not contain every class, falling back to a full refit")
+        return None, None, None
 
-rf.fit(X_train, y_train)
+    return rf, training_state, new_rows
 
-pred = rf.predict(X_test)
 
-print(f"Accuracy: {accuracy_score(y_test, pred)}")
+def extend_model(args, telemetry, rf, training_state, new_rows, X_train, y_train, train_hashes):
+    # adds trees for the new rows and evicts the oldest ones above max_trees
+    new_trees = args.new_trees if new_rows.any() else 0
+    n_evicted = evict_trees(rf, training_state, max(0, len(rf.estimators_) + new_trees - args.max_trees))
+    if new_trees > 0:
+        with telemetry.phase('fit', rows=int(new_rows.sum())):
+            add_trees(rf, training_state, X_train[new_rows], y_train[new_rows], new_trees)
+        training_state["batches"].append({"run_datetime": args.run_datetime, "trees": new_trees, "rows": int(new_rows.sum())})
+        training_state["trained_rows"] = np.union1d(training_state["trained_rows"], train_hashes[new_rows])
 
-# Save the model as pickle file
-if not os.path.exists('model/'):
-    os.makedirs('model/')
+    print(f"[{datetime.now()}] Incremental training: {int(new_rows.sum())} new rows, {new_trees} new trees, "
+          f"{n_evicted} evicted, {len(rf.estimators_)} trees")
 
-pickle.dump(rf, open('model/rf.pkl', 'wb'))
 
-# Register model in AzureML Model Registry
-model = Model.register(ws, 'model', 'titanic_model')
\ No newline at end of file
+def search_params(args, run, telemetry, X_train, y_train):
+    # forest params of the config, searched with k-fold cross validation when a param lists several values
+    search_space = {param: parse_values(getattr(args, param)) for param in SEARCH_PARAMS}
+    candidates = get_candidates(search_space)
+    if len(candidates) == 1:
+        return candidates[0]
+
+    # k-fold cross validation on the training split, the test split stays untouched for the best model
+    search_start = time.perf_counter()
+    with telemetry.phase('search', rows=len(X_train)):
+        best, search_results, search_setup = run_search(
+            X_train, y_train, candidates, args.cv_folds, max_workers=args.search_workers or None)
+    search_time = time.perf_counter() - search_start
+
+    print(f"[{datetime.now()}] Searched {len(candidates)} candidates with {args.cv_folds}-fold CV in {search_time:.2f}s "
+          f"({search_setup['workers']} workers, n_jobs={search_setup['n_jobs']})")
+    for result in sorted(search_results, key=lambda result: -result["mean_score"]):
+        print(f"    {result['mean_score']:.4f} +/- {result['std_score']:.4f}  {result['mean_fit_time_s']:>7.3f}s  "
+              f"{result['mean_model_size_bytes'] / 1024:>9.1f} KiB  {result['params']}")
+
+    # files in outputs/ are uploaded with the run on AzureML
+    os.makedirs('outputs/', exist_ok=True)
+    with open('outputs/hyperparameter_search.json', 'w') as f:
+        json.dump({"search_space": search_space, "cv_folds": args.cv_folds, "search_time_s": round(search_time, 3),
+                   **search_setup, "best": best, "candidates": search_results}, f, indent=4)
+
+    run.log('cv_accuracy', best["mean_score"])
+    return best["params"]
+
+
+def fit_model(args, run, telemetry, ws, X, X_train, y_train, train_hashes):
+    ## FIT
+    # incremental mode extends the last registered forest with trees fitted on the new rows only,
+    # otherwise a new forest is fitted on all training rows
+    rf, training_state, new_rows = None, None, None
+    if args.training_mode == 'incremental':
+        rf, training_state, new_rows = load_incremental_model(args, ws, X, y_train, train_hashes)
+
+    # the search is not part of the train time
+    if rf is not None:
+        train_start = time.perf_counter()
+        extend_model(args, telemetry, rf, training_state, new_rows, X_train, y_train, train_hashes)
+        best_params = {param: rf.get_params()[param] for param in SEARCH_PARAMS}
+    else:
+        best_params = search_params(args, run, telemetry, X_train, y_train)
+        train_start = time.perf_counter()
+        rf = RandomForestClassifier(
+            **best_params,
+            random_state=123
+        )
+
+        with telemetry.phase('fit', rows=len(X_train)):
+            rf.fit(X_train, y_train)
+        training_state = {"batches": [{"run_datetime": args.run_datetime, "trees": rf.n_estimators, "rows": len(X_train)}],
+                          "trees_fitted": rf.n_estimators, "trained_rows": np.unique(train_hashes)}
+    train_time = time.perf_counter() - train_start
+
+    run.log('train_time_s', train_time)
+
+    return rf, training_state, best_params, train_time
+
+
+def evaluate(args, run, telemetry, rf, best_params, train_time, X_train, y_train, X_test, y_test):
+    ## EVALUATE
+    if args.training_mode == 'incremental' and args.compare_full_refit:
+        # the same number of trees fitted from scratch on all training rows, only to report the saving
+        full_start = time.perf_counter()
+        full_rf = RandomForestClassifier(**{**best_params, "n_estimators": len(rf.estimators_)}, random_state=123)
+        full_rf.fit(X_train, y_train)
+        full_time = time.perf_counter() - full_start
+        print(f"[{datetime.now()}] Full refit: {full_time:.2f}s, accuracy {accuracy_score(y_test, full_rf.predict(X_test))} "
+              f"({train_time:.2f}s for this run, {full_time / max(train_time, 1e-9):.1f}x)")
+        run.log('full_refit_time_s', full_time)
+
+    with telemetry.phase('predict', rows=len(X_test)):
+        pred = rf.predict(X_test)
+    accuracy = accuracy_score(y_test, pred)
+
+    print(f"Accuracy: {accuracy}")
+    run.log('accuracy', accuracy)
+
+    return accuracy
+
+
+def save_model(telemetry, rf, training_state, step_input, feature_names):
+    # Save the model as pickle file
+    with telemetry.phase('write'):
+        os.makedirs('model/', exist_ok=True)
+
+        pickle.dump(rf, open('model/rf.pkl', 'wb'))
+        save_training_state('model/', training_state)
+
+        # Export the trees as flat arrays for the sklearn-free scoring engine
+        export_forest(rf, 'model/rf_forest/', feature_names=feature_names)
+
+        # Ship the fitted preprocessing with the model, so the entry script can score raw passenger records
+        preprocessing_spec = step_input.read_json(PREPROCESSING_SPEC_NAME)
+        if preprocessing_spec is not None:
+            assert preprocessing_spec['feature_columns'] == feature_names
+            with open(f"model/{PREPROCESSING_SPEC_NAME}.json", 'w') as f:
+                json.dump(preprocessing_spec, f, indent=4)
+
+
+def benchmark(args, run, telemetry, ws, X, hashes):
+    ## BENCHMARK
+    # the candidate and the registered model are measured in the same process on the same rows
+    X_replay = replay_set(X, hashes, args.benchmark_rows)
+    with telemetry.phase('benchmark', rows=len(X_replay)):
+        candidate = benchmark_model('model/', X_replay, args.benchmark_single_rows, args.benchmark_repeats)
+
+        if ws is not None:
+            baseline_dir = download_registered_model(ws, 'registered_model')
+        else:
+            baseline_dir = args.baseline_model_dir or 'registered_model/'
+
+        # a registered model that cannot be benchmarked, e.g. one without the forest export, never blocks the new one
+        baseline = None
+        if baseline_dir and os.path.isdir(baseline_dir):
+            try:
+                baseline = benchmark_model(baseline_dir, X_replay, args.benchmark_single_rows, args.benchmark_repeats)
+            except Exception as e:
+                print(f"[{datetime.now()}] Registered model not benchmarked, only absolute budgets are checked: {e!r}")
+
+    max_ratios = {'size': args.max_size_ratio, 'latency': args.max_latency_ratio, 'memory': args.max_memory_ratio}
+    max_values = {'size_bytes': args.max_size_mb * 1024 ** 2, 'load_ms': args.max_load_ms,
+                  'single_row_p95_ms': args.max_single_row_p95_ms, 'batch_p95_ms': args.max_batch_p95_ms,
+                  'peak_memory_bytes': args.max_memory_mb * 1024 ** 2}
+    violations = check_budgets(candidate, baseline, max_ratios, max_values)
+    passed = not violations or not args.benchmark_gate
+
+    print(f"[{datetime.now()}] Benchmark on {len(X_replay)} replay rows (candidate / registered):")
+    for metric in sorted(candidate):
+        print(f"    {metric:<22} {candidate[metric]:>14} {baseline[metric] if baseline is not None else '-':>14}")
+    for violation in violations:
+        print(f"[{datetime.now()}] Over budget: {violation}")
+    for metric in sorted(set(max_values) | {metric for metrics in RATIO_METRICS.values() for metric in metrics}):
+        run.log(f"benchmark_{metric}", candidate[metric])
+
+    # stored with the model, and uploaded with the run on AzureML
+    result = {"run_datetime": args.run_datetime, "replay_rows": len(X_replay),
+              "replay_fingerprint": int(np.bitwise_xor.reduce(row_hashes(X_replay))),
+              "candidate": candidate, "registered": baseline, "registered_model_dir": baseline_dir if baseline else None,
+              "budgets": {**{f"max_{budget}_ratio": ratio for budget, ratio in max_ratios.items()},
+                          **{f"max_{metric}": value for metric, value in max_values.items()}},
+              "violations": violations, "gate": bool(args.benchmark_gate), "passed": passed}
+    for benchmark_dir in ['model/', 'outputs/']:
+        os.makedirs(benchmark_dir, exist_ok=True)
+        with open(os.path.join(benchmark_dir, f"{BENCHMARK_NAME}.json"), 'w') as f:
+            json.dump(result, f, indent=4)
+
+    return result
+
+
+def gate_and_register(telemetry, ws, benchmark_result, accuracy, best_params):
+    ## REGISTER
+    # Register model in AzureML Model Registry, local runs keep the model folder only
+    violations = benchmark_result["violations"]
+    if not benchmark_result["passed"]:
+        print(f"[{datetime.now()}] Model not registered, {len(violations)} benchmark budgets exceeded")
+    elif ws is not None:
+        from azureml.core import Model
+        candidate = benchmark_result["candidate"]
+        with telemetry.phase('register'):
+            Model.register(ws, 'model', 'titanic_model',
+                           tags={"accuracy": f"{accuracy:.4f}",
+                                 "size_mb": f"{candidate['size_bytes'] / 1024 ** 2:.2f}",
+                                 "single_row_p95_ms": f"{candidate['single_row_p95_ms']:.2f}"},
+                           properties={param: str(value) for param, value in best_params.items()})
+    else:
+        # local stand-in for the registry, the model the next offline run is compared with
+        shutil.rmtree('registered_model/', ignore_errors=True)
+        shutil.copytree('model/', 'registered_model/')
+
+    return benchmark_result["passed"]
+
+
+def main():
+    args = parse_args()
+
+    run = get_run_context()
+    telemetry = StepTelemetry(run, 'train', args.run_datetime)
+    # no workspace in offline runs, e.g. in the local runner
+    ws = None if run.id.startswith('OfflineRun') else run.experiment.workspace
+
+    # From here on, we can reuse the code from the notebooks
+    step_input = StepInput(args.input_path)
+    with telemetry.phase('read') as phase:
+        df = step_input.read()
+        phase['rows'] = len(df)
+
+    target = 'Survived'
+
+    X = df.loc[:, df.columns != target]
+    y = df[target]
+
+    # rows are assigned to the test split by their content hash, so the split is stable as the dataset grows
+    # full runs use it too, the incremental runs that extend their model hold out the same rows
+    hashes = row_hashes(df)
+    is_test = hash_split(hashes, test_size=0.2)
+    X_train, X_test, y_train, y_test = X[~is_test], X[is_test], y[~is_test], y[is_test]
+    train_hashes = hashes[~is_test]
+
+    rf, training_state, best_params, train_time = fit_model(args, run, telemetry, ws, X, X_train, y_train, train_hashes)
+    accuracy = evaluate(args, run, telemetry, rf, best_params, train_time, X_train, y_train, X_test, y_test)
+    save_model(telemetry, rf, training_state, step_input, list(X.columns))
+    benchmark_result = benchmark(args, run, telemetry, ws, X, hashes)
+    passed = gate_and_register(telemetry, ws, benchmark_result, accuracy, best_params)
+
+    telemetry.finish()
+
+    # a failed step makes a blocked model visible in the pipeline run, and keeps dependent steps from running
+    if not passed:
+        raise RuntimeError(f"Model registration blocked by the benchmark gate: {'; '.join(benchmark_result['violations'])}")
+
+
+# the search runs in a process pool, which imports this module again under spawn/forkserver
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import os
+import time
+import pickle
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# input file formats, by extension
+INPUT_FORMATS = ['parquet', 'feather', 'csv']
+
+# model of the worker processes, inherited from the parent when processes are forked
+_model = None
+
+
+def load_model(model_dir):
+    with open(os.path.join(model_dir, 'rf.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def list_input_files(input_path):
+    # every data file below the dataset folder, in a stable order
+    input_files = []
+    for root, _, names in os.walk(input_path):
+        input_files += [os.path.join(root, name) for name in names if name.rsplit('.', 1)[-1] in INPUT_FORMATS]
+    return sorted(input_files)
+
+
+def count_rows(file_path):
+    file_format = file_path.rsplit('.', 1)[-1]
+    if file_format == 'parquet':
+        return pq.ParquetFile(file_path).metadata.num_rows
+    if file_format == 'feather':
+        with pa.ipc.open_file(pa.memory_map(file_path)) as reader:
+            return sum(reader.get_batch(batch_nr).num_rows for batch_nr in range(reader.num_record_batches))
+    # csv without quoted line breaks, which holds for the numeric preprocessed data
+    with open(file_path, 'rb') as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+
+def plan_partitions(input_files, partition_rows):
+    # (file, first row, last row + 1) ranges of at most partition_rows rows, files are never combined
+    partitions = []
+    for file_path in input_files:
+        n_rows = count_rows(file_path)
+        partitions += [(file_path, start, min(start + partition_rows, n_rows)) for start in range(0, n_rows, partition_rows)]
+    return partitions
+
+
+def read_partition(file_path, start, stop, columns):
+    file_format = file_path.rsplit('.', 1)[-1]
+    if file_format == 'csv':
+        return pd.read_csv(file_path, skiprows=range(1, start + 1), nrows=stop - start, usecols=columns)[columns]
+    if file_format == 'feather':
+        with pa.ipc.open_file(pa.memory_map(file_path)) as reader:
+            table = reader.read_all().select(columns)
+        return table.slice(start, stop - start).to_pandas()
+
+    # only the row groups overlapping the range are read
+    parquet_file = pq.ParquetFile(file_path)
+    row_groups, first_row, group_start = [], None, 0
+    for group_nr in range(parquet_file.num_row_groups):
+        group_stop = group_start + parquet_file.metadata.row_group(group_nr).num_rows
+        if group_start < stop and group_stop > start:
+            row_groups.append(group_nr)
+            first_row = group_start if first_row is None else first_row
+        group_start = group_stop
+    table = parquet_file.read_row_groups(row_groups, columns=columns)
+    return table.slice(start - first_row, stop - start).to_pandas()
+
+
+def score_partition(partition_nr, partition, output_path):
+    # one parquet file per partition, workers never write to the same file
+    file_path, start, stop = partition
+    partition_start = time.perf_counter()
+    feature_columns = list(_model.feature_names_in_)
+    X = read_partition(file_path, start, stop, feature_columns)
+
+    proba = _model.predict_proba(X)
+    predictions = pd.DataFrame({
+        'source_file': os.path.basename(file_path),
+        'row': np.arange(start, stop),
+        'prediction': _model.classes_.take(np.argmax(proba, axis=1)),
+        'probability': proba[:, -1]
+    })
+    partition_path = os.path.join(output_path, f"part-{partition_nr:05d}.parquet")
+    predictions.to_parquet(partition_path, index=False)
+
+    return {"partition": partition_nr, "file": os.path.basename(file_path), "start": start, "stop": stop,
+            "rows": stop - start, "seconds": round(time.perf_counter() - partition_start, 4)}
+
+
+def _init_worker(model_dir):
+    global _model
+    _model = load_model(model_dir)
+
+
+def score_partitions(partitions, model, model_dir, output_path, max_workers=None):
+    # On Linux the workers are forked after the model is loaded, so they share its memory read-only
+    # instead of each unpickling a copy. Other platforms load the model from model_dir once per worker.
+    global _model
+    _model = model
+    os.makedirs(output_path, exist_ok=True)
+    # parts of an earlier run with more partitions would otherwise stay in the output
+    for name in os.listdir(output_path):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            os.remove(os.path.join(output_path, name))
+
+    workers = min(max_workers or os.cpu_count() or 1, len(partitions))
+    if workers <= 1:
+        return [score_partition(partition_nr, partition, output_path) for partition_nr, partition in enumerate(partitions)]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_dir,))
+
+    with pool:
+        futures = [pool.submit(score_partition, partition_nr, partition, output_path)
+                   for partition_nr, partition in enumerate(partitions)]
+        results = [future.result() for future in as_completed(futures)]
+
+    return sorted(results, key=lambda result: result["partition"])
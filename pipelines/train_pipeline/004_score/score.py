@@ -0,0 +1,77 @@
+import os
+import argparse
+import time
+from datetime import datetime
+from step_run import get_run_context
+from step_io import StepOutput
+from step_telemetry import StepTelemetry
+from batch_scoring import load_model, list_input_files, plan_partitions, score_partitions
+
+# Read dataset, code specific for ML pipelines
+parser = argparse.ArgumentParser()
+# run_datetime is not actually used in current demo
+parser.add_argument('--run_datetime', dest='run_datetime', required=True)
+# folder with the input data, a dataset mount on AzureML and a local folder in the local runner
+parser.add_argument('--titanic_input_dataset', dest='input_path', required=True)
+parser.add_argument('--predictions_output_path', dest='output_path', required=True)
+# registered model to score with, 'latest' is its newest version
+parser.add_argument('--model_name', dest='model_name', default='titanic_model')
+parser.add_argument('--model_version', dest='model_version', default='latest')
+# model folder in offline runs, defaults to the model of the train step in the local runner
+parser.add_argument('--model_dir', dest='model_dir', default='')
+# rows per partition and worker processes, 0 uses every core of the node
+parser.add_argument('--partition_rows', dest='partition_rows', type=int, default=100000)
+parser.add_argument('--workers', dest='workers', type=int, default=0)
+args = parser.parse_args()
+
+run = get_run_context()
+offline = run.id.startswith('OfflineRun')
+telemetry = StepTelemetry(run, 'score', args.run_datetime)
+
+with telemetry.phase('load_model'):
+    if not offline:
+        from azureml.core import Model
+        ws = run.experiment.workspace
+        version = None if args.model_version == 'latest' else int(args.model_version)
+        registered_model = Model(ws, args.model_name, version=version)
+        model_dir = registered_model.download(target_dir='scoring_model', exist_ok=True)
+        model_label = f"{registered_model.name}:{registered_model.version}"
+    else:
+        model_dir = args.model_dir or '../train/model'
+        model_label = os.path.abspath(model_dir)
+    model = load_model(model_dir)
+    feature_columns = list(getattr(model, 'feature_names_in_', []))
+    assert feature_columns, "the model has no feature names, retrain it on a DataFrame"
+
+with telemetry.phase('plan') as phase:
+    input_files = list_input_files(args.input_path)
+    partitions = plan_partitions(input_files, args.partition_rows)
+    phase['rows'] = sum(stop - start for _, start, stop in partitions)
+
+print(f"[{datetime.now()}] Scoring {len(input_files)} files in {len(partitions)} partitions with model {model_label}")
+
+with telemetry.phase('score', rows=phase['rows']):
+    score_start = time.perf_counter()
+    results = score_partitions(partitions, model, model_dir, args.output_path, max_workers=args.workers or None)
+    score_time = time.perf_counter() - score_start
+
+rows = sum(result["rows"] for result in results)
+rows_per_s = rows / score_time if score_time > 0 else 0.0
+print(f"[{datetime.now()}] Scored {rows} rows in {score_time:.2f}s ({rows_per_s:.0f} rows/s)")
+for result in results:
+    print(f"    part-{result['partition']:05d}  {result['file']:<30} rows {result['start']:>9}-{result['stop']:<9} {result['seconds']:>8.3f}s")
+
+# summary next to the partitions, the leading underscore keeps it out of parquet dataset reads of the folder
+StepOutput(args.output_path).write_json('_scoring_summary', {
+    "model": model_label,
+    "feature_columns": feature_columns,
+    "rows": rows,
+    "seconds": round(score_time, 3),
+    "rows_per_s": round(rows_per_s, 1),
+    "partitions": results
+})
+
+run.log('rows', rows)
+run.log('rows_per_s', rows_per_s)
+
+telemetry.finish()
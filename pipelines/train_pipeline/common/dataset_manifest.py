@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime
+
+
+# stored in the state folder of the step, the leading underscore keeps it out of file listings of the folder
+MANIFEST_NAME = '_manifest'
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class LocalDirectoryBackend:
+    # Files of a dataset in a local folder. An AzureML dataset mount is a local folder as well,
+    # so the same backend serves local runs, tests and mounted file datasets.
+    # Names starting with '_' or '.' are metadata (manifests, summaries) and are not part of the dataset.
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_files(self):
+        # relative path -> (size in bytes, modification time)
+        files = {}
+        for directory, dirs, names in os.walk(self.root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(('_', '.')))
+            for name in sorted(names):
+                if name.startswith(('_', '.')):
+                    continue
+                file_path = os.path.join(directory, name)
+                stat = os.stat(file_path)
+                files[os.path.relpath(file_path, self.root).replace(os.sep, '/')] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def local_path(self, relative_path):
+        return os.path.join(self.root, *relative_path.split('/'))
+
+    def file_hash(self, relative_path):
+        sha = hashlib.sha256()
+        with open(self.local_path(relative_path), 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+
+class ManifestDiff:
+    # Relative paths per change type between a previous manifest and the current files.
+
+    def __init__(self, added, changed, removed, unchanged):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.unchanged = unchanged
+
+    @property
+    def to_process(self):
+        # files whose content the step has not processed yet
+        return sorted(self.added + self.changed)
+
+    def summary(self):
+        return {change: len(paths) for change, paths in
+                [('added', self.added), ('changed', self.changed), ('removed', self.removed), ('unchanged', self.unchanged)]}
+
+
+class DatasetManifest:
+    # Per file size, mtime and sha256 of a file dataset, plus optional stats a step records per file
+    # (e.g. row counts or partial sums), so unchanged files never have to be read again.
+
+    def __init__(self, files=None, created=None):
+        self.files = files or {}
+        self.created = created
+
+    @classmethod
+    def build(cls, backend, previous=None, rehash=False):
+        # files with the size and mtime of the previous manifest keep its hash and stats without being read
+        previous_files = previous.files if previous is not None else {}
+        files, hashed = {}, 0
+        for relative_path, (size, mtime) in backend.list_files().items():
+            entry = previous_files.get(relative_path)
+            if not rehash and entry is not None and entry['size'] == size and entry['mtime'] == mtime:
+                files[relative_path] = dict(entry)
+                continue
+            files[relative_path] = {'size': size, 'mtime': mtime, 'sha256': backend.file_hash(relative_path)}
+            hashed += 1
+            # a touched file with the same content keeps its stats
+            if entry is not None and entry['sha256'] == files[relative_path]['sha256'] and 'stats' in entry:
+                files[relative_path]['stats'] = entry['stats']
+
+        manifest = cls(files, created=str(datetime.now()))
+        manifest.hashed = hashed
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        # None when there is no manifest yet, e.g. the first run of a step
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            content = json.load(f)
+        return cls(content['files'], content.get('created'))
+
+    def save(self, path):
+        # written to a temporary file first, an interrupted run never leaves half a manifest
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({'created': self.created, 'files': self.files}, f, indent=4)
+        os.replace(tmp_path, path)
+        return path
+
+    def diff(self, previous):
+        previous_files = previous.files if previous is not None else {}
+        added, changed, unchanged = [], [], []
+        for relative_path, entry in self.files.items():
+            if relative_path not in previous_files:
+                added.append(relative_path)
+            elif previous_files[relative_path]['sha256'] != entry['sha256']:
+                changed.append(relative_path)
+            else:
+                unchanged.append(relative_path)
+        removed = sorted(set(previous_files) - set(self.files))
+        return ManifestDiff(added, changed, removed, unchanged)
+
+    def set_stats(self, relative_path, stats):
+        self.files[relative_path]['stats'] = stats
+
+    def get_stats(self, relative_path):
+        return self.files[relative_path].get('stats')
+
+
+if __name__ == '__main__':
+    # compares a folder with its last manifest, e.g. to check what an incremental run would process
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', dest='path', required=True)
+    parser.add_argument('--manifest_path', dest='manifest_path', required=True)
+    parser.add_argument('--save', dest='save', type=int, default=0)
+    args = parser.parse_args()
+
+    previous = DatasetManifest.load(args.manifest_path)
+    manifest = DatasetManifest.build(LocalDirectoryBackend(args.path), previous)
+    diff = manifest.diff(previous)
+    print(f"[{datetime.now()}] {len(manifest.files)} files, {manifest.hashed} hashed: {json.dumps(diff.summary())}")
+    for change, paths in [('added', diff.added), ('changed', diff.changed), ('removed', diff.removed)]:
+        for relative_path in paths:
+            print(f"    {change:<8} {relative_path}")
+    if args.save:
+        manifest.save(args.manifest_path)
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+
+
+# per node arrays are memory mapped, the small forest level arrays are read directly
+NODE_ARRAYS = ['feature', 'threshold', 'left', 'right', 'value']
+FOREST_ARRAYS = ['roots', 'max_depth', 'classes', 'feature_names']
+
+
+class ArrayForest:
+    # Pure NumPy evaluator for forests exported by 003_train/forest_export.py.
+    # Gives the same predictions as RandomForestClassifier without importing sklearn.
+
+    def __init__(self, arrays):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.max_depth = int(arrays['max_depth'])
+        self.classes_ = arrays['classes']
+        self.feature_names_in_ = arrays['feature_names'] if len(arrays['feature_names']) else None
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        # with mmap_mode the node arrays are paged in on first use instead of read upfront
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+                  for name in NODE_ARRAYS}
+        arrays.update({name: np.load(os.path.join(path, f"{name}.npy"), allow_pickle=False)
+                       for name in FOREST_ARRAYS})
+        return cls(arrays)
+
+    def apply(self, X):
+        # leaf index per (row, tree), all rows and trees are advanced one level per iteration
+        # sklearn evaluates trees on float32 inputs, so the same rounding is applied here
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(len(X))[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            is_leaf = left == -1
+            if is_leaf.all():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(is_leaf, nodes, np.where(go_left, left, self.right[nodes]))
+
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+
+        # trees are accumulated in order to match RandomForestClassifier bit for bit
+        proba = np.zeros((len(leaves), self.value.shape[1]))
+        for tree in range(leaves.shape[1]):
+            proba += self.value[leaves[:, tree]]
+        proba /= leaves.shape[1]
+
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
@@ -0,0 +1,50 @@
+import os
+import json
+import argparse
+import pandas as pd
+from datetime import datetime
+from step_run import get_run_context
+from step_io import StepInput, StepOutput
+from step_telemetry import StepTelemetry
+
+# Merge step of a step with SHARDS in the pipeline config, added by the deployment.
+# Concatenates the outputs of the shard steps in shard order, so the rows keep the order of the unsharded step.
+# Metadata json files (e.g. fill values) are fitted on all rows by every shard and copied once.
+parser = argparse.ArgumentParser()
+parser.add_argument('--run_datetime', dest='run_datetime', required=True)
+parser.add_argument('--shard_count', dest='shard_count', type=int, required=True)
+parser.add_argument('--merged_output_path', dest='output_path', required=True)
+# one --shard_input_<index> folder per shard
+known_args, _ = parser.parse_known_args()
+for shard_index in range(known_args.shard_count):
+    parser.add_argument(f'--shard_input_{shard_index}', dest=f'shard_input_{shard_index}', required=True)
+args = parser.parse_args()
+
+run = get_run_context()
+telemetry = StepTelemetry(run, 'merge_shards', args.run_datetime)
+
+shard_inputs = [StepInput(getattr(args, f'shard_input_{shard_index}')) for shard_index in range(args.shard_count)]
+step_output = StepOutput(args.output_path)
+
+# the merged dataset is read whole by the next step as well, so it is concatenated in memory
+with telemetry.phase('read') as phase:
+    shards = [shard_input.read() for shard_input in shard_inputs]
+    phase['rows'] = sum(len(shard) for shard in shards)
+
+columns = [list(shard.columns) for shard in shards]
+assert all(shard_columns == columns[0] for shard_columns in columns), f"shards have different columns: {columns}"
+
+with telemetry.phase('write', rows=phase['rows']):
+    step_output.write(pd.concat(shards, ignore_index=True))
+
+json_names = sorted({name[:-len('.json')] for shard_input in shard_inputs for name in os.listdir(shard_input.path)
+                     if name.endswith('.json') and not name.startswith(('_', '.'))})
+for name in json_names:
+    contents = [shard_input.read_json(name) for shard_input in shard_inputs]
+    if any(json.dumps(content, sort_keys=True) != json.dumps(contents[0], sort_keys=True) for content in contents):
+        raise ValueError(f"{name}.json differs between the shards, the step fits it on its own rows only")
+    step_output.write_json(name, contents[0])
+
+print(f"[{datetime.now()}] Merged {args.shard_count} shards, {phase['rows']} rows, metadata: {json_names or 'none'}")
+
+telemetry.finish()
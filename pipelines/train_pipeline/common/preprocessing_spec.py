@@ -0,0 +1,36 @@
+import json
+
+
+# file name of the spec, in the preprocess output and next to rf.pkl in the registered model
+PREPROCESSING_SPEC_NAME = 'preprocessing'
+
+
+def dummy_column_names(spec):
+    # same names and order as pd.get_dummies(..., drop_first=True) on the spec categories
+    names = []
+    for col, categories in spec["categorical_columns"].items():
+        names.extend(f"{col}_{category}" for category in categories[1 if spec["drop_first"] else 0:])
+    return names
+
+
+def create_preprocessing_spec(numeric_columns, categories, fill_values, feature_columns):
+    # Everything needed to turn a raw passenger record into a model feature vector:
+    #   numeric_columns: passed through, after filling missing values
+    #   categories: sorted categories per categorical column, one-hot encoded with the first category dropped
+    #   fill_values: replacement for missing values, per input column
+    #   feature_columns: the column order the model was trained on
+    spec = {
+        "numeric_columns": list(numeric_columns),
+        "categorical_columns": {col: list(values) for col, values in categories.items()},
+        "fill_values": dict(fill_values),
+        "drop_first": True,
+        "feature_columns": list(feature_columns)
+    }
+
+    # the spec has to describe exactly the columns the preprocess step produced
+    expected_columns = spec["numeric_columns"] + dummy_column_names(spec)
+    assert sorted(expected_columns) == sorted(spec["feature_columns"]), \
+        f"preprocessing spec {expected_columns} does not match the feature columns {spec['feature_columns']}"
+
+    # only plain python values, so the spec can be stored as json
+    return json.loads(json.dumps(spec))
@@ -0,0 +1,205 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# file formats for intermediate data, in order of preference when reading
+READERS = {
+    "parquet": pd.read_parquet,
+    "feather": pd.read_feather,
+    "csv": pd.read_csv
+}
+
+
+class StepOutput:
+    # Typed intermediate output of a pipeline step.
+    # path is a folder: on AzureML the mount of an OutputFileDatasetConfig, locally a plain folder.
+    # Parquet and Feather keep the pandas dtypes (categoricals, boolean dummy columns), so the next step
+    # does not have to parse text again.
+
+    def __init__(self, path, name='titanic_dataset', file_format='parquet'):
+        assert file_format in READERS, f"unsupported format '{file_format}', expected one of {list(READERS)}"
+        self.path = path
+        self.name = name
+        self.file_format = file_format
+
+    @property
+    def file_path(self):
+        return os.path.join(self.path, f"{self.name}.{self.file_format}")
+
+    def write(self, df):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        if self.file_format == "parquet":
+            df.to_parquet(self.file_path, index=False)
+        elif self.file_format == "feather":
+            df.reset_index(drop=True).to_feather(self.file_path)
+        else:
+            df.to_csv(self.file_path, index=False)
+
+        return self.file_path
+
+    def write_chunks(self, chunks):
+        # streaming write, only one chunk is in memory at a time
+        # all chunks must have the same columns and dtypes, the schema of the first chunk is used for the file
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        writer = None
+        try:
+            for chunk_nr, chunk in enumerate(chunks):
+                if self.file_format == "csv":
+                    chunk.to_csv(self.file_path, index=False, header=chunk_nr == 0, mode='w' if chunk_nr == 0 else 'a')
+                    continue
+
+                if writer is None:
+                    schema = arrow_schema(chunk)
+                    if self.file_format == "parquet":
+                        writer = pq.ParquetWriter(self.file_path, schema)
+                    else:
+                        writer = pa.ipc.new_file(self.file_path, schema)
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return self.file_path
+
+    def write_json(self, name, obj):
+        # small metadata next to the data, e.g. fitted preprocessing parameters
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        json_path = os.path.join(self.path, f"{name}.json")
+        with open(json_path, 'w') as f:
+            json.dump(obj, f, indent=4)
+
+        return json_path
+
+
+class StepInput:
+    # Reads the output of a previous step, or a raw dataset, from a folder.
+    # The first format found is used, so raw csv datasets and typed intermediate outputs are read the same way.
+
+    def __init__(self, path, name='titanic_dataset'):
+        self.path = path
+        self.name = name
+
+    @property
+    def file_format(self):
+        for file_format in READERS:
+            if os.path.isfile(os.path.join(self.path, f"{self.name}.{file_format}")):
+                return file_format
+        raise FileNotFoundError(f"No {self.name} file in {self.path}, expected one of {list(READERS)}")
+
+    @property
+    def file_path(self):
+        return os.path.join(self.path, f"{self.name}.{self.file_format}")
+
+    def read(self, columns=None):
+        file_format = self.file_format
+        file_path = os.path.join(self.path, f"{self.name}.{file_format}")
+
+        if file_format == "csv":
+            return pd.read_csv(file_path, usecols=columns)
+        return READERS[file_format](file_path, columns=columns)
+
+    def num_rows(self):
+        file_format = self.file_format
+        file_path = os.path.join(self.path, f"{self.name}.{file_format}")
+
+        if file_format == "parquet":
+            return pq.ParquetFile(file_path).metadata.num_rows
+        if file_format == "feather":
+            with pa.ipc.open_file(pa.memory_map(file_path)) as reader:
+                return sum(reader.get_batch(batch_nr).num_rows for batch_nr in range(reader.num_record_batches))
+        # only the first column is parsed, quoted fields with line breaks are counted correctly
+        return sum(len(chunk) for chunk in pd.read_csv(file_path, usecols=[0], chunksize=100000))
+
+    def read_shard(self, shard_index, shard_count, columns=None):
+        # contiguous slice of the rows, the shards in index order concatenate to the whole dataset
+        file_format = self.file_format
+        file_path = os.path.join(self.path, f"{self.name}.{file_format}")
+        n_rows = self.num_rows()
+        start, stop = n_rows * shard_index // shard_count, n_rows * (shard_index + 1) // shard_count
+
+        if file_format == "csv":
+            return pd.read_csv(file_path, usecols=columns, skiprows=range(1, start + 1), nrows=stop - start)
+        if file_format == "feather":
+            with pa.ipc.open_file(pa.memory_map(file_path)) as reader:
+                table = reader.read_all()
+            table = table.select(columns) if columns is not None else table
+            return table.slice(start, stop - start).to_pandas()
+
+        # only the row groups overlapping the slice are read
+        parquet_file = pq.ParquetFile(file_path)
+        row_groups, first_row, group_start = [], start, 0
+        for group_nr in range(parquet_file.num_row_groups):
+            group_stop = group_start + parquet_file.metadata.row_group(group_nr).num_rows
+            if group_start < stop and group_stop > start:
+                first_row = group_start if not row_groups else first_row
+                row_groups.append(group_nr)
+            group_start = group_stop
+        table = parquet_file.read_row_groups(row_groups, columns=columns) if row_groups else \
+            parquet_file.schema_arrow.empty_table().select(columns or parquet_file.schema_arrow.names)
+        return table.slice(start - first_row if row_groups else 0, stop - start).to_pandas()
+
+    def read_json(self, name, default=None):
+        json_path = os.path.join(self.path, f"{name}.json")
+        if not os.path.isfile(json_path):
+            return default
+
+        with open(json_path) as f:
+            return json.load(f)
+
+    def iter_chunks(self, chunksize, columns=None):
+        # yields DataFrames of at most chunksize rows, every call starts a new pass over the data
+        file_format = self.file_format
+        file_path = os.path.join(self.path, f"{self.name}.{file_format}")
+
+        if file_format == "csv":
+            yield from pd.read_csv(file_path, usecols=columns, chunksize=chunksize)
+        elif file_format == "parquet":
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=columns):
+                yield batch.to_pandas()
+        else:
+            with pa.ipc.open_file(file_path) as reader:
+                for batch_nr in range(reader.num_record_batches):
+                    batch = reader.get_batch(batch_nr)
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    for start in range(0, batch.num_rows, chunksize):
+                        yield batch.slice(start, chunksize).to_pandas()
+
+
+def common_dtypes(chunk_dtypes):
+    # dtypes that fit every chunk, given the dtypes of each chunk
+    # csv chunks can disagree on them:
+    #   int64 in one chunk, float64 in a chunk with missing values
+    #   text in one chunk, float64 in a chunk where the column is empty
+    dtypes = {}
+    for chunk_dtype in chunk_dtypes:
+        for column, dtype in chunk_dtype.items():
+            if column not in dtypes or dtypes[column] == dtype:
+                dtypes[column] = dtype
+            elif pd.api.types.is_numeric_dtype(dtypes[column]) and pd.api.types.is_numeric_dtype(dtype):
+                dtypes[column] = np.result_type(dtypes[column], dtype)
+            elif pd.api.types.is_numeric_dtype(dtypes[column]):
+                dtypes[column] = dtype
+
+    return dtypes
+
+
+def arrow_schema(df):
+    # columns without any value in df are stored as strings instead of the arrow null type
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for index, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(index, field.with_type(pa.string()))
+
+    return schema
@@ -0,0 +1,22 @@
+try:
+    from azureml.core import Run
+except ImportError:
+    # local runs, e.g. in the local runner, do not need the AzureML SDK
+    Run = None
+
+
+class LocalRun:
+    # Stand-in for the offline run context of the AzureML SDK when it is not installed.
+    # Same id prefix, so the steps and StepTelemetry take their offline paths. Metrics are not stored,
+    # like on the SDK's offline run, StepTelemetry keeps the phase timings in telemetry.jsonl.
+    id = 'OfflineRun_local'
+
+    def log(self, name, value, description=''):
+        pass
+
+
+def get_run_context():
+    # AzureML run of the step, an offline run outside of AzureML
+    if Run is None:
+        return LocalRun()
+    return Run.get_context()
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import platform
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not recorded there
+    resource = None
+
+
+# history of all runs of a step in its working directory, one json object per line
+TELEMETRY_FILE = 'telemetry.jsonl'
+
+# phase metrics logged to the AzureML run
+RUN_METRICS = ['wall_time_s', 'cpu_time_s', 'peak_rss_mb', 'rows', 'bytes_read', 'bytes_written']
+
+
+def peak_rss_mb():
+    # peak resident set size of the process so far
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(max_rss / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def cpu_time():
+    # user + system time of the process and its finished child processes, e.g. a process pool
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def io_counters():
+    # bytes read and written by the process, including mounted datasets, Linux only
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class StepTelemetry:
+    # Phase timings of a pipeline step:
+    #   with telemetry.phase('read') as phase:
+    #       df = step_input.read()
+    #       phase['rows'] = len(df)
+    # Every phase records wall time, CPU time, peak RSS at the end of the phase and bytes read/written.
+    # finish() logs the phases to the AzureML run, offline runs append them to telemetry.jsonl instead.
+
+    def __init__(self, run, step_name, run_datetime=None):
+        self.run = run
+        self.step_name = step_name
+        self.run_datetime = run_datetime
+        self.offline = run.id.startswith('OfflineRun')
+        self.phases = []
+        self.start = time.perf_counter()
+        self.cpu_start = cpu_time()
+
+    @contextmanager
+    def phase(self, name, rows=None):
+        record = {'phase': name, 'rows': rows}
+        read_start, written_start = io_counters()
+        wall_start, cpu_start = time.perf_counter(), cpu_time()
+        try:
+            yield record
+        finally:
+            read_end, written_end = io_counters()
+            record.update({
+                'wall_time_s': round(time.perf_counter() - wall_start, 4),
+                'cpu_time_s': round(cpu_time() - cpu_start, 4),
+                'peak_rss_mb': peak_rss_mb(),
+                'bytes_read': record.get('bytes_read', read_end - read_start if read_end is not None else None),
+                'bytes_written': record.get('bytes_written', written_end - written_start if written_end is not None else None)
+            })
+            self.phases.append(record)
+
+    def finish(self):
+        summary = {
+            'step': self.step_name,
+            'run_id': self.run.id,
+            'run_datetime': self.run_datetime,
+            'finished': str(datetime.now()),
+            'wall_time_s': round(time.perf_counter() - self.start, 4),
+            'cpu_time_s': round(cpu_time() - self.cpu_start, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': self.phases
+        }
+
+        for record in self.phases:
+            print(f"[{datetime.now()}] {self.step_name}.{record['phase']}: {record['wall_time_s']:.3f}s wall, "
+                  f"{record['cpu_time_s']:.3f}s cpu, peak rss {record['peak_rss_mb']} MB, rows {record['rows']}, "
+                  f"read {record['bytes_read']} B, written {record['bytes_written']} B")
+
+        if self.offline:
+            with open(TELEMETRY_FILE, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        else:
+            for record in self.phases:
+                for metric in RUN_METRICS:
+                    if record[metric] is not None:
+                        self.run.log(f"{record['phase']}.{metric}", record[metric])
+            self.run.log('wall_time_s', summary['wall_time_s'])
+            self.run.log('peak_rss_mb', summary['peak_rss_mb'])
+
+        return summary
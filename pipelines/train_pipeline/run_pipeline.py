@@ -1,7 +1,27 @@
+import argparse
+import json
+import sys
 import os
 
 path_to_pipeline_deployment = "pipelines/pipeline_deployment/pipeline_deployment.py"
 path_to_config = "pipelines/train_pipeline/pipeline_config.json"
 
+# the deployment runs in this process, no second interpreter start and workspace authentication
+sys.path.append(os.path.abspath(os.path.dirname(path_to_pipeline_deployment)))
+
 if __name__ == '__main__':
-    os.system(f"python {path_to_pipeline_deployment} --config_path {path_to_config}")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    # runs the same config with the local runner, an offline check of the config and the step scripts
+    parser.add_argument('--local', dest='local', action='store_true')
+    parser.add_argument('--work_dir', dest='work_dir', default='outputs/local_pipeline')
+    args = parser.parse_args()
+
+    with open(path_to_config) as f:
+        config = json.load(f)
+
+    if args.local:
+        from local_runner import main as run_locally
+        run_locally(config, args.work_dir, os.cpu_count(), use_cache=True)
+    else:
+        from pipeline_deployment import main as deploy_pipeline
+        deploy_pipeline(config)
@@ -0,0 +1,56 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "pipelines", "pipeline_deployment")))
+from compute_client import ComputeClient, get_compute_targets
+from fake_compute_client import InMemoryComputeClient
+
+
+COMPUTE_CONFIGS = {"cpu": {"cpu-cluster001": {"min": 0, "max": 2}, "cpu-unused": {"min": 0, "max": 1}},
+                   "gpu": {"gpu-cluster001": {"min": 0, "max": 1}}}
+
+
+def pipeline_config(*compute_names):
+    return {"PIPELINE_STEPS": [{"NAME": f"step{nr}", "COMPUTE": compute_name} for nr, compute_name in enumerate(compute_names)]}
+
+
+def test_fake_client_implements_the_interface():
+    assert isinstance(InMemoryComputeClient(), ComputeClient)
+
+
+def test_existing_target_is_not_created():
+    client = InMemoryComputeClient(existing=["cpu-cluster001"])
+
+    targets = get_compute_targets(client, pipeline_config("cpu-cluster001", "cpu-cluster001"), COMPUTE_CONFIGS)
+
+    assert list(targets) == ["cpu-cluster001"]
+    assert "create" not in client.calls
+
+
+def test_missing_targets_are_created_from_the_config():
+    client = InMemoryComputeClient(provisioning_s=0.01)
+
+    targets = get_compute_targets(client, pipeline_config("cpu-cluster001", "gpu-cluster001"), COMPUTE_CONFIGS)
+
+    assert targets["cpu-cluster001"]["vm_size"] == "STANDARD_DS3_V2"
+    assert (targets["cpu-cluster001"]["min_nodes"], targets["cpu-cluster001"]["max_nodes"]) == (0, 2)
+    assert targets["gpu-cluster001"]["vm_size"] == "STANDARD_NC6"
+    # clusters no step uses are left alone
+    assert "cpu-unused" not in client.targets
+    assert client.calls["create"] == 2
+
+
+def test_target_missing_from_the_config_fails():
+    client = InMemoryComputeClient(existing=["cpu-cluster001"])
+
+    with pytest.raises(RuntimeError, match="cpu-cluster999"):
+        get_compute_targets(client, pipeline_config("cpu-cluster001", "cpu-cluster999"), COMPUTE_CONFIGS)
+    assert "create" not in client.calls
+
+
+def test_failed_provisioning_fails():
+    client = InMemoryComputeClient(failures=["gpu-cluster001"])
+
+    with pytest.raises(RuntimeError, match="gpu-cluster001"):
+        get_compute_targets(client, pipeline_config("cpu-cluster001", "gpu-cluster001"), COMPUTE_CONFIGS)
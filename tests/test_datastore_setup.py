@@ -0,0 +1,92 @@
+import os
+import sys
+
+# datastore_config reads the environment at import time
+os.environ.setdefault("DTAP_ENVIRONMENT", "test")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "datastore_deployment")))
+from datastore_setup import main as datastore_setup
+from fake_datastore_client import InMemoryDatastoreClient
+
+
+DATASTORE_CONFIG = [
+    {
+        "DATASTORE_NAME": "test_blob",
+        "STORAGE_NAME": "teststorage",
+        "TYPE": "BLOB",
+        "CONTAINER": "data",
+        "AUTH": {"ACCOUNT_KEY_SECRET": "test-account-key"},
+        "DATASETS": {
+            "ds-raw": {"TYPE": "file", "PATH": "raw/**"},
+            "ds-features": {"TYPE": "tabular", "PATH": "features/features.parquet"}
+        }
+    },
+    {
+        "DATASTORE_NAME": "test_sql",
+        "TYPE": "SQL",
+        "AUTH": {"SERVER": "server", "DATABASE": "db", "USERNAME": "user", "PASSWORD_SECRET": "test-sql-password"},
+        "DATASETS": {
+            "ds-passengers": {"TYPE": "tabular", "QUERY": "SELECT * FROM passengers"}
+        }
+    }
+]
+
+
+def fake_client():
+    return InMemoryDatastoreClient(secrets={"test-account-key": "key", "test-sql-password": "password"})
+
+
+def register_calls(client):
+    return {method: count for method, count in client.calls.items() if method.startswith("register")}
+
+
+def run(client, mode, snapshot_path=None, snapshot_ttl_s=0):
+    return datastore_setup(client, DATASTORE_CONFIG, max_workers=4, mode=mode, snapshot_path=snapshot_path,
+                           snapshot_ttl_s=snapshot_ttl_s, workspace_key="in-memory")
+
+
+def test_plan_changes_nothing():
+    client = fake_client()
+
+    assert run(client, "plan") == []
+    assert register_calls(client) == {}
+    assert client.datastores == {} and client.datasets == {}
+
+
+def test_apply_creates_the_plan_and_a_second_apply_is_a_no_op():
+    client = fake_client()
+
+    results = run(client, "apply")
+    assert sorted((result["kind"], result["name"], result["status"]) for result in results) == [
+        ("dataset", "ds-features", "created"), ("dataset", "ds-passengers", "created"), ("dataset", "ds-raw", "created"),
+        ("datastore", "test_blob", "created"), ("datastore", "test_sql", "created")]
+    # the secrets of both datastores in one keyvault call
+    assert client.calls["get_secrets"] == 1
+
+    client.calls.clear()
+    assert run(client, "apply") == []
+    assert register_calls(client) == {}
+    assert client.calls.get("get_secrets", 0) == 0
+
+
+def test_second_apply_with_a_cached_snapshot_does_not_call_the_workspace(tmp_path):
+    client = fake_client()
+    snapshot_path = str(tmp_path / "snapshot.json")
+
+    run(client, "apply", snapshot_path, snapshot_ttl_s=900)
+    client.calls.clear()
+
+    assert run(client, "apply", snapshot_path, snapshot_ttl_s=900) == []
+    assert client.calls == {}
+
+
+def test_apply_only_creates_what_is_missing():
+    client = fake_client()
+    run(client, "apply")
+    del client.datasets["ds-raw"]
+    client.calls.clear()
+
+    results = run(client, "apply")
+
+    assert [(result["kind"], result["name"], result["status"]) for result in results
+            if result["kind"] == "dataset"] == [("dataset", "ds-raw", "created")]
+    assert register_calls(client) == {"register_dataset": 1}
@@ -0,0 +1,91 @@
+from azureml.core import Workspace
+from azureml.core.authentication import ServicePrincipalAuthentication, MsiAuthentication
+from typing import Optional, List, Tuple, Dict, Set, Any, Union
+from datetime import datetime
+import threading
+import json
+import os
+
+
+# Shared AzureML connection for all deployment entry points (pipeline, datastore and model deployment).
+# Within a process every entry point gets the same Workspace and auth objects, so tokens and the SDK
+# HTTP sessions are reused. Tokens are kept across processes by the SDK token cache.
+
+AUTH_MODES: List[str] = ["from_config", "interactive", "service_principal", "managed_identity"]
+
+_auth_cache: Dict[str, Any] = {}
+_workspace_cache: Dict[str, Workspace] = {}
+_lock = threading.RLock()
+
+
+def _read_config_file():
+    # same lookup as Workspace.from_config for the default file names, starting in the working directory
+    directory: str = os.getcwd()
+    while True:
+        for file_path in [os.path.join(directory, "config.json"), os.path.join(directory, ".azureml", "config.json")]:
+            if os.path.isfile(file_path):
+                with open(file_path) as f:
+                    return json.load(f)
+        if os.path.dirname(directory) == directory:
+            return None
+        directory = os.path.dirname(directory)
+
+
+def get_workspace_details(auth_mode):
+    # subscription, resource group and workspace name, known without connecting to the workspace
+    if auth_mode == "from_config":
+        config: Optional[Dict[str, str]] = _read_config_file()
+        if config is None:
+            return None
+        return {"subscription_id": config["subscription_id"], "resource_group": config["resource_group"],
+                "workspace_name": config["workspace_name"]}
+
+    return {"subscription_id": os.environ["SUBSCRIPTION_ID"], "resource_group": os.environ["RESOURCE_GROUP_NAME"],
+            "workspace_name": os.environ["WORKSPACE_NAME"]}
+
+
+def get_auth(auth_mode):
+    ## AUTHENTICATION
+    # one auth object per mode and process, its tokens are refreshed by the SDK when they expire
+    # from_config and interactive return None: the SDK default chain, which picks up Azure CLI or managed identity
+    # credentials (e.g. in CI) before it falls back to an interactive login
+    assert auth_mode in AUTH_MODES, f"unsupported auth mode '{auth_mode}', expected one of {AUTH_MODES}"
+    with _lock:
+        if auth_mode not in _auth_cache:
+            if auth_mode in ["from_config", "interactive"]:
+                _auth_cache[auth_mode] = None
+            elif auth_mode == "service_principal":
+                _auth_cache[auth_mode] = ServicePrincipalAuthentication(
+                    tenant_id=os.environ["TENANT_ID"],
+                    service_principal_id=os.environ["SP_CLIENT_ID"],
+                    service_principal_password=os.environ["SP_SECRET"])
+            elif auth_mode == "managed_identity":
+                # when running on Azure VM
+                _auth_cache[auth_mode] = MsiAuthentication()
+        return _auth_cache[auth_mode]
+
+
+def get_workspace(auth_mode="from_config"):
+    ## WORKSPACE
+    details: Optional[Dict[str, str]] = get_workspace_details(auth_mode)
+    if details is None:
+        # no config file found, let the SDK report it
+        return Workspace.from_config()
+
+    workspace_key: str = "/".join([auth_mode, details["subscription_id"], details["resource_group"], details["workspace_name"]])
+    with _lock:
+        if workspace_key in _workspace_cache:
+            return _workspace_cache[workspace_key]
+
+        ws: Workspace = Workspace.get(details["workspace_name"], auth=get_auth(auth_mode),
+                                      subscription_id=details["subscription_id"], resource_group=details["resource_group"])
+        print(f"[{datetime.now()}] Connected to workspace '{ws.name}' ({auth_mode}).")
+        _workspace_cache[workspace_key] = ws
+        return ws
+
+
+def get_scoring_uri(service_name, auth_mode="from_config"):
+    # scoring uri of a deployed webservice, looked up on every call: a redeployment can change it
+    from azureml.core.webservice import Webservice
+
+    return Webservice(get_workspace(auth_mode), service_name).scoring_uri